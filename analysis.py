@@ -0,0 +1,487 @@
+"""
+Earth Engine analysis pipeline for Vembanad Lake: cloud masking, compositing,
+water masking and the spectral index layers and statistics shown in the dashboard.
+
+Kept free of Streamlit calls so it can also run off the script thread.
+"""
+import calendar
+import datetime
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import ee
+from google.oauth2 import service_account
+
+from ee_cache import ee_cached
+from ee_executor import is_memory_limit_error
+from invalidation import CacheScope
+from metrics import in_current_stage
+from reductions import HISTOGRAM_BINS, HISTOGRAM_RANGES, grid_cells, merged_stats, partial_from_properties
+
+# Required Earth Engine OAuth scope for service account credentials
+EE_SCOPES = ["https://www.googleapis.com/auth/earthengine.readonly"]
+
+# Vembanad Lake study area (min lon, min lat, max lon, max lat)
+AOI_BOUNDS = [76.25, 9.9, 76.45, 10.1]
+
+# Scene-level cloud filter applied before compositing
+MAX_CLOUD_PERCENT = 20
+
+# Boundary windows end on: 'day' (midnight UTC), 'acquisition' (the day after the
+# last Sentinel-2 revisit) or 'month' (the first of the month)
+TIME_ANCHORS = ('day', 'acquisition', 'month')
+TIME_ANCHOR = os.environ.get('BACKWATER_TIME_ANCHOR', 'day')
+
+# Sentinel-2A/B revisit cycle over the lake and one of its acquisition dates; any
+# date on the cycle works as the origin
+S2_REVISIT_DAYS = 5
+S2_REVISIT_ORIGIN = datetime.date(2017, 3, 28)
+
+# Days Sentinel-2 scenes can take to reach the archive after acquisition; data
+# older than this before the anchor date is treated as settled
+SETTLING_DAYS = 7
+
+
+def connect_ee(service_account_info=None):
+    """Initializes Earth Engine with a service account, or local credentials if none is given."""
+    if service_account_info:
+        credentials = service_account.Credentials.from_service_account_info(
+            service_account_info, scopes=EE_SCOPES
+        )
+        ee.Initialize(credentials)
+    else:
+        ee.Initialize(project="backwater-guard")
+
+
+def anchor_date(today=None, anchor=None):
+    """
+    Exclusive end of the data windows: the last boundary of `anchor` (default
+    TIME_ANCHOR) that has closed by `today` (UTC). Windows, and so cache keys and
+    stored results, only change when a new boundary closes.
+    """
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    anchor = anchor or TIME_ANCHOR
+    if anchor == 'day':
+        return today
+    if anchor == 'acquisition':
+        # Acquisitions before today are complete; today's may still be arriving
+        cycles = (today - datetime.timedelta(days=1) - S2_REVISIT_ORIGIN).days // S2_REVISIT_DAYS
+        return S2_REVISIT_ORIGIN + datetime.timedelta(days=cycles * S2_REVISIT_DAYS + 1)
+    if anchor == 'month':
+        return today.replace(day=1)
+    raise ValueError(f"Unknown time anchor {anchor!r}; expected one of {', '.join(TIME_ANCHORS)}")
+
+
+def composite_window(months_back, today=None, anchor=None):
+    """
+    [start, end) window covering the `months_back` months before the anchor date
+    (see anchor_date), as ISO dates. Stable until the next boundary closes, so it
+    can key caches and stored results.
+    """
+    end = anchor_date(today, anchor)
+    year, month = divmod(end.year * 12 + end.month - 1 - months_back, 12)
+    day = min(end.day, calendar.monthrange(year, month + 1)[1])
+    start = datetime.date(year, month + 1, day)
+    return start.isoformat(), end.isoformat()
+
+
+def month_range(month, until=None):
+    """ISO [start, end) dates of calendar month 'YYYY-MM', ending no later than `until`."""
+    year, month_number = (int(part) for part in month.split('-'))
+    start = datetime.date(year, month_number, 1)
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    if until is not None:
+        end = min(end, datetime.date.fromisoformat(str(until)))
+    return start.isoformat(), end.isoformat()
+
+
+def _month_windows(months, until=None):
+    return ee.List([ee.List(list(month_range(month, until))) for month in months])
+
+
+def mask_s2_clouds(image):
+    """Cloud masking using Sentinel-2 QA60 band."""
+    qa = image.select('QA60')
+    cloud_bit_mask = 1 << 10
+    cirrus_bit_mask = 1 << 11
+    mask = qa.bitwiseAnd(cloud_bit_mask).eq(0).And(qa.bitwiseAnd(cirrus_bit_mask).eq(0))
+    scaled_optical = image.select('B.*').divide(10000)
+    return scaled_optical.updateMask(mask).copyProperties(image, ["system:time_start"])
+
+
+def composite_scope(aoi, months_back=3):
+    """Invalidation scope of a recent composite (the ee.Geometry AOI is left open)."""
+    return CacheScope(None, *composite_window(months_back))
+
+
+@ee_cached(maxsize=16, ttl=3600, namespace='composites', scope=composite_scope)
+def build_composite(aoi, months_back=3):
+    """
+    Builds the recent Sentinel-2 collection, its median composite and the water mask.
+    Nothing is sent to Earth Engine, so the result can feed concurrent requests.
+    """
+    start, end = composite_window(months_back)
+    collection = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
+        .filterDate(start, end) \
+        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', MAX_CLOUD_PERCENT)) \
+        .filterBounds(aoi) \
+        .map(mask_s2_clouds)
+    
+    latest_image = collection.median().clip(aoi)
+    
+    # NDWI water mask (McFeeters 1996)
+    ndwi = latest_image.normalizedDifference(['B3', 'B8']).rename('ndwi')
+    nir = latest_image.select('B8')
+    water_mask = ndwi.gt(0.1).And(nir.lt(0.15))
+    
+    return collection, latest_image, water_mask
+
+
+@ee_cached(maxsize=16, ttl=3600, namespace='composites', scope=composite_scope)
+def get_sentinel2_image(aoi, months_back=3):
+    """
+    Builds a median composite from recent Sentinel-2 imagery.
+    Uses NDWI for water detection with thresholds tuned for Vembanad Lake.
+    """
+    collection, latest_image, water_mask = build_composite(aoi, months_back)
+    
+    collection_size = collection.size().getInfo()
+    if collection_size == 0:
+        return None, None, collection_size
+    
+    return latest_image, water_mask, collection_size
+
+
+@ee_cached(maxsize=32, namespace='layers')
+def get_chlorophyll_map(image, water_mask):
+    """
+    Chlorophyll proxy using NDCI (Normalized Difference Chlorophyll Index).
+    
+    Method: NDCI = (B5 - B4) / (B5 + B4)
+    Reference: Mishra & Mishra (2012)
+    
+    Note: This is a relative index, NOT chlorophyll-a concentration (mg/L).
+    Higher values indicate greater algal biomass.
+    """
+    ndci = image.normalizedDifference(['B5', 'B4']).rename('ndci')
+    
+    # Classification into relative categories
+    classified_image = (
+        ndci.where(ndci.lte(0.0), 1)    # Very Low
+        .where(ndci.gt(0.0).And(ndci.lte(0.1)), 2)   # Low
+        .where(ndci.gt(0.1).And(ndci.lte(0.2)), 3)   # Moderate
+        .where(ndci.gt(0.2), 4)         # High
+    )
+    return classified_image.updateMask(water_mask), ndci.updateMask(water_mask)
+
+
+@ee_cached(maxsize=32, namespace='layers')
+def get_turbidity_map(image, water_mask, threshold):
+    """
+    Turbidity proxy using red band reflectance.
+    
+    Method: Higher red band reflectance correlates with suspended particles.
+    This identifies the top 15% most turbid areas as hotspots.
+    
+    Note: Values are unitless reflectance, NOT NTU (Nephelometric Turbidity Units).
+    Requires local calibration for quantitative interpretation.
+    
+    `threshold` is the 85th percentile of red reflectance over water
+    ('turbidity_p85' from calculate_water_quality_stats); None yields an empty layer.
+    """
+    # Using red band as turbidity indicator (simplified Nechad approach)
+    red_band = image.select('B4').rename('turbidity')
+    turbidity_on_water = red_band.updateMask(water_mask)
+    
+    # Top 15% as hotspots, thresholded at the fused reduction's 85th percentile
+    if threshold is None:
+        hotspots = ee.Image(0).selfMask()
+    else:
+        hotspots = turbidity_on_water.gte(threshold).selfMask()
+    
+    return hotspots, turbidity_on_water
+
+
+@ee_cached(maxsize=32, namespace='layers')
+def get_floating_matter_map(image, water_mask, threshold):
+    """
+    NIR anomaly detection over water surfaces.
+    
+    Method: Clean water absorbs NIR; high NIR indicates surface anomalies.
+    This identifies the top 5% highest NIR areas.
+    
+    CAUTION: High NIR can indicate multiple phenomena:
+    - Algal scum or surface mats
+    - Very shallow water (bottom reflectance)
+    - Suspended organic matter
+    - Sun glint artifacts
+    
+    Cannot distinguish between these without additional analysis.
+    Use as flagging tool for field investigation, not direct classification.
+    
+    `threshold` is the 95th percentile of NIR reflectance over water
+    ('nir_p95' from calculate_water_quality_stats); None yields an empty layer.
+    """
+    nir_band = image.select('B8')
+    nir_on_water = nir_band.updateMask(water_mask)
+    
+    # Top 5% as anomalies, thresholded at the fused reduction's 95th percentile
+    if threshold is None:
+        anomalies = ee.Image(0).selfMask()
+    else:
+        anomalies = nir_on_water.gte(threshold).selfMask()
+    
+    return anomalies, nir_on_water
+
+
+@ee_cached(maxsize=32, namespace='stats', shared=True)
+def calculate_water_quality_stats(image, water_mask, aoi):
+    """
+    Calculate comprehensive statistics for spectral indices in one fused reduction.
+    
+    Besides NDCI and turbidity mean/stdDev/min/max, the same pass returns the hotspot
+    thresholds used by the map layers ('turbidity_p85' on B4, 'nir_p95' on B8) and
+    the number of valid water pixels ('water_pixels').
+    """
+    ndci = image.normalizedDifference(['B5', 'B4']).rename('ndci').updateMask(water_mask)
+    turbidity = image.select('B4').rename('turbidity').updateMask(water_mask)
+    nir = image.select('B8').rename('nir').updateMask(water_mask)
+    
+    stats = ndci.addBands(turbidity).addBands(nir).reduceRegion(
+        reducer=ee.Reducer.mean().combine(
+            ee.Reducer.stdDev(), '', True
+        ).combine(
+            ee.Reducer.minMax(), '', True
+        ).combine(
+            ee.Reducer.percentile([85, 95]), '', True
+        ).combine(
+            ee.Reducer.count(), '', True
+        ),
+        geometry=aoi,
+        scale=30,
+        maxPixels=1e9
+    ).getInfo()
+    stats['water_pixels'] = stats.get('nir_count')
+    
+    return stats
+
+
+# Lake-wide statistics over AOIs spanning more than this many grid cells are reduced
+# cell by cell ('auto'); BACKWATER_REDUCTION forces 'single' or 'tiled'
+REDUCTION_MODE = os.environ.get('BACKWATER_REDUCTION', 'auto')
+REDUCTION_CELL_DEGREES = 0.1
+MAX_SINGLE_REDUCTION_CELLS = 4
+REDUCTION_WORKERS = 4
+# tileScale of successive attempts at one cell; a larger scale trades speed for memory
+REDUCTION_TILE_SCALES = (1, 4, 16)
+
+
+def use_tiled_reduction(bounds):
+    if REDUCTION_MODE == 'auto':
+        return len(grid_cells(bounds, REDUCTION_CELL_DEGREES)) > MAX_SINGLE_REDUCTION_CELLS
+    return REDUCTION_MODE == 'tiled'
+
+
+def reduce_stats_cell(bands, cell):
+    """
+    Mergeable reducer output (see reductions.py) of `bands` over one grid cell,
+    retried with a larger tileScale when it runs out of memory or time; other
+    errors propagate at once.
+    """
+    reducer = ee.Reducer.mean().combine(
+        ee.Reducer.stdDev(), '', True
+    ).combine(
+        ee.Reducer.minMax(), '', True
+    ).combine(
+        ee.Reducer.count(), '', True
+    ).unweighted()
+    for attempt, tile_scale in enumerate(REDUCTION_TILE_SCALES):
+        region = dict(geometry=ee.Geometry.Rectangle(list(cell)), scale=30, maxPixels=1e9, tileScale=tile_scale)
+        stats = ee.Dictionary(bands.reduceRegion(reducer=reducer, **region))
+        # One histogram per band, as their ranges differ; a single-output reduction
+        # is keyed by the band name alone
+        for band, (low, high) in HISTOGRAM_RANGES.items():
+            histogram = ee.Dictionary(bands.select([band]).reduceRegion(
+                reducer=ee.Reducer.fixedHistogram(low, high, HISTOGRAM_BINS).unweighted(), **region
+            ))
+            stats = stats.combine(histogram.rename([band], [f'{band}_histogram']))
+        try:
+            return stats.getInfo()
+        except ee.EEException as e:
+            if not is_memory_limit_error(e) or attempt == len(REDUCTION_TILE_SCALES) - 1:
+                raise
+
+
+@ee_cached(maxsize=16, namespace='stats', shared=True)
+def tiled_water_quality_stats(image, water_mask, bounds):
+    """
+    calculate_water_quality_stats for large AOIs: the AOI is split into grid cells
+    of REDUCTION_CELL_DEGREES, reduced in parallel (each cell retried on its own)
+    and the partial results merged exactly, with histogram-based percentiles.
+    """
+    ndci = image.normalizedDifference(['B5', 'B4']).rename('ndci').updateMask(water_mask)
+    turbidity = image.select('B4').rename('turbidity').updateMask(water_mask)
+    nir = image.select('B8').rename('nir').updateMask(water_mask)
+    bands = ndci.addBands(turbidity).addBands(nir)
+    
+    cells = grid_cells(bounds, REDUCTION_CELL_DEGREES)
+    with ThreadPoolExecutor(max_workers=REDUCTION_WORKERS) as pool:
+        results = list(pool.map(in_current_stage(lambda cell: reduce_stats_cell(bands, cell)), cells))
+    stats = merged_stats({
+        band: [partial_from_properties(band, properties) for properties in results]
+        for band in HISTOGRAM_RANGES
+    })
+    stats['water_pixels'] = stats.get('nir_count')
+    
+    return stats
+
+
+# Per-month statistics of each index: mean, standard deviation and valid pixel count
+MONTHLY_REDUCER_OUTPUTS = {'mean': 'mean', 'std': 'stdDev', 'pixel_count': 'count'}
+
+
+def monthly_reducer():
+    return ee.Reducer.mean().combine(
+        ee.Reducer.stdDev(), '', True
+    ).combine(
+        ee.Reducer.count(), '', True
+    )
+
+
+def monthly_indices(image):
+    """NDCI and turbidity bands of a monthly composite, masked to water."""
+    ndwi = image.normalizedDifference(['B3', 'B8'])
+    nir = image.select('B8')
+    water_mask = ndwi.gt(0.1).And(nir.lt(0.15))
+    
+    return image.normalizedDifference(['B5', 'B4']).rename('ndci') \
+        .addBands(image.select('B4').rename('turbidity')) \
+        .updateMask(water_mask)
+
+
+def _index_stats(properties):
+    """{'ndci': {'mean', 'std', 'pixel_count'}, 'turbidity': {...}} from reducer output properties."""
+    return {
+        index: {stat: properties.get(f'{index}_{output}') for stat, output in MONTHLY_REDUCER_OUTPUTS.items()}
+        for index in ('ndci', 'turbidity')
+    }
+
+
+def fetch_monthly_stats(aoi, months, until=None):
+    """
+    NDCI and turbidity statistics (mean, std, pixel count) for the given calendar
+    months, up to `until` (ISO date, exclusive), from one fused reduction per month
+    and a single request.
+    """
+    s2_collection = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED').filterBounds(aoi)
+    
+    def calculate_monthly_stats(window):
+        window = ee.List(window)
+        date = ee.Date(window.get(0))
+        image = s2_collection.filterDate(date, ee.Date(window.get(1))).map(mask_s2_clouds).median().clip(aoi)
+        
+        stats = monthly_indices(image).reduceRegion(
+            reducer=monthly_reducer(),
+            geometry=aoi, 
+            scale=30, 
+            maxPixels=1e9
+        )
+        return ee.Feature(None, stats).set('date', date.format('YYYY-MM'))
+    
+    data = _month_windows(months, until).map(calculate_monthly_stats).getInfo()
+    
+    return {f['properties']['date']: _index_stats(f['properties']) for f in data}
+
+
+# Earth Engine returns at most 5000 elements per getInfo()
+MAX_FEATURES_PER_REQUEST = 5000
+
+
+def fetch_monthly_site_stats(sites, site_count, months, until=None):
+    """
+    NDCI and turbidity statistics (mean, std, pixel count) of every site for the
+    given calendar months, up to `until` (ISO date, exclusive).
+
+    `sites` is an ee.FeatureCollection of `site_count` features with a 'site' name
+    property. Each month gets one composite over the sites' bounding box and a single
+    reduceRegions over all sites, so cost grows with the number of months, not months
+    times sites. Months are paged so no request returns more than
+    MAX_FEATURES_PER_REQUEST features. Returns {site: {month: {index: {stat: value}}}}.
+    """
+    region = sites.geometry().bounds()
+    s2_collection = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED').filterBounds(region)
+    
+    def reduce_month(window):
+        window = ee.List(window)
+        date = ee.Date(window.get(0))
+        image = s2_collection.filterDate(date, ee.Date(window.get(1))).map(mask_s2_clouds).median().clip(region)
+        
+        label = date.format('YYYY-MM')
+        reduced = monthly_indices(image).reduceRegions(collection=sites, reducer=monthly_reducer(), scale=30)
+        return reduced.map(lambda f: ee.Feature(None, f.toDictionary()).set('month', label))
+    
+    months_per_request = max(1, MAX_FEATURES_PER_REQUEST // max(site_count, 1))
+    
+    results = {}
+    for i in range(0, len(months), months_per_request):
+        windows = _month_windows(months[i:i + months_per_request], until)
+        data = ee.FeatureCollection(windows.map(reduce_month)).flatten().getInfo()['features']
+        for f in data:
+            properties = f['properties']
+            results.setdefault(properties['site'], {})[properties['month']] = _index_stats(properties)
+    return results
+
+
+# Acquisitions per getInfo() when extracting per-scene statistics
+SCENE_PAGE_SIZE = 100
+
+
+def scene_collection(aoi, start, end):
+    """
+    The acquisitions over `aoi` in [start, end) (ISO dates) passing the same
+    CLOUDY_PIXEL_PERCENTAGE rule as the composites, sorted by time.
+    """
+    return ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
+        .filterBounds(aoi) \
+        .filterDate(start, end) \
+        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', MAX_CLOUD_PERCENT)) \
+        .sort('system:time_start')
+
+
+def scene_stats_collection(aoi, start, end):
+    """
+    scene_collection(aoi, start, end) and a FeatureCollection of one null-geometry
+    feature per acquisition with its date, NDCI and turbidity means over clear
+    water and the AOI's clear water and total pixel counts.
+    """
+    collection = scene_collection(aoi, start, end)
+    total = ee.Image.constant(1).rename('total')
+    
+    def reduce_scene(image):
+        stats = monthly_indices(mask_s2_clouds(image)).addBands(total).reduceRegion(
+            reducer=ee.Reducer.mean().combine(ee.Reducer.count(), '', True),
+            geometry=aoi,
+            scale=30,
+            maxPixels=1e9
+        )
+        return ee.Feature(None, {
+            'date': image.date().format('YYYY-MM-dd'),
+            'ndci': stats.get('ndci_mean'),
+            'turbidity': stats.get('turbidity_mean'),
+            'valid_pixels': stats.get('ndci_count'),
+            'total_pixels': stats.get('total_count')
+        })
+    
+    return collection, collection.map(reduce_scene)
+
+
+def fetch_scene_stats(aoi, start, end, page_size=SCENE_PAGE_SIZE):
+    """
+    Per-acquisition statistics (see scene_stats_collection) in pages of `page_size`
+    rows, one request each, so no single response grows with the period.
+    """
+    collection, features = scene_stats_collection(aoi, start, end)
+    size = collection.size().getInfo()
+    for offset in range(0, size, page_size):
+        page = features.toList(page_size, offset).getInfo()
+        yield [f['properties'] for f in page]
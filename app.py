@@ -1,14 +1,31 @@
-import ee
 import streamlit as st
 import geemap.foliumap as geemap
+import folium
 import datetime
 import pandas as pd
-import plotly.graph_objects as go
 import plotly.express as px
-from plotly.subplots import make_subplots
-import numpy as np
 import json
-from google.oauth2 import service_account
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from analysis import AOI_BOUNDS, TIME_ANCHOR, composite_window
+from backends import (
+    LAYER_VIS_PARAMS, TimeSeriesStream, create_backend, get_trend_map, index_means,
+    invalidate_results, scene_index_frame, stored_composite_stats, stored_scene_count,
+    stored_scene_series, stored_site_time_series
+)
+from charts import (
+    NDCI_ELEVATED, NDCI_HIGH, TURBIDITY_ELEVATED, TURBIDITY_HIGH, cached_trend_figure
+)
+from ee_cache import MEMORY_BUDGET_BYTES, cache_stats
+from ee_executor import EERequestExecutor
+from invalidation import NAMESPACES, Invalidation
+from metrics import RerunMetrics, start_metrics_server
+from sites import parse_sites
+from storage import time_series_parquet
+from tiles import TILE_PROXY_PORT, start_tile_proxy
 
 # -----------------------------------------------------------------------------
 # 1. App Setup and Configuration
@@ -21,9 +38,46 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+def get_service_account_info():
+    """
+    Earth Engine service account from Streamlit secrets, or None for local auth. The
+    offline backend reads no secrets, and a missing secrets.toml is checked for
+    quietly, as indexing st.secrets without one renders an error.
+    """
+    if os.environ.get('BACKWATER_BACKEND', 'ee') == 'local' or not st.secrets.load_if_toml_exists():
+        return None
+    if "gcp_service_account" in st.secrets:
+        return dict(st.secrets["gcp_service_account"])
+    return None
+
+@st.cache_resource
+def get_backend(local_raster=False):
+    """
+    Process-wide data backend, chosen by BACKWATER_BACKEND ('ee' by default, or
+    'local' for the offline fixture backend). `local_raster` selects the Earth Engine
+    composites processed with the local raster engine.
+    """
+    service_account_info = get_service_account_info()
+    backend = create_backend(service_account_info=service_account_info)
+    if local_raster and backend.name == 'ee':
+        backend = create_backend('ee-raster', service_account_info=service_account_info)
+    return backend
+
+@st.cache_resource
+def start_warmup():
+    """
+    Starts backend initialization and the default composite/stats fetch on a
+    background thread, once per process. Later sessions find the future already done.
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ee-warmup")
+    future = executor.submit(get_backend().warm_up)
+    executor.shutdown(wait=False)
+    return future
+
 # Initialize session state for loading animation
 if 'app_loaded' not in st.session_state:
     st.session_state.app_loaded = False
+    st.session_state.session_started = time.perf_counter()
 
 # Loading Animation
 if not st.session_state.app_loaded:
@@ -44,7 +98,6 @@ if not st.session_state.app_loaded:
             align-items: center;
             justify-content: center;
             z-index: 9999;
-            animation: fadeOut 0.5s ease-out 3s forwards;
         }
         
         .water-drop-container {
@@ -187,13 +240,6 @@ if not st.session_state.app_loaded:
             0%, 100% { opacity: 1; }
             50% { opacity: 0.5; }
         }
-        
-        @keyframes fadeOut {
-            to {
-                opacity: 0;
-                visibility: hidden;
-            }
-        }
     </style>
     
     <div class="splash-container">
@@ -210,16 +256,11 @@ if not st.session_state.app_loaded:
         </div>
         <div class="loading-text">INITIALIZING SATELLITE DATA...</div>
     </div>
-    
-    <script>
-        setTimeout(function() {
-            window.parent.postMessage({type: 'streamlit:setComponentValue', value: true}, '*');
-        }, 3500);
-    </script>
     """, unsafe_allow_html=True)
     
-    import time
-    time.sleep(3.5)
+    # Keep the splash up only while Earth Engine and the default composite warm up;
+    # initialize_ee() below reports initialization errors, the sidebar fetch errors.
+    start_warmup().exception()
     st.session_state.app_loaded = True
     st.rerun()
 
@@ -282,28 +323,15 @@ to identify areas that may need detailed field investigation.
 
 @st.cache_resource
 def initialize_ee():
-    """Initializes Google Earth Engine using service account credentials."""
+    """Waits for the background backend initialization and reports its outcome."""
     try:
-        if "gcp_service_account" in st.secrets:
-            creds_dict = dict(st.secrets["gcp_service_account"])
-
-            # ✅ Define required Earth Engine OAuth scope
-            SCOPES = ["https://www.googleapis.com/auth/earthengine.readonly"]
-
-            # Build credentials with explicit scope
-            credentials = service_account.Credentials.from_service_account_info(
-                creds_dict, scopes=SCOPES
-            )
-
-            ee.Initialize(credentials)
-
-        else:
+        start_warmup().result()
+        if get_backend().name == 'ee' and get_service_account_info() is None:
             st.warning("⚠️ No service account found, using local auth fallback...")
-            ee.Initialize(project="backwater-guard")
-
         return True
 
     except Exception as e:
+        logging.getLogger(__name__).error("Backend initialization failed", exc_info=True)
         st.error(f"❌ Earth Engine initialization failed: {e}")
         st.info("""
         For local testing:
@@ -318,223 +346,75 @@ def initialize_ee():
 
 # --- Main execution block ---
 
-ee_initialized = initialize_ee()
+# Wall time, backend requests and cache lookups of each stage of this rerun
+rerun_metrics = RerunMetrics()
+
+with rerun_metrics.stage('ee_init'):
+    ee_initialized = initialize_ee()
 
 if not ee_initialized:
     st.stop()
 
-# Safe to define AOI after initialization
-AOI = ee.Geometry.Rectangle([76.25, 9.9, 76.45, 10.1])
-
-# -----------------------------------------------------------------------------
-# 3. Enhanced Analysis Functions
-# -----------------------------------------------------------------------------
-
-def mask_s2_clouds(image):
-    """Cloud masking using Sentinel-2 QA60 band."""
-    qa = image.select('QA60')
-    cloud_bit_mask = 1 << 10
-    cirrus_bit_mask = 1 << 11
-    mask = qa.bitwiseAnd(cloud_bit_mask).eq(0).And(qa.bitwiseAnd(cirrus_bit_mask).eq(0))
-    scaled_optical = image.select('B.*').divide(10000)
-    return scaled_optical.updateMask(mask).copyProperties(image, ["system:time_start"])
+@st.cache_resource
+def get_request_executor():
+    """Process-wide bounded pool for independent Earth Engine requests."""
+    return EERequestExecutor(max_workers=4)
 
-@st.cache_data(ttl=3600)
-def get_sentinel2_image(_aoi, months_back=3):
+@st.cache_resource
+def start_metrics_endpoint():
     """
-    Builds a median composite from recent Sentinel-2 imagery.
-    Uses NDWI for water detection with thresholds tuned for Vembanad Lake.
+    Prometheus text metrics on http://127.0.0.1:<BACKWATER_METRICS_PORT>/metrics,
+    once per process; off unless the port is set.
     """
-    now = datetime.datetime.now(datetime.timezone.utc)
-    collection = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
-        .filterDate(ee.Date(now).advance(-months_back, 'month'), ee.Date(now)) \
-        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20)) \
-        .filterBounds(_aoi) \
-        .map(mask_s2_clouds)
-    
-    collection_size = collection.size().getInfo()
-    if collection_size == 0:
-        return None, None, collection_size
-    
-    latest_image = collection.median().clip(_aoi)
-    
-    # NDWI water mask (McFeeters 1996)
-    ndwi = latest_image.normalizedDifference(['B3', 'B8']).rename('ndwi')
-    nir = latest_image.select('B8')
-    water_mask = ndwi.gt(0.1).And(nir.lt(0.15))
-    
-    return latest_image, water_mask, collection_size
+    port = int(os.environ.get("BACKWATER_METRICS_PORT") or 0)
+    return start_metrics_server(port) if port else None
 
-@st.cache_data
-def get_chlorophyll_map(_image, _water_mask):
-    """
-    Chlorophyll proxy using NDCI (Normalized Difference Chlorophyll Index).
-    
-    Method: NDCI = (B5 - B4) / (B5 + B4)
-    Reference: Mishra & Mishra (2012)
-    
-    Note: This is a relative index, NOT chlorophyll-a concentration (mg/L).
-    Higher values indicate greater algal biomass.
-    """
-    ndci = _image.normalizedDifference(['B5', 'B4']).rename('ndci')
-    
-    # Classification into relative categories
-    classified_image = (
-        ndci.where(ndci.lte(0.0), 1)    # Very Low
-        .where(ndci.gt(0.0).And(ndci.lte(0.1)), 2)   # Low
-        .where(ndci.gt(0.1).And(ndci.lte(0.2)), 3)   # Moderate
-        .where(ndci.gt(0.2), 4)         # High
-    )
-    return classified_image.updateMask(_water_mask), ndci.updateMask(_water_mask)
+start_metrics_endpoint()
 
-@st.cache_data
-def get_turbidity_map(_image, _water_mask):
+@st.cache_resource
+def start_tile_endpoint():
     """
-    Turbidity proxy using red band reflectance.
-    
-    Method: Higher red band reflectance correlates with suspended particles.
-    This identifies the top 15% most turbid areas as hotspots.
-    
-    Note: Values are unitless reflectance, NOT NTU (Nephelometric Turbidity Units).
-    Requires local calibration for quantitative interpretation.
+    Local tile proxy for Earth Engine layers on BACKWATER_TILE_PORT (off unless set),
+    once per process.
     """
-    # Using red band as turbidity indicator (simplified Nechad approach)
-    red_band = _image.select('B4').rename('turbidity')
-    turbidity_on_water = red_band.updateMask(_water_mask)
-    
-    # Identify top 15% as hotspots
-    percentile = turbidity_on_water.reduceRegion(
-        reducer=ee.Reducer.percentile([85]), 
-        geometry=AOI, 
-        scale=30, 
-        maxPixels=1e9
-    ).get('turbidity')
-    
-    hotspots = ee.Image(ee.Algorithms.If(
-        percentile, 
-        turbidity_on_water.gte(ee.Number(percentile)).selfMask(), 
-        ee.Image(0).selfMask()
-    ))
-    
-    return hotspots, turbidity_on_water
+    return start_tile_proxy() if TILE_PROXY_PORT else None
 
-@st.cache_data
-def get_floating_matter_map(_image, _water_mask):
-    """
-    NIR anomaly detection over water surfaces.
-    
-    Method: Clean water absorbs NIR; high NIR indicates surface anomalies.
-    This identifies the top 5% highest NIR areas.
-    
-    CAUTION: High NIR can indicate multiple phenomena:
-    - Algal scum or surface mats
-    - Very shallow water (bottom reflectance)
-    - Suspended organic matter
-    - Sun glint artifacts
-    
-    Cannot distinguish between these without additional analysis.
-    Use as flagging tool for field investigation, not direct classification.
-    """
-    nir_band = _image.select('B8')
-    nir_on_water = nir_band.updateMask(_water_mask)
-    
-    # Identify top 5% as anomalies
-    percentile = nir_on_water.reduceRegion(
-        reducer=ee.Reducer.percentile([95]), 
-        geometry=AOI, 
-        scale=30, 
-        maxPixels=1e9
-    ).get('B8')
-    
-    anomalies = ee.Image(ee.Algorithms.If(
-        percentile, 
-        nir_on_water.gte(ee.Number(percentile)).selfMask(), 
-        ee.Image(0).selfMask()
-    ))
-    
-    return anomalies, nir_on_water
+start_tile_endpoint()
 
-@st.cache_data
-def calculate_water_quality_stats(_image, _water_mask, _aoi):
-    """Calculate comprehensive statistics for spectral indices."""
-    ndci = _image.normalizedDifference(['B5', 'B4']).rename('ndci').updateMask(_water_mask)
-    turbidity = _image.select('B4').rename('turbidity').updateMask(_water_mask)
-    
-    stats = ndci.addBands(turbidity).reduceRegion(
-        reducer=ee.Reducer.mean().combine(
-            ee.Reducer.stdDev(), '', True
-        ).combine(
-            ee.Reducer.minMax(), '', True
-        ),
-        geometry=_aoi,
-        scale=30,
-        maxPixels=1e9
-    ).getInfo()
-    
-    return stats
+# -----------------------------------------------------------------------------
+# 3. Enhanced Analysis Functions
+# -----------------------------------------------------------------------------
 
-@st.cache_data
-def create_time_series(_bounds_key, _aoi, years=2):
-    """Generate monthly time series of water quality indices."""
-    start_date = ee.Date(datetime.datetime.now(datetime.timezone.utc)).advance(-years, 'year')
-    end_date = ee.Date(datetime.datetime.now(datetime.timezone.utc))
-    s2_collection = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED').filterBounds(_aoi)
-    
-    def calculate_monthly_mean(date):
-        date = ee.Date(date)
-        image = s2_collection.filterDate(date, date.advance(1, 'month')).map(mask_s2_clouds).median().clip(_aoi)
-        
-        ndwi = image.normalizedDifference(['B3', 'B8'])
-        nir = image.select('B8')
-        water_mask = ndwi.gt(0.1).And(nir.lt(0.15))
-        
-        ndci = image.normalizedDifference(['B5', 'B4']).updateMask(water_mask)
-        turbidity = image.select('B4').rename('turbidity').updateMask(water_mask)
-        
-        mean_ndci = ndci.reduceRegion(
-            reducer=ee.Reducer.mean(), 
-            geometry=_aoi, 
-            scale=30, 
-            maxPixels=1e9
-        ).get('nd')
-        
-        mean_turb = turbidity.reduceRegion(
-            reducer=ee.Reducer.mean(), 
-            geometry=_aoi, 
-            scale=30, 
-            maxPixels=1e9
-        ).get('turbidity')
-        
-        return ee.Feature(None, {
-            'date': date.format('YYYY-MM'),
-            'mean_ndci': mean_ndci,
-            'mean_turbidity': mean_turb
-        })
-    
-    months = ee.List.sequence(0, end_date.difference(start_date, 'month').subtract(1)).map(
-        lambda m: start_date.advance(m, 'month')
-    )
-    monthly_data = months.map(calculate_monthly_mean)
-    data = monthly_data.getInfo()
-    
-    df = pd.DataFrame([{
-        'Month': f['properties']['date'],
-        'Chlorophyll Index': f['properties'].get('mean_ndci'),
-        'Turbidity': f['properties'].get('mean_turbidity')
-    } for f in data]).set_index('Month')
-    
-    return df
+# The analysis pipeline lives in analysis.py (Earth Engine) behind the data backends
+# in backends.py, so it can run off the script thread and offline.
 
 # Visualization parameters
-chl_viz_params = {'min': 1, 'max': 4, 'palette': ['#3498db', '#2ecc71', '#f39c12', '#e74c3c']}
-turbidity_viz_params = {'palette': ['#c0392b']}
-floating_viz_params = {'palette': ['#8e44ad']}
+chl_viz_params = LAYER_VIS_PARAMS['chlorophyll']
+turbidity_viz_params = LAYER_VIS_PARAMS['turbidity']
+floating_viz_params = LAYER_VIS_PARAMS['nir']
+
+# Per-pixel trend layers and the index each one fits
+TREND_LAYERS = {'Chlorophyll Trend': 'ndci', 'Turbidity Trend': 'turbidity'}
+# Seconds a rerun waits for a trend map before drawing the map without it, and the
+# timeout of the request, which may first download years of scenes into the time cube
+TREND_MAP_WAIT = 15
+TREND_MAP_TIMEOUT = 3600
+
+@st.cache_resource
+def get_trend_executor():
+    """
+    Process-wide single worker for trend maps, so time cube builds queue behind each
+    other instead of holding the request executor's workers.
+    """
+    return EERequestExecutor(max_workers=1, timeout=TREND_MAP_TIMEOUT)
 
-# Reference thresholds (for relative comparison, not regulatory limits)
-NDCI_ELEVATED = 0.15  # Elevated algal activity
-NDCI_HIGH = 0.25      # High algal activity
-TURBIDITY_ELEVATED = 0.05  # Elevated turbidity (reflectance units)
-TURBIDITY_HIGH = 0.08      # High turbidity (reflectance units)
+@st.cache_resource
+def trend_map_requests():
+    """Trend map futures by (backend, AOI, index, years), shared by all sessions."""
+    return {}
+TREND_METHOD_LABELS = {'ols': "least-squares fit", 'sen': "Sen's slope"}
+
+# Reference thresholds (NDCI_*, TURBIDITY_*) are defined with the trend chart in charts.py
 
 # -----------------------------------------------------------------------------
 # 4. Enhanced Dashboard Layout
@@ -544,6 +424,11 @@ TURBIDITY_HIGH = 0.08      # High turbidity (reflectance units)
 with st.sidebar:
     st.markdown("### Control Panel")
     
+    warmup_error = start_warmup().result().get('error')
+    if warmup_error:
+        st.warning(f"Pre-fetching the default composite failed ({warmup_error}); "
+                   "it is retried with the first request.")
+    
     with st.expander("⚙️ Data Settings", expanded=True):
         composite_months = st.slider(
             "Composite Time Window (months)", 
@@ -551,13 +436,23 @@ with st.sidebar:
             help="Longer windows provide more cloud-free data but less temporal specificity"
         )
         analysis_years = st.slider("Trend Analysis Period (years)", 1, 5, 2)
+        per_scene_trend = st.toggle(
+            "Per-scene trend", False,
+            help="Plot every cloud-filtered acquisition instead of monthly composites; "
+                 "shows short events that monthly means smooth out"
+        )
+        use_local_engine = st.toggle(
+            "Local raster engine", False,
+            help="Download the composite bands once and compute layers and statistics locally; "
+                 "layer and opacity changes then need no Earth Engine requests"
+        )
     
     st.markdown("---")
     
     st.markdown("### 🗺️ Layer Selection")
     map_selection = st.radio(
         "Choose visualization:",
-        ('Chlorophyll Proxy', 'Turbidity Hotspots', 'NIR Anomalies', 'Multi-layer'),
+        ('Chlorophyll Proxy', 'Turbidity Hotspots', 'NIR Anomalies', 'Multi-layer') + tuple(TREND_LAYERS),
         label_visibility="collapsed"
     )
     
@@ -575,29 +470,114 @@ with st.sidebar:
         max_lon = st.number_input("Max Lon", 76.0, 77.0, 76.270, 0.01, format="%.4f")
         max_lat = st.number_input("Max Lat", 9.0, 11.0, 9.915, 0.01, format="%.4f")
     
-    HOTSPOT_AOI = ee.Geometry.Rectangle([min_lon, min_lat, max_lon, max_lat])
+    HOTSPOT_BOUNDS = (min_lon, min_lat, max_lon, max_lat)
     
-    if st.button("🔄 Refresh Data", use_container_width=True):
-        st.cache_data.clear()
+    sites_file = st.file_uploader(
+        "Compare sites (GeoJSON)", type=["geojson", "json"],
+        help="Points or polygons (stations, river mouths, sub-basins); named by their "
+             "'name', 'site' or 'station' property"
+    )
+    SITES = None
+    if sites_file is not None:
+        try:
+            SITES = parse_sites(sites_file.getvalue())
+            st.caption(f"{len(SITES)} sites loaded")
+        except ValueError as e:
+            st.error(f"Could not read sites: {e}")
+    
+    with st.expander("Refresh options"):
+        refresh_days = st.number_input(
+            "Results with imagery from the last N days", 1, 3650, 7,
+            help="Closed months already in the monthly store are never recomputed"
+        )
+        refresh_area_only = st.checkbox("Only results overlapping the analysis area", True)
+        refresh_namespaces = st.multiselect(
+            "Results", list(NAMESPACES), default=list(NAMESPACES), format_func=NAMESPACES.get
+        )
+    
+    if st.button("🔄 Refresh Data", use_container_width=True, disabled=not refresh_namespaces,
+                 help=None if refresh_namespaces else "Select at least one result type under Refresh options"):
+        invalidation = Invalidation(
+            refresh_namespaces, aoi=HOTSPOT_BOUNDS if refresh_area_only else None, days=refresh_days
+        )
+        cached, stored = invalidate_results(get_backend(use_local_engine), invalidation)
+        st.session_state['refresh_report'] = (invalidation.describe(), cached, stored)
         st.rerun()
     
+    if 'refresh_report' in st.session_state:
+        description, cached, stored = st.session_state.pop('refresh_report')
+        dropped = ', '.join(
+            f"{NAMESPACES.get(namespace, namespace)}: {cached.get(namespace, 0) + stored.get(namespace, 0)}"
+            for namespace in sorted(set(cached) | set(stored))
+        )
+        st.success(
+            f"Refreshed {description}: {sum(cached.values())} cached and {sum(stored.values())} "
+            f"stored results invalidated" + (f" ({dropped})." if dropped else ".")
+        )
+    
+    show_performance = st.toggle(
+        "Performance panel", False,
+        help="Per-stage wall time, backend requests, bytes and cache hits for each rerun"
+    )
+    
     st.markdown("---")
     st.caption("Data: ESA Sentinel-2 via Google Earth Engine")
 
+# Independent backend requests for this rerun are submitted together so their
+# round trips overlap: the composite scene count, its statistics and the trend series.
+# Each is read from the shared result store first (filled by precompute.py).
+backend = get_backend(use_local_engine)
+executor = get_request_executor()
+# The trend series is fetched in chunks of months, most recent first, and drawn as they
+# arrive; the per-scene series is extracted in pages and drawn once complete
+timeseries_stream = scene_future = None
+if per_scene_trend:
+    scene_future = executor.submit(
+        rerun_metrics.wrap('time_series', stored_scene_series), backend, HOTSPOT_BOUNDS, analysis_years
+    )
+else:
+    with rerun_metrics.stage('time_series'):
+        timeseries_stream = TimeSeriesStream(
+            backend, HOTSPOT_BOUNDS, analysis_years, executor,
+            fetch=rerun_metrics.wrap('time_series', backend.monthly_stats)
+        )
+count_future = executor.submit(
+    rerun_metrics.wrap('composite', stored_scene_count), backend, AOI_BOUNDS, composite_months
+)
+stats_future = executor.submit(
+    rerun_metrics.wrap('stats', stored_composite_stats), backend, AOI_BOUNDS, composite_months
+)
+# All uploaded sites share one composite and one reduction per month
+site_series_future = executor.submit(
+    rerun_metrics.wrap('site_series', stored_site_time_series), backend, SITES, analysis_years
+) if SITES else None
+# A trend map may first build the time cube, so reruns until it finishes pick up the
+# request already running instead of waiting on a new one
+trend_future = None
+if map_selection in TREND_LAYERS:
+    trend_key = (repr(backend), tuple(AOI_BOUNDS), TREND_LAYERS[map_selection], analysis_years)
+    trend_future = trend_map_requests().get(trend_key)
+    if trend_future is None or trend_future.done():
+        trend_future = trend_map_requests()[trend_key] = get_trend_executor().submit(
+            rerun_metrics.wrap('map', get_trend_map), backend, AOI_BOUNDS, TREND_LAYERS[map_selection],
+            analysis_years
+        )
+
 # Main Content Area
 tab1, tab2, tab3 = st.tabs(["🗺️ Interactive Map", "📊 Analytics Dashboard", "ℹ️ About & Methodology"])
 
 with tab1:
     # Load data
     with st.spinner("Fetching satellite imagery..."):
-        image, water_mask, img_count = get_sentinel2_image(AOI, composite_months)
+        img_count = executor.result(count_future)
     
-    if image is None:
+    if img_count == 0:
         st.error("No clear imagery available for the selected period. Try increasing the time window.")
         st.stop()
     
     # Calculate statistics
-    stats = calculate_water_quality_stats(image, water_mask, AOI)
+    with st.spinner("Calculating statistics..."):
+        stats = executor.result(stats_future)
     chl_mean = stats.get('ndci_mean')
     turb_mean = stats.get('turbidity_mean')
     
@@ -612,10 +592,12 @@ with tab1:
         )
     
     with col2:
+        window_start, window_end = composite_window(composite_months)
         st.metric(
             "Time Window", 
             f"{composite_months} months", 
-            help="Temporal range of composite imagery"
+            help=f"Temporal range of composite imagery: {window_start} up to {window_end}, "
+                 f"ending on the last closed {TIME_ANCHOR} boundary"
         )
     
     with col3:
@@ -685,6 +667,18 @@ with tab1:
         
         **Critical Limitation:** Cannot distinguish between these causes. Use as screening tool to prioritize field visits.
         """)
+    elif map_selection in TREND_LAYERS:
+        st.info(f"""
+        **{map_selection}:** Per-pixel trend over the last {analysis_years} years, fitted to monthly medians of every clear water acquisition.
+        
+        - 🔴 Red = increasing | 🔵 Blue = decreasing, in index units per year
+        - Solid colors are significant trends (p < 0.05); faint colors are not
+        
+        **Interpretation:** Shows *where* conditions are changing, e.g. worsening near river mouths or outfalls while the lake-wide mean is flat. 
+        Pixels need at least 6 months with clear water data; seasonal cycles average out best over several full years.
+        
+        **Limitation:** Trends of proxy indices, not of measured concentrations. Edge pixels mixing water and land can show spurious trends.
+        """)
     else:
         st.info("""
         **Multi-layer View:** Comprehensive assessment showing all three indicators simultaneously.
@@ -697,35 +691,75 @@ with tab1:
         Are turbidity hotspots near river inlets? Use this view to understand complex water quality patterns.
         """)
     
-    # Map Display
-    m = geemap.Map(center=[10.0, 76.35], zoom=11, height=650)
-    m.add_basemap("HYBRID")
-    
-    # Add layers based on selection
-    if map_selection == 'Chlorophyll Proxy':
-        chl_map, ndci_raw = get_chlorophyll_map(image, water_mask)
-        m.addLayer(chl_map, chl_viz_params, 'Chlorophyll Index (NDCI)', True, layer_opacity)
+    # Map Display (layers come from cached tile URLs or local overlays; opacity is client-side)
+    with rerun_metrics.stage('map'):
+        m = geemap.Map(center=[10.0, 76.35], zoom=11, height=650, ee_initialize=False)
+        m.add_basemap("HYBRID")
         
-    elif map_selection == 'Turbidity Hotspots':
-        turbidity_map, turb_raw = get_turbidity_map(image, water_mask)
-        m.addLayer(turbidity_map, turbidity_viz_params, 'Turbidity Hotspots', True, layer_opacity)
+        # Add layers based on selection
+        if map_selection == 'Chlorophyll Proxy':
+            backend.add_layer(m, AOI_BOUNDS, composite_months, 'chlorophyll', chl_viz_params,
+                              'Chlorophyll Index (NDCI)', layer_opacity, stats)
         
-    elif map_selection == 'NIR Anomalies':
-        floating_map, float_raw = get_floating_matter_map(image, water_mask)
-        m.addLayer(floating_map, floating_viz_params, 'NIR Anomalies', True, layer_opacity)
+        elif map_selection == 'Turbidity Hotspots':
+            backend.add_layer(m, AOI_BOUNDS, composite_months, 'turbidity', turbidity_viz_params,
+                              'Turbidity Hotspots', layer_opacity, stats)
         
-    else:  # Multi-layer
-        chl_map, _ = get_chlorophyll_map(image, water_mask)
-        turbidity_map, _ = get_turbidity_map(image, water_mask)
-        floating_map, _ = get_floating_matter_map(image, water_mask)
+        elif map_selection == 'NIR Anomalies':
+            backend.add_layer(m, AOI_BOUNDS, composite_months, 'nir', floating_viz_params,
+                              'NIR Anomalies', layer_opacity, stats)
         
-        m.addLayer(chl_map, chl_viz_params, 'Chlorophyll', True, layer_opacity * 0.8)
-        m.addLayer(turbidity_map, turbidity_viz_params, 'Turbidity', True, layer_opacity * 0.7)
-        m.addLayer(floating_map, floating_viz_params, 'NIR Anomalies', True, layer_opacity * 0.7)
-    
-    m.addLayer(HOTSPOT_AOI, {'color': 'FF0000', 'fillColor': 'FF000020'}, 'Analysis Area', True, 0.8)
-    
-    m.to_streamlit()
+        elif map_selection in TREND_LAYERS:
+            with st.spinner("Fitting per-pixel trends..."):
+                wait([trend_future], timeout=TREND_MAP_WAIT)
+            if trend_future.done():
+                trend_map = get_trend_executor().result(trend_future)
+                trend_map.overlay(f"{map_selection} ({analysis_years} years)", layer_opacity).add_to(m)
+            else:
+                trend_map = None
+                st.info(
+                    f"The time cube of {analysis_years} years of scenes is still being built in the background, "
+                    "which takes several minutes the first time. Rerun to show the trend layer once it is ready; "
+                    "`python precompute.py --trend-maps` builds the cubes ahead of time."
+                )
+        
+        else:  # Multi-layer
+            backend.add_layer(m, AOI_BOUNDS, composite_months, 'chlorophyll', chl_viz_params,
+                              'Chlorophyll', layer_opacity * 0.8, stats)
+            backend.add_layer(m, AOI_BOUNDS, composite_months, 'turbidity', turbidity_viz_params,
+                              'Turbidity', layer_opacity * 0.7, stats)
+            backend.add_layer(m, AOI_BOUNDS, composite_months, 'nir', floating_viz_params,
+                              'NIR Anomalies', layer_opacity * 0.7, stats)
+        
+        # Drawn client-side, so editing the analysis area does not request new tiles
+        folium.Rectangle(
+            bounds=[[min_lat, min_lon], [max_lat, max_lon]],
+            color='#FF0000', weight=2, opacity=0.8,
+            fill=True, fill_color='#FF0000', fill_opacity=0.125,
+            name='Analysis Area', tooltip='Analysis Area'
+        ).add_to(m)
+        
+        if SITES:
+            folium.GeoJson(
+                {'type': 'FeatureCollection', 'features': [
+                    {'type': 'Feature', 'geometry': site.geometry, 'properties': {'name': site.name}}
+                    for site in SITES
+                ]},
+                name='Sites',
+                style_function=lambda feature: {'color': '#f1c40f', 'weight': 2, 'fillOpacity': 0.2},
+                tooltip=folium.GeoJsonTooltip(fields=['name'], labels=False)
+            ).add_to(m)
+        
+        m.to_streamlit()
+        
+        if map_selection in TREND_LAYERS and trend_map is not None:
+            trend_summary = trend_map.summary()
+            st.caption(
+                f"{trend_summary['increasing']:.1%} of {trend_summary['pixels']:,} water pixels "
+                f"significantly increasing, {trend_summary['decreasing']:.1%} decreasing "
+                f"(p < 0.05, {TREND_METHOD_LABELS[trend_map.method]}). "
+                f"Colors saturate at ±{trend_summary['limit']:.4f} per year."
+            )
 
 with tab2:
     st.markdown("### Water Quality Trends")
@@ -742,183 +776,47 @@ with tab2:
     """)
     
     try:
-        with st.spinner("Calculating historical trends..."):
-            bounds_key = (min_lon, min_lat, max_lon, max_lat)
-            timeseries_df = create_time_series(bounds_key, HOTSPOT_AOI, analysis_years)
+        progress_slot = st.empty()
+        chart_slot = st.empty()
+        if scene_future is not None:
+            with st.spinner("Extracting per-scene statistics..."):
+                scene_series = executor.result(scene_future)
+            timeseries_df = scene_index_frame(scene_series)
+            period_unit = "scenes"
+            csv_data = scene_series.to_frame().to_csv(index=False)
+            parquet_data = scene_series.to_parquet()
+            if timeseries_df['Chlorophyll Index'].notna().any():
+                with rerun_metrics.stage('chart'):
+                    fig = cached_trend_figure(timeseries_df)
+                    chart_slot.plotly_chart(fig, use_container_width=True)
+        else:
+            drawn_months = 0
+            for timeseries_stats in timeseries_stream.updates():
+                timeseries_df = index_means(timeseries_stats)
+                if not timeseries_stream.done:
+                    progress_slot.progress(
+                        timeseries_stream.loaded_months / len(timeseries_stream.months),
+                        text=f"Loaded {timeseries_stream.loaded_months} of {len(timeseries_stream.months)} months..."
+                    )
+                if timeseries_stream.loaded_months > drawn_months and timeseries_df['Chlorophyll Index'].notna().any():
+                    drawn_months = timeseries_stream.loaded_months
+                    with rerun_metrics.stage('chart'):
+                        fig = cached_trend_figure(timeseries_df)
+                        chart_slot.plotly_chart(fig, use_container_width=True)
+            period_unit = "months"
+            csv_data = timeseries_stats.to_csv(index=False)
+            parquet_data = time_series_parquet(timeseries_stats)
+        progress_slot.empty()
+        if timeseries_stream is not None and timeseries_stream.failed:
+            st.warning(
+                f"Could not load {len(timeseries_stream.failed)} months "
+                f"({', '.join(sorted(timeseries_stream.failed))}); they are left out of the chart. "
+                f"Use Refresh Data to try again."
+            )
         
         if not timeseries_df.empty and timeseries_df['Chlorophyll Index'].notna().any():
-            # Identify monsoon months and prepare datetime x-axis
-            def is_monsoon(month_str):
-                try:
-                    month = int(month_str.split('-')[1])
-                    return month in [6, 7, 8, 9]
-                except Exception:
-                    return False
-
-            timeseries_df['Is_Monsoon'] = timeseries_df.index.map(is_monsoon)
-            # Convert index to datetime for better axis scaling and shading ranges
-            dt_index = pd.to_datetime(timeseries_df.index, format='%Y-%m', errors='coerce')
-            
-            # Create interactive chart
-            fig = make_subplots(
-                rows=2, cols=1,
-                subplot_titles=(
-                    'Chlorophyll Index (NDCI) - Monsoon months in light blue', 
-                    'Turbidity Index (Red Band Reflectance)'
-                ),
-                vertical_spacing=0.15,
-                shared_xaxes=True
-            )
-            
-            # Compute contiguous monsoon periods (grouped shading)
-            monsoon_positions = [i for i, v in enumerate(timeseries_df['Is_Monsoon']) if v]
-            monsoon_periods = []
-            if monsoon_positions:
-                start_pos = monsoon_positions[0]
-                for i in range(1, len(monsoon_positions)):
-                    if monsoon_positions[i] != monsoon_positions[i-1] + 1:
-                        monsoon_periods.append((start_pos, monsoon_positions[i-1]))
-                        start_pos = monsoon_positions[i]
-                monsoon_periods.append((start_pos, monsoon_positions[-1]))
-
-            # Chlorophyll plot
             chl_data = timeseries_df['Chlorophyll Index'].dropna()
-            if len(chl_data) > 0:
-                # Monsoon shading across contiguous ranges for both subplots
-                for s_pos, e_pos in monsoon_periods:
-                    if pd.notna(dt_index[s_pos]) and pd.notna(dt_index[e_pos]):
-                        x0 = dt_index[s_pos]
-                        # Shade through end of the last month in the period
-                        x1 = (dt_index[e_pos] + pd.offsets.MonthEnd(0))
-                        fig.add_vrect(x0=x0, x1=x1, fillcolor="lightblue", opacity=0.18,
-                                      layer="below", line_width=0, row=1, col=1)
-                        fig.add_vrect(x0=x0, x1=x1, fillcolor="lightblue", opacity=0.18,
-                                      layer="below", line_width=0, row=2, col=1)
-                
-                # Primary series
-                x_chl = pd.to_datetime(chl_data.index, format='%Y-%m', errors='coerce')
-                fig.add_trace(
-                    go.Scatter(
-                        x=x_chl, y=chl_data.values,
-                        mode='lines+markers', name='NDCI',
-                        line=dict(color='#2ecc71', width=3),
-                        marker=dict(size=8),
-                        hovertemplate='<b>%{x}</b><br>NDCI: %{y:.4f}<extra></extra>'
-                    ),
-                    row=1, col=1
-                )
-                # Rolling 3-month average (smoothing)
-                chl_roll = chl_data.rolling(window=3, min_periods=2).mean()
-                fig.add_trace(
-                    go.Scatter(
-                        x=x_chl, y=chl_roll.values,
-                        mode='lines', name='NDCI (3-mo avg)',
-                        line=dict(color='rgba(46,204,113,0.5)', width=2, dash='dot')
-                    ),
-                    row=1, col=1
-                )
-                # Highlight high values
-                chl_high_mask = chl_data > NDCI_HIGH
-                if chl_high_mask.any():
-                    fig.add_trace(
-                        go.Scatter(
-                            x=x_chl[chl_high_mask], y=chl_data[chl_high_mask],
-                            mode='markers', name='NDCI > High',
-                            marker=dict(size=10, color='#e74c3c', symbol='diamond')
-                        ),
-                        row=1, col=1
-                    )
-                
-                # Reference lines
-                fig.add_hline(
-                    y=NDCI_ELEVATED, line_dash="dash", line_color="orange", 
-                    row=1, col=1
-                )
-                fig.add_hline(
-                    y=NDCI_HIGH, line_dash="dash", line_color="red", 
-                    row=1, col=1
-                )
-                
-                # Trend line
-                if len(chl_data) > 1:
-                    z = np.polyfit(range(len(chl_data)), chl_data.values, 1)
-                    p = np.poly1d(z)
-                    trend_direction = "↑ Increasing" if z[0] > 0 else "↓ Decreasing"
-                    fig.add_trace(
-                        go.Scatter(
-                            x=x_chl, y=p(range(len(chl_data))),
-                            mode='lines', name=f'Trend {trend_direction}',
-                            line=dict(color='rgba(46,204,113,0.3)', width=2, dash='dash')
-                        ),
-                        row=1, col=1
-                    )
-            
-            # Turbidity plot
             turb_data = timeseries_df['Turbidity'].dropna()
-            if len(turb_data) > 0:
-                # Primary series
-                x_turb = pd.to_datetime(turb_data.index, format='%Y-%m', errors='coerce')
-                fig.add_trace(
-                    go.Scatter(
-                        x=x_turb, y=turb_data.values,
-                        mode='lines+markers', name='Turbidity',
-                        line=dict(color='#e74c3c', width=3),
-                        marker=dict(size=8),
-                        hovertemplate='<b>%{x}</b><br>Turbidity: %{y:.4f}<extra></extra>'
-                    ),
-                    row=2, col=1
-                )
-                # Rolling 3-month average
-                turb_roll = turb_data.rolling(window=3, min_periods=2).mean()
-                fig.add_trace(
-                    go.Scatter(
-                        x=x_turb, y=turb_roll.values,
-                        mode='lines', name='Turbidity (3-mo avg)',
-                        line=dict(color='rgba(231,76,60,0.5)', width=2, dash='dot')
-                    ),
-                    row=2, col=1
-                )
-                # Highlight high turbidity points
-                turb_high_mask = turb_data > TURBIDITY_HIGH
-                if turb_high_mask.any():
-                    fig.add_trace(
-                        go.Scatter(
-                            x=x_turb[turb_high_mask], y=turb_data[turb_high_mask],
-                            mode='markers', name='Turbidity > High',
-                            marker=dict(size=10, color='#c0392b', symbol='diamond')
-                        ),
-                        row=2, col=1
-                    )
-                
-                fig.add_hline(
-                    y=TURBIDITY_ELEVATED, line_dash="dash", line_color="orange", 
-                    row=2, col=1
-                )
-                fig.add_hline(
-                    y=TURBIDITY_HIGH, line_dash="dash", line_color="red", 
-                    row=2, col=1
-                )
-            
-            fig.update_layout(
-                height=700, 
-                showlegend=True, 
-                hovermode='x unified',
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                legend=dict(
-                    orientation='h',
-                    yanchor='top',
-                    y=-0.12,
-                    xanchor='center',
-                    x=0.5
-                ),
-                margin=dict(t=80, r=30, b=120, l=60)
-            )
-            fig.update_xaxes(title_text="Month", row=2, col=1, tickformat='%Y-%m')
-            fig.update_yaxes(title_text="NDCI (unitless)", row=1, col=1, tickformat=".3f", title_standoff=10, ticks="outside", ticklen=6)
-            fig.update_yaxes(title_text="Red Reflectance (unitless)", row=2, col=1, tickformat=".3f", title_standoff=10, ticks="outside", ticklen=6)
-            
-            st.plotly_chart(fig, use_container_width=True)
             
             # Alert summary
             chl_alerts = len(chl_data[chl_data > NDCI_HIGH])
@@ -926,8 +824,8 @@ with tab2:
             
             if chl_alerts > 0 or turb_alerts > 0:
                 st.warning(
-                    f"**Elevated Readings Detected:** {chl_alerts} months with high NDCI values, "
-                    f"{turb_alerts} months with high turbidity values. These periods may warrant "
+                    f"**Elevated Readings Detected:** {chl_alerts} {period_unit} with high NDCI values, "
+                    f"{turb_alerts} {period_unit} with high turbidity values. These periods may warrant "
                     f"ground-truth sampling to assess actual conditions."
                 )
             else:
@@ -946,20 +844,73 @@ with tab2:
                 st.dataframe(turb_stats, use_container_width=True)
             
             # Download data
-            csv_data = timeseries_df.to_csv()
-            st.download_button(
-                label="📥 Download Time Series Data (CSV)",
-                data=csv_data,
-                file_name=f"vembanad_spectral_indices_{datetime.date.today()}.csv",
-                mime="text/csv",
-                use_container_width=True
-            )
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button(
+                    label="📥 Download Time Series Data (CSV)",
+                    data=csv_data,
+                    file_name=f"vembanad_spectral_indices_{datetime.date.today()}.csv",
+                    mime="text/csv",
+                    use_container_width=True
+                )
+            with col2:
+                st.download_button(
+                    label="📥 Download Time Series Data (Parquet)",
+                    data=parquet_data,
+                    file_name=f"vembanad_spectral_indices_{datetime.date.today()}.parquet",
+                    mime="application/vnd.apache.parquet",
+                    use_container_width=True
+                )
         else:
             st.warning("Insufficient data for trend analysis. Try adjusting the analysis area or time period.")
     
     except Exception as e:
         st.error(f"Error calculating trends: {str(e)}")
         st.info("Try selecting a smaller analysis area or shorter time period.")
+    
+    if site_series_future is not None:
+        st.markdown("### Site Comparison")
+        try:
+            with st.spinner("Calculating site trends..."):
+                sites_stats = executor.result(site_series_future)
+                sites_df = index_means(sites_stats, by=['site']).reset_index().rename(columns={'site': 'Site'})
+            
+            for column, threshold in (('Chlorophyll Index', NDCI_HIGH), ('Turbidity', TURBIDITY_HIGH)):
+                site_fig = px.line(
+                    sites_df.dropna(subset=[column]), x='Month', y=column, color='Site', markers=True,
+                    title=f"{column} by site"
+                )
+                site_fig.add_hline(y=threshold, line_dash="dash", line_color="red")
+                site_fig.update_layout(height=380, plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)')
+                st.plotly_chart(site_fig, use_container_width=True)
+            
+            site_summary = sites_df.groupby('Site', sort=False).agg(
+                ndci_mean=('Chlorophyll Index', 'mean'),
+                ndci_max=('Chlorophyll Index', 'max'),
+                turbidity_mean=('Turbidity', 'mean'),
+                turbidity_max=('Turbidity', 'max'),
+                clear_months=('Chlorophyll Index', 'count')
+            )
+            st.dataframe(site_summary, use_container_width=True)
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button(
+                    label="📥 Download Site Time Series (CSV)",
+                    data=sites_stats.to_csv(index=False),
+                    file_name=f"vembanad_sites_{datetime.date.today()}.csv",
+                    mime="text/csv",
+                    use_container_width=True
+                )
+            with col2:
+                st.download_button(
+                    label="📥 Download Site Time Series (Parquet)",
+                    data=time_series_parquet(sites_stats),
+                    file_name=f"vembanad_sites_{datetime.date.today()}.parquet",
+                    mime="application/vnd.apache.parquet",
+                    use_container_width=True
+                )
+        except Exception as e:
+            st.error(f"Error calculating site trends: {str(e)}")
 
 with tab3:
     st.markdown("""
@@ -1297,4 +1248,24 @@ with tab3:
     """)
 
 st.markdown("---")
-st.caption("🌍 Environmental screening tool for water resource monitoring • Not a substitute for field measurements • Requires ground-truth validation")
\ No newline at end of file
+st.caption("🌍 Environmental screening tool for water resource monitoring • Not a substitute for field measurements • Requires ground-truth validation")
+
+# Time-to-first-render for this session, measured from the start of the splash screen
+if 'first_render_seconds' not in st.session_state:
+    st.session_state.first_render_seconds = time.perf_counter() - st.session_state.session_started
+st.sidebar.caption(f"⏱️ First render in {st.session_state.first_render_seconds:.2f} s")
+
+# Debug panel: where this rerun's time went
+if show_performance:
+    with st.sidebar.expander("⏱️ Rerun performance", expanded=True):
+        stage_rows = rerun_metrics.stage_rows()
+        st.dataframe(pd.DataFrame(stage_rows), hide_index=True, use_container_width=True)
+        st.caption(
+            f"{sum(row['Requests'] for row in stage_rows)} {backend.name} backend requests, "
+            f"{sum(row['KB'] for row in stage_rows):.1f} KB this rerun"
+        )
+        st.dataframe(pd.DataFrame(rerun_metrics.cache_rows()), hide_index=True, use_container_width=True)
+        st.caption(f"Process caches (memory budget {MEMORY_BUDGET_BYTES / 2**20:.0f} MB, shared tier on disk)")
+        st.dataframe(pd.DataFrame(cache_stats()), hide_index=True, use_container_width=True)
+        if start_metrics_endpoint() is not None:
+            st.caption(f"Prometheus metrics: http://127.0.0.1:{start_metrics_endpoint().server_port}/metrics")
@@ -0,0 +1,861 @@
+"""
+Pluggable data backends for the analysis pipeline.
+
+The dashboard talks to a Backend instead of calling Earth Engine directly. A
+backend covers scene filtering, compositing, the fused statistics reduction, the
+monthly statistics behind the trend chart and drawing the index layers on the map:
+
+- EarthEngineBackend: the Sentinel-2 SR pipeline in analysis.py, on Earth Engine.
+- RasterEngineBackend: the same composites, downloaded once and processed with
+  NumPy (the "Local raster engine" option).
+- LocalBackend: recorded or synthetic Sentinel-2 band stacks read from disk (see
+  fixtures.py), so the dashboard and pipeline run offline and deterministically.
+
+All methods take AOIs as plain (min_lon, min_lat, max_lon, max_lat) bounds.
+"""
+import datetime
+import functools
+import json
+import logging
+import os
+import time
+import warnings
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import ee
+import numpy as np
+import pandas as pd
+
+from analysis import (
+    AOI_BOUNDS, MAX_CLOUD_PERCENT, SCENE_PAGE_SIZE, SETTLING_DAYS, anchor_date, build_composite,
+    calculate_water_quality_stats, composite_window, connect_ee, fetch_monthly_site_stats,
+    fetch_monthly_stats, fetch_scene_stats, month_range,
+    get_chlorophyll_map, get_floating_matter_map, get_sentinel2_image, get_turbidity_map,
+    tiled_water_quality_stats, use_tiled_reduction
+)
+from ee_cache import ee_cached, fingerprint, invalidate, single_flight
+from ee_executor import bound_ee_requests
+from invalidation import CacheScope
+from metrics import EE_REQUESTS, SCENE_READS, count_ee_requests
+from pixel_trends import TREND_METHOD, TrendMap, monthly_stack, pixel_trends
+from raster_engine import BANDS, LocalComposite, download_scenes, get_local_composite, pixel_grid
+from scene_series import SceneSeries
+from sites import site_key, sites_bounds
+from storage import (
+    CACHE_DIR, current_month_label, file_lock, get_monthly_store, get_raster_cache, get_result_store,
+    month_labels
+)
+from tiles import SEED_ZOOMS, add_ee_layer, get_tile_url, register_layer, seed_tiles
+from time_cube import TimeCube, cube_key
+
+logger = logging.getLogger(__name__)
+
+# Index layers every backend can draw, and their default visualization
+LAYERS = ('chlorophyll', 'turbidity', 'nir')
+LAYER_VIS_PARAMS = {
+    'chlorophyll': {'min': 1, 'max': 4, 'palette': ['#3498db', '#2ecc71', '#f39c12', '#e74c3c']},
+    'turbidity': {'palette': ['#c0392b']},
+    'nir': {'palette': ['#8e44ad']},
+}
+
+# QA60 opaque cloud and cirrus bits, as in mask_s2_clouds
+CLOUD_BITS = (1 << 10) | (1 << 11)
+
+# Indices of the monthly time series and their chart labels
+INDICES = ('ndci', 'turbidity')
+INDEX_LABELS = {'ndci': 'Chlorophyll Index', 'turbidity': 'Turbidity'}
+
+# Columns and dtypes of the long time series frames
+TIME_SERIES_DTYPES = {'month': str, 'index': str, 'mean': float, 'std': float, 'pixel_count': 'Int64'}
+
+
+def ee_geometry(bounds):
+    return ee.Geometry.Rectangle(list(bounds))
+
+
+def add_array_layer(m, composite, layer, vis_params, name, opacity):
+    """Draws one index layer of a LocalComposite as an image overlay."""
+    if layer == 'chlorophyll':
+        rgba = composite.classes_rgba(vis_params['palette'])
+    elif layer == 'turbidity':
+        rgba = composite.mask_rgba(composite.turbidity_hotspots, vis_params['palette'][0])
+    else:
+        rgba = composite.mask_rgba(composite.nir_anomalies, vis_params['palette'][0])
+    composite.overlay(rgba, name, opacity).add_to(m)
+
+
+class Backend(ABC):
+    """Interface shared by all data backends."""
+
+    name = None
+    # Whether monthly statistics go to the shared on-disk monthly store
+    persist_monthly = True
+
+    # RequestCounter of this backend's requests to its data source
+    requests = None
+    # Whether layers are drawn as Earth Engine tiles (see layer_image and tiles.py)
+    tile_layers = False
+
+    def initialize(self):
+        """Connects to the data source; errors propagate."""
+
+    @abstractmethod
+    def count_scenes(self, bounds, months_back):
+        """Number of scenes passing the cloud filter in the recent composite window."""
+
+    @abstractmethod
+    def composite_stats(self, bounds, months_back):
+        """Fused statistics of the recent composite (keys as calculate_water_quality_stats)."""
+
+    @abstractmethod
+    def monthly_stats(self, bounds, months, until=None):
+        """
+        {month: {index: {'mean', 'std', 'pixel_count'}}} of 'ndci' and 'turbidity'
+        over water, for calendar months 'YYYY-MM'; `until` (ISO date, exclusive)
+        ends the still-open month at the anchor date.
+        """
+
+    @abstractmethod
+    def site_monthly_stats(self, sites, months, until=None):
+        """{site name: monthly_stats} for a sequence of sites.Site."""
+
+    @abstractmethod
+    def scene_stats(self, bounds, start, end):
+        """SceneSeries of every cloud-filtered acquisition in [start, end) (ISO dates)."""
+
+    @abstractmethod
+    def cube_grid(self, bounds):
+        """(height, width, grid bounds) of the pixel grid scene_bands() uses for `bounds`."""
+
+    @abstractmethod
+    def scene_bands(self, bounds, start, end):
+        """
+        Yields (date, bands, clear) per cloud-filtered acquisition in [start, end),
+        oldest first: BANDS as (band, y, x) uint16 reflectance * 10000 on cube_grid(),
+        0 where cloudy or without data, and the (y, x) clear-sky mask.
+        """
+
+    @abstractmethod
+    def add_layer(self, m, bounds, months_back, layer, vis_params, name, opacity, stats):
+        """Draws index `layer` (one of LAYERS) of the recent composite on map `m`."""
+
+    def cache_clear(self):
+        """Drops this backend's in-process caches."""
+
+    def warm_up(self, months_back=3):
+        """
+        Initializes the backend and pre-fetches the default composite and its statistics.
+
+        Initialization errors propagate; a failed data fetch is logged and left for the
+        dashboard to retry. Returns elapsed seconds per stage, and the fetch error as
+        'error' if there was one.
+        """
+        timings = {}
+        started = time.perf_counter()
+        self.initialize()
+        timings['init'] = time.perf_counter() - started
+
+        try:
+            if stored_scene_count(self, AOI_BOUNDS, months_back):
+                timings['composite'] = time.perf_counter() - started
+                stored_composite_stats(self, AOI_BOUNDS, months_back)
+                timings['stats'] = time.perf_counter() - started
+        except Exception as e:
+            logger.warning("Warm-up fetch with %r failed", self, exc_info=True)
+            timings['error'] = f"{type(e).__name__}: {e}"
+        return timings
+
+    def __repr__(self):
+        # Part of ee_cached keys, so it must identify the data source
+        return f"{type(self).__name__}({self.name!r})"
+
+    @property
+    def data_source(self):
+        """Identifies the imagery scene_bands() reads; backends over the same one share time cubes."""
+        return repr(self)
+
+
+class EarthEngineBackend(Backend):
+    """Sentinel-2 SR harmonized on Google Earth Engine."""
+
+    name = 'ee'
+    requests = EE_REQUESTS
+    tile_layers = True
+
+    def __init__(self, service_account_info=None):
+        self.service_account_info = service_account_info
+
+    def initialize(self):
+        connect_ee(self.service_account_info)
+        bound_ee_requests()
+        count_ee_requests()
+
+    def count_scenes(self, bounds, months_back):
+        _, _, collection_size = get_sentinel2_image(ee_geometry(bounds), months_back)
+        return collection_size
+
+    def composite_stats(self, bounds, months_back):
+        aoi = ee_geometry(bounds)
+        _, image, water_mask = build_composite(aoi, months_back)
+        if use_tiled_reduction(bounds):
+            return tiled_water_quality_stats(image, water_mask, tuple(bounds))
+        return calculate_water_quality_stats(image, water_mask, aoi)
+
+    def monthly_stats(self, bounds, months, until=None):
+        return fetch_monthly_stats(ee_geometry(bounds), months, until)
+
+    def site_monthly_stats(self, sites, months, until=None):
+        collection = ee.FeatureCollection([
+            ee.Feature(ee.Geometry(site.geometry), {'site': site.name}) for site in sites
+        ])
+        return fetch_monthly_site_stats(collection, len(sites), months, until)
+
+    def scene_stats(self, bounds, start, end):
+        return SceneSeries.concat(
+            SceneSeries.from_rows(page) for page in fetch_scene_stats(ee_geometry(bounds), start, end)
+        )
+
+    def cube_grid(self, bounds):
+        dimensions = pixel_grid(bounds, TIME_CUBE_SCALE_M)['dimensions']
+        return dimensions['height'], dimensions['width'], tuple(bounds)
+
+    def scene_bands(self, bounds, start, end):
+        return download_scenes(bounds, start, end, TIME_CUBE_SCALE_M)
+
+    @property
+    def data_source(self):
+        # Subclasses only change how composites are computed, not the scenes
+        return f"EarthEngine('COPERNICUS/S2_SR_HARMONIZED', {TIME_CUBE_SCALE_M})"
+
+    def layer_image(self, bounds, months_back, layer, stats):
+        """ee.Image of index `layer` of the recent composite."""
+        _, image, water_mask = build_composite(ee_geometry(bounds), months_back)
+        if layer == 'chlorophyll':
+            layer_image, _ = get_chlorophyll_map(image, water_mask)
+        elif layer == 'turbidity':
+            layer_image, _ = get_turbidity_map(image, water_mask, stats.get('turbidity_p85'))
+        else:
+            layer_image, _ = get_floating_matter_map(image, water_mask, stats.get('nir_p95'))
+        return layer_image
+
+    def add_layer(self, m, bounds, months_back, layer, vis_params, name, opacity, stats):
+        add_ee_layer(m, self.layer_image(bounds, months_back, layer, stats), vis_params, name, True, opacity)
+
+    def cache_clear(self):
+        for cached_func in (build_composite, get_sentinel2_image, get_chlorophyll_map,
+                            get_turbidity_map, get_floating_matter_map, calculate_water_quality_stats,
+                            tiled_water_quality_stats, get_tile_url):
+            cached_func.cache_clear()
+
+
+class RasterEngineBackend(EarthEngineBackend):
+    """Earth Engine composites downloaded once; stats and layers computed with NumPy."""
+
+    name = 'ee-raster'
+    tile_layers = False
+
+    def composite_stats(self, bounds, months_back):
+        return get_local_composite(tuple(bounds), months_back).stats
+
+    def add_layer(self, m, bounds, months_back, layer, vis_params, name, opacity, stats):
+        composite = get_local_composite(tuple(bounds), months_back)
+        add_array_layer(m, composite, layer, vis_params, name, opacity)
+
+    def cache_clear(self):
+        super().cache_clear()
+        get_local_composite.cache_clear()
+
+
+@functools.lru_cache(maxsize=128)
+def read_scene(path):
+    """QA60 and the composite bands of one fixture scene, as uint16 arrays."""
+    SCENE_READS.add(os.path.getsize(path))
+    with np.load(path) as scene:
+        return scene['QA60'], np.stack([scene[band] for band in BANDS])
+
+
+class LocalBackend(Backend):
+    """
+    Offline backend over a directory of Sentinel-2 band stacks.
+
+    The directory holds an index.json manifest ({"bounds": [...], "shape": [h, w],
+    "scenes": [{"date", "file", "cloudy_pixel_percentage"}]}) and one .npz per scene
+    with QA60 and B2-B8 as uint16 surface reflectance (x 10000) on a shared EPSG:4326
+    grid. Cloud masking, compositing and reductions mirror the Earth Engine path.
+    """
+
+    name = 'local'
+    requests = SCENE_READS
+    # Fixture results are cheap to recompute and must not mix with Earth Engine data
+    persist_monthly = False
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        with open(os.path.join(self.directory, 'index.json')) as fh:
+            manifest = json.load(fh)
+        self.bounds = tuple(manifest['bounds'])
+        self.shape = tuple(manifest['shape'])
+        self.scenes = sorted(manifest['scenes'], key=lambda scene: scene['date'])
+
+    def __repr__(self):
+        return f"LocalBackend({self.directory!r})"
+
+    def initialize(self):
+        if not self.scenes:
+            raise ValueError(f"No scenes in fixture directory {self.directory}")
+
+    def filter_scenes(self, start, end, max_cloud=None):
+        """Scenes acquired in [start, end) (ISO dates), optionally under a cloud limit."""
+        return [
+            scene for scene in self.scenes
+            if start <= scene['date'] < end
+            and (max_cloud is None or scene['cloudy_pixel_percentage'] < max_cloud)
+        ]
+
+    def _window(self, bounds):
+        """Row and column slices of the fixture grid covered by `bounds`."""
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        height, width = self.shape
+        col0 = int(np.clip(np.floor((bounds[0] - min_lon) / (max_lon - min_lon) * width), 0, width))
+        col1 = int(np.clip(np.ceil((bounds[2] - min_lon) / (max_lon - min_lon) * width), 0, width))
+        row0 = int(np.clip(np.floor((max_lat - bounds[3]) / (max_lat - min_lat) * height), 0, height))
+        row1 = int(np.clip(np.ceil((max_lat - bounds[1]) / (max_lat - min_lat) * height), 0, height))
+        return slice(row0, row1), slice(col0, col1)
+
+    def _window_bounds(self, rows, cols):
+        """Geographic bounds of a _window(), snapped to the fixture pixel grid."""
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        height, width = self.shape
+        step_lon, step_lat = (max_lon - min_lon) / width, (max_lat - min_lat) / height
+        return (min_lon + cols.start * step_lon, max_lat - rows.stop * step_lat,
+                min_lon + cols.stop * step_lon, max_lat - rows.start * step_lat)
+
+    @ee_cached(maxsize=64, ttl=3600, namespace='composites',
+               scope=lambda self, bounds, start, end, max_cloud=None: CacheScope(tuple(bounds), start, end))
+    def composite(self, bounds, start, end, max_cloud=None):
+        """Cloud-masked median composite over `bounds` as a LocalComposite, or None."""
+        scenes = self.filter_scenes(start, end, max_cloud)
+        if not scenes:
+            return None
+        rows, cols = self._window(bounds)
+        stack = []
+        for scene in scenes:
+            qa, bands = read_scene(os.path.join(self.directory, scene['file']))
+            clear = (qa[rows, cols] & CLOUD_BITS) == 0
+            reflectance = bands[:, rows, cols].astype(np.float32)
+            reflectance[:, ~clear] = np.nan
+            reflectance[reflectance == 0] = np.nan
+            stack.append(reflectance)
+        with warnings.catch_warnings():
+            # All-cloud pixels give all-NaN slices; they simply stay empty
+            warnings.simplefilter('ignore', RuntimeWarning)
+            median = np.nanmedian(np.stack(stack), axis=0)
+        bands = np.nan_to_num(np.round(median), nan=0).astype(np.uint16)
+        return LocalComposite(bands, self._window_bounds(rows, cols))
+
+    def count_scenes(self, bounds, months_back):
+        start, end = composite_window(months_back)
+        return len(self.filter_scenes(start, end, MAX_CLOUD_PERCENT))
+
+    def _recent_composite(self, bounds, months_back):
+        start, end = composite_window(months_back)
+        return self.composite(tuple(bounds), start, end, MAX_CLOUD_PERCENT)
+
+    def composite_stats(self, bounds, months_back):
+        composite = self._recent_composite(bounds, months_back)
+        return composite.stats if composite is not None else {}
+
+    def monthly_stats(self, bounds, months, until=None):
+        monthly = {}
+        for month in months:
+            composite = self.composite(tuple(bounds), *month_range(month, until))
+            stats = composite.stats if composite is not None else {}
+            monthly[month] = {index: {
+                'mean': stats.get(f'{index}_mean'),
+                'std': stats.get(f'{index}_stdDev'),
+                'pixel_count': stats.get(f'{index}_count', 0),
+            } for index in INDICES}
+        return monthly
+
+    def site_monthly_stats(self, sites, months, until=None):
+        # One composite per month over all sites; site masks are the same every month
+        region = sites_bounds(sites)
+        monthly = {site.name: {} for site in sites}
+        masks = None
+        for month in months:
+            composite = self.composite(region, *month_range(month, until))
+            if composite is not None and masks is None:
+                masks = {site.name: composite.geometry_mask(site.geometry) for site in sites}
+            for site in sites:
+                monthly[site.name][month] = (
+                    composite.region_stats(masks[site.name]) if composite is not None
+                    else {index: {'mean': None, 'std': None, 'pixel_count': 0} for index in INDICES}
+                )
+        return monthly
+
+    def scene_stats(self, bounds, start, end):
+        rows, cols = self._window(bounds)
+        window_bounds = self._window_bounds(rows, cols)
+        scenes = self.filter_scenes(start, end, MAX_CLOUD_PERCENT)
+        pages = []
+        # Paged like the Earth Engine extraction; only one page of rows is held as dicts
+        for offset in range(0, len(scenes), SCENE_PAGE_SIZE):
+            page = []
+            for scene in scenes[offset:offset + SCENE_PAGE_SIZE]:
+                qa, bands = read_scene(os.path.join(self.directory, scene['file']))
+                clear_bands = np.where((qa[rows, cols] & CLOUD_BITS) == 0, bands[:, rows, cols], 0)
+                composite = LocalComposite(clear_bands, window_bounds)
+                stats = composite.region_stats(np.ones(clear_bands.shape[1:], dtype=bool))
+                page.append({
+                    'date': scene['date'],
+                    'ndci': stats['ndci']['mean'],
+                    'turbidity': stats['turbidity']['mean'],
+                    'valid_pixels': stats['ndci']['pixel_count'],
+                    'total_pixels': clear_bands.shape[1] * clear_bands.shape[2],
+                })
+            pages.append(SceneSeries.from_rows(page))
+        return SceneSeries.concat(pages)
+
+    def cube_grid(self, bounds):
+        rows, cols = self._window(bounds)
+        return rows.stop - rows.start, cols.stop - cols.start, self._window_bounds(rows, cols)
+
+    def scene_bands(self, bounds, start, end):
+        rows, cols = self._window(bounds)
+        for scene in self.filter_scenes(start, end, MAX_CLOUD_PERCENT):
+            qa, bands = read_scene(os.path.join(self.directory, scene['file']))
+            clear = (qa[rows, cols] & CLOUD_BITS) == 0
+            yield scene['date'], np.where(clear, bands[:, rows, cols], 0).astype(np.uint16), clear
+
+    def add_layer(self, m, bounds, months_back, layer, vis_params, name, opacity, stats):
+        composite = self._recent_composite(bounds, months_back)
+        if composite is not None:
+            add_array_layer(m, composite, layer, vis_params, name, opacity)
+
+    def cache_clear(self):
+        LocalBackend.composite.cache_clear()
+        read_scene.cache_clear()
+
+
+def create_backend(name=None, service_account_info=None, fixture_dir=None):
+    """
+    Backend by name: 'ee' (default), 'ee-raster' or 'local'. Defaults come from the
+    BACKWATER_BACKEND and BACKWATER_FIXTURE_DIR environment variables.
+    """
+    name = name or os.environ.get('BACKWATER_BACKEND', 'ee')
+    if name == 'ee':
+        return EarthEngineBackend(service_account_info)
+    if name == 'ee-raster':
+        return RasterEngineBackend(service_account_info)
+    if name == 'local':
+        fixture_dir = fixture_dir or os.environ.get('BACKWATER_FIXTURE_DIR', os.path.join('.cache', 'fixture'))
+        return LocalBackend(fixture_dir)
+    raise ValueError(f"Unknown backend {name!r}; expected 'ee', 'ee-raster' or 'local'")
+
+
+def _stats_rows(monthly_stats, months):
+    """Long time series rows from {month: {index: {stat: value}}}; missing months are empty."""
+    empty = {'mean': None, 'std': None, 'pixel_count': None}
+    return [{'month': month, 'index': index, **{**empty, **monthly_stats.get(month, {}).get(index, {})}}
+            for month in months for index in INDICES]
+
+
+def _time_series_frame(rows, columns=()):
+    dtypes = {**{column: str for column in columns}, **TIME_SERIES_DTYPES}
+    return pd.DataFrame.from_records(rows, columns=list(dtypes)).astype(dtypes)
+
+
+SeriesWindow = namedtuple('SeriesWindow', ['months', 'open_month', 'until'])
+
+
+def series_window(years):
+    """
+    Calendar months of a `years` series ending at the anchor date, the month still
+    open at that date (computed but never persisted) and the anchor date itself.
+    With the month anchor every month of the series is closed.
+    """
+    until = anchor_date()
+    last_day = until - datetime.timedelta(days=1)
+    return SeriesWindow(month_labels(years, last_day), current_month_label(until), until.isoformat())
+
+
+def settled_months(monthly_stats, until):
+    """
+    The months of {month: {index: stats}} that may be persisted: closed at least
+    SETTLING_DAYS before `until` (ISO date), so late scenes are no longer arriving,
+    and with data for some index, so a month without imagery yet is never frozen
+    as missing.
+    """
+    settled = (datetime.date.fromisoformat(until) - datetime.timedelta(days=SETTLING_DAYS)).isoformat()
+    return {
+        month: values for month, values in monthly_stats.items()
+        if month_range(month)[1] <= settled
+        and any(stats.get('mean') is not None for stats in values.values())
+    }
+
+
+def time_series_scope(bounds, years):
+    """Invalidation scope of a `years` series: the AOI, first month to the anchor date."""
+    window = series_window(years)
+    return CacheScope(tuple(bounds), month_range(window.months[0])[0], window.until)
+
+
+@ee_cached(maxsize=32, ttl=3600, namespace='time_series',
+           scope=lambda backend, bounds, years=2: time_series_scope(bounds, years), shared=True)
+def create_time_series(backend, bounds, years=2):
+    """
+    Generate monthly time series of water quality indices, as a long frame with
+    columns month ('YYYY-MM'), index, mean, std and pixel_count.
+
+    Settled calendar months are read from the persistent store; only months missing
+    from it (normally just the current month and the one before while it settles)
+    are computed by the backend.
+    """
+    months, _, until = series_window(years)
+    store = get_monthly_store() if backend.persist_monthly else None
+    monthly_stats = store.load(bounds, months) if store else {}
+
+    missing = [month for month in months if month not in monthly_stats]
+    if missing:
+        fetched = backend.monthly_stats(bounds, missing, until)
+        if store:
+            store.save(bounds, settled_months(fetched, until))
+        monthly_stats.update(fetched)
+
+    return _time_series_frame(_stats_rows(monthly_stats, months))
+
+
+@ee_cached(maxsize=16, ttl=3600, namespace='site_time_series',
+           scope=lambda backend, sites, years=2: time_series_scope(sites_bounds(sites), years),
+           shared=True)
+def create_site_time_series(backend, sites, years=2):
+    """
+    Monthly NDCI and turbidity statistics for every site, as a long frame with a
+    site column in front of the create_time_series columns.
+
+    Settled months come from the persistent store per site; months missing for any
+    site are computed for all sites in one batch by the backend.
+    """
+    months, _, until = series_window(years)
+    store = get_monthly_store() if backend.persist_monthly else None
+    values = {site.name: store.load(site_key(site), months) if store else {} for site in sites}
+
+    missing = sorted({month for site in sites for month in months if month not in values[site.name]})
+    if missing:
+        fetched = backend.site_monthly_stats(sites, missing, until)
+        for site in sites:
+            site_values = fetched.get(site.name, {})
+            if store:
+                store.save(site_key(site), settled_months(site_values, until))
+            values[site.name].update(site_values)
+
+    rows = [{'site': site.name, **row} for site in sites for row in _stats_rows(values[site.name], months)]
+    return _time_series_frame(rows, columns=['site'])
+
+
+def index_means(df, by=()):
+    """
+    Wide frame of monthly means from a long time series frame: one column per index
+    (labelled as in INDEX_LABELS), indexed by 'Month' (and `by` columns before it).
+    """
+    wide = df.pivot_table(index=[*by, 'month'], columns='index', values='mean', aggfunc='first', dropna=False)
+    wide = wide.reindex(columns=list(INDICES)).rename(columns=INDEX_LABELS)
+    wide.columns.name = None
+    return wide.rename_axis(index={'month': 'Month'})
+
+
+# Stored results are keyed by anchored windows, so new keys appear only when a boundary
+# closes; this age (seconds) bounds how long one may miss late-archived scenes
+RESULT_MAX_AGE = 24 * 3600
+
+
+def result_key_prefix(backend):
+    return f"{backend!r}|"
+
+
+def result_key(backend, stage, parts):
+    return f"{result_key_prefix(backend)}{stage}|{fingerprint(parts)}"
+
+
+def stored_result(backend, stage, parts, compute, refresh=False, namespace=None, scope=None,
+                  max_age=RESULT_MAX_AGE):
+    """
+    compute() for `stage` of `backend`, read from the shared result store when
+    precompute.py or another session already produced it (within `max_age` seconds,
+    None for no limit), else computed once however many sessions of this process
+    ask at the same time, and stored under `namespace` (default: the stage) and
+    `scope` for scoped invalidation. `refresh` recomputes and replaces the stored
+    result.
+    """
+    store = get_result_store()
+    key = result_key(backend, stage, parts)
+    if not refresh:
+        found, value = store.get(key, max_age=max_age)
+        if found:
+            return value
+
+    def compute_and_store():
+        value = compute()
+        store.put(key, value, namespace or stage, scope)
+        return value
+
+    # Sessions missing the same result wait for one computation; a refresh must not
+    # join one that started before it
+    return compute_and_store() if refresh else single_flight(stage, key, compute_and_store)
+
+
+def invalidate_results(backend, invalidation):
+    """
+    Drops what `invalidation` matches from the in-process caches and from
+    `backend`'s stored results; the monthly store of closed months is kept.
+    Returns ({namespace: cache entries dropped}, {namespace: stored results dropped}).
+    """
+    return dict(invalidate(invalidation)), get_result_store().invalidate(result_key_prefix(backend), invalidation)
+
+
+def _frame_records(df):
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def stored_scene_count(backend, bounds, months_back, refresh=False):
+    window = composite_window(months_back)
+    return stored_result(backend, 'scenes', (tuple(bounds), window),
+                         lambda: backend.count_scenes(bounds, months_back), refresh,
+                         namespace='composites', scope=CacheScope(tuple(bounds), *window))
+
+
+def stored_composite_stats(backend, bounds, months_back, refresh=False):
+    window = composite_window(months_back)
+    return stored_result(backend, 'stats', (tuple(bounds), window),
+                         lambda: backend.composite_stats(bounds, months_back), refresh,
+                         scope=CacheScope(tuple(bounds), *window))
+
+
+def seed_layer_tiles(backend, bounds, months_back, zooms=SEED_ZOOMS):
+    """
+    Pre-fetches the tiles of every index layer of the recent composite over `bounds`
+    into the tile proxy's cache. Returns {layer: tile count}; empty for backends that
+    draw layers without Earth Engine tiles.
+    """
+    if not backend.tile_layers:
+        return {}
+    stats = stored_composite_stats(backend, bounds, months_back)
+    return {
+        layer: seed_tiles(register_layer(backend.layer_image(bounds, months_back, layer, stats),
+                                         LAYER_VIS_PARAMS[layer]), bounds, zooms)
+        for layer in LAYERS
+    }
+
+
+def _time_series_parts(bounds, years):
+    return tuple(bounds), years, series_window(years).until
+
+
+def stored_time_series(backend, bounds, years=2, refresh=False):
+    """create_time_series through the result store (keyed by the anchor date)."""
+    records = stored_result(
+        backend, 'time_series', _time_series_parts(bounds, years),
+        lambda: _frame_records(create_time_series(backend, tuple(bounds), years)),
+        refresh, scope=time_series_scope(bounds, years)
+    )
+    return _time_series_frame(records)
+
+
+def stored_site_time_series(backend, sites, years=2, refresh=False):
+    """create_site_time_series through the result store."""
+    records = stored_result(
+        backend, 'site_time_series', (tuple(site_key(site) for site in sites), [site.name for site in sites],
+                                      years, series_window(years).until),
+        lambda: _frame_records(create_site_time_series(backend, sites, years)),
+        refresh, scope=time_series_scope(sites_bounds(sites), years)
+    )
+    return _time_series_frame(records, columns=['site'])
+
+
+def stored_scene_series(backend, bounds, years=2, refresh=False):
+    """
+    Per-acquisition SceneSeries of the `years` trend period, same-day acquisitions
+    merged. Extraction runs one calendar year at a time: years that closed at
+    least SETTLING_DAYS before the anchor date are stored without an age limit, as
+    they can no longer change, and even `refresh` reads them from the store; only
+    the open year is keyed by the anchor date and re-extracted.
+    """
+    window = time_series_scope(bounds, years)
+    start, until = datetime.date.fromisoformat(window.start), window.end
+    settled = (datetime.date.fromisoformat(until) - datetime.timedelta(days=SETTLING_DAYS)).isoformat()
+    parts = []
+    for year in range(start.year, datetime.date.fromisoformat(until).year + 1):
+        year_start, year_end = f"{year}-01-01", f"{year + 1}-01-01"
+        closed = year_end <= settled
+        end = min(year_end, until)
+        if year_start >= end:
+            continue
+        columns = stored_result(
+            backend, 'scene_series', (tuple(bounds), year, None if closed else until),
+            lambda year_start=year_start, end=end: backend.scene_stats(bounds, year_start, end).to_columns(),
+            refresh and not closed, namespace='time_series', scope=CacheScope(tuple(bounds), year_start, end),
+            max_age=None if closed else RESULT_MAX_AGE
+        )
+        parts.append(SceneSeries.from_columns(columns))
+    return SceneSeries.concat(parts).between(window.start, until).daily()
+
+
+def scene_index_frame(series):
+    """A SceneSeries as the wide frame of the trend chart, indexed by 'Date'."""
+    return pd.DataFrame(
+        {INDEX_LABELS['ndci']: series.ndci, INDEX_LABELS['turbidity']: series.turbidity},
+        index=pd.Index(np.datetime_as_string(series.date, unit='D'), name='Date'),
+    )
+
+
+# Pixel size of Earth Engine time cubes; the local backend uses its fixture grid
+TIME_CUBE_SCALE_M = 20
+
+
+def get_time_cube(backend, bounds, years=2):
+    """
+    The TimeCube of every cloud-filtered acquisition over `bounds` for the `years`
+    trend period, under BACKWATER_CACHE_DIR/cubes with one cube per data source.
+    An existing cube is brought up to date by re-scanning its last SETTLING_DAYS,
+    which may have gained late scenes, and the days since; a longer period extends
+    it back in time. Updates hold a file lock, so one process writes at a time, and
+    are swapped in atomically for readers (see time_cube). Slice the period with
+    cube.select().
+    """
+    window = time_series_scope(bounds, years)
+    directory = os.path.join(CACHE_DIR, 'cubes', cube_key(backend.data_source, bounds))
+
+    def update():
+        os.makedirs(directory, exist_ok=True)
+        with file_lock(os.path.join(directory, '.lock')):
+            try:
+                cube = TimeCube(directory)
+            except FileNotFoundError:
+                height, width, grid_bounds = backend.cube_grid(bounds)
+                cube = TimeCube.create(directory, grid_bounds, BANDS, height, width, window.start)
+            if cube.start > window.start:
+                cube.prepend(backend.scene_bands(bounds, window.start, cube.start), window.start)
+            if cube.end < window.end:
+                settling = datetime.date.fromisoformat(cube.end) - datetime.timedelta(days=SETTLING_DAYS)
+                since = max(cube.start, settling.isoformat())
+                cube.append(backend.scene_bands(bounds, since, window.end), window.end, since=since)
+            return cube
+
+    return single_flight('time_cube', (directory, window.start, window.end), update)
+
+
+def get_trend_map(backend, bounds, index, years=2, method=TREND_METHOD):
+    """
+    TrendMap of `index` ('ndci' or 'turbidity') per pixel over `bounds` for the
+    `years` trend period, fitted to the monthly medians of the time cube. Kept in the
+    raster cache per cube state, so it is refitted only once the cube's scenes changed.
+    """
+    window = series_window(years)
+    cube = get_time_cube(backend, bounds, years)
+    cache = get_raster_cache()
+    key = fingerprint(cube.directory, cube.generations, cube.end, index, method, window.months)[:32]
+
+    def compute():
+        array = cache.get(key)
+        if array is None:
+            stack = monthly_stack(cube, index, window.months)
+            trend = TrendMap(cube.bounds, index, method, *pixel_trends(stack, method))
+            array = cache.put(key, trend.to_array())
+        return TrendMap.from_array(cube.bounds, index, method, array)
+
+    return single_flight('trend_map', key, compute)
+
+
+# Months per backend request when a time series is streamed
+TIME_SERIES_CHUNK_MONTHS = 6
+
+
+class TimeSeriesStream:
+    """
+    A time series fetched progressively: the months missing from the result and
+    monthly stores are requested in chunks of `chunk_months`, most recent first, all
+    submitted to `executor` at once so they run in parallel. updates() yields after
+    every finished chunk so the caller can redraw. A chunk that fails is retried
+    month by month; months that fail on their own too, or whose request outlives
+    the executor's timeout, are left empty and listed in `failed`. A complete series is written to the result store like
+    stored_time_series.
+    """
+
+    def __init__(self, backend, bounds, years, executor, fetch=None, chunk_months=TIME_SERIES_CHUNK_MONTHS):
+        self.backend = backend
+        self.bounds = tuple(bounds)
+        self.years = years
+        self.months, _, self._until = series_window(years)
+        self.failed = []
+        self._executor = executor
+        self._fetch = fetch or backend.monthly_stats
+        self._key = result_key(backend, 'time_series', _time_series_parts(bounds, years))
+        self._store = get_monthly_store() if backend.persist_monthly else None
+        self._stats = {}
+        self._futures = {}
+
+        found, records = get_result_store().get(self._key, max_age=RESULT_MAX_AGE)
+        if found:
+            self._frame = _time_series_frame(records)
+            return
+        self._frame = None
+        if self._store:
+            self._stats.update(self._store.load(self.bounds, self.months))
+        missing = [month for month in reversed(self.months) if month not in self._stats]
+        for i in range(0, len(missing), chunk_months):
+            self._submit(missing[i:i + chunk_months], retry=True)
+
+    def _submit(self, months, retry):
+        future = self._executor.submit(self._fetch, self.bounds, months, self._until)
+        self._futures[future] = (months, retry)
+
+    @property
+    def done(self):
+        return not self._futures
+
+    @property
+    def loaded_months(self):
+        return len(self.months) if self._frame is not None else len(self._stats)
+
+    def frame(self):
+        """Long frame as create_time_series returns it; months not yet loaded are empty."""
+        if self._frame is not None:
+            return self._frame
+        return _time_series_frame(_stats_rows(self._stats, self.months))
+
+    def updates(self):
+        """Yields the current frame(), then again after every finished chunk."""
+        yield self.frame()
+        while self._futures:
+            timeout = max(0.0, min(future.deadline for future in self._futures) - time.monotonic())
+            finished, _ = wait(self._futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not finished:
+                # A hung request keeps its worker but not the stream: its months stay empty
+                for future in [f for f in self._futures if f.deadline <= time.monotonic()]:
+                    future.cancel()
+                    self.failed.extend(self._futures.pop(future)[0])
+                yield self.frame()
+                continue
+            for future in finished:
+                months, retry = self._futures.pop(future)
+                try:
+                    fetched = future.result()
+                except Exception:
+                    if retry and len(months) > 1:
+                        for month in months:
+                            self._submit([month], retry=False)
+                    elif retry:
+                        self._submit(months, retry=False)
+                    else:
+                        self.failed.extend(months)
+                    continue
+                self._stats.update(fetched)
+                if self._store:
+                    self._store.save(self.bounds, settled_months(fetched, self._until))
+            yield self.frame()
+        if self._frame is None and not self.failed:
+            self._frame = self.frame()
+            get_result_store().put(self._key, _frame_records(self._frame), 'time_series',
+                                   time_series_scope(self.bounds, self.years))
@@ -0,0 +1,207 @@
+"""
+Benchmark suite for the analysis pipeline.
+
+Runs each dashboard stage cold (caches cleared) against the local backend over a
+synthetic fixture, for several AOI sizes, composite windows of 1-6 months and trend
+periods of 1-5 years:
+
+- scenes:               scene filtering behind get_sentinel2_image (Backend.count_scenes)
+- stats:                the fused reduction of calculate_water_quality_stats (Backend.composite_stats)
+- time_series:          create_time_series
+- trend_figure:         the Plotly figure of the Analytics tab (charts.build_trend_figure)
+- trend_figure_cached:  the same figure from the serialized figure cache (charts.cached_trend_figure)
+
+and reports the median latency of N runs, peak traced memory and backend requests
+per case. Results are compared with a baseline recorded on the same machine
+(timings from other machines mean nothing), kept under BACKWATER_CACHE_DIR; the
+first run records it, and later runs exit with status 1 when any case regresses
+past the tolerances.
+
+    python benchmark.py                      # compare with the baseline (record it on first run)
+    python benchmark.py --save-baseline      # run and replace the baseline
+    python benchmark.py --backend ee         # same stages against Earth Engine
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from analysis import AOI_BOUNDS
+from backends import create_backend, create_time_series, index_means
+from charts import build_trend_figure, cached_trend_figure
+from fixtures import write_synthetic_fixture
+from storage import CACHE_DIR
+
+BASELINE_PATH = os.path.join(CACHE_DIR, 'benchmark_baseline.json')
+FIXTURE_DIR = os.path.join(CACHE_DIR, 'benchmark-fixture')
+
+# AOIs inside the fixture bounds: the default hotspot box, part of the lake, the whole AOI
+AOI_SIZES = {
+    'hotspot': (76.255, 9.905, 76.270, 9.915),
+    'quarter': (76.30, 9.95, 76.40, 10.05),
+    'full': tuple(AOI_BOUNDS),
+}
+COMPOSITE_MONTHS = (1, 2, 3, 4, 5, 6)
+TREND_YEARS = (1, 2, 3, 4, 5)
+
+# Differences below these are noise whatever the relative change; cached and
+# in-memory stages vary by several times between runs at a few milliseconds
+LATENCY_SLACK_S = 0.05
+MEMORY_SLACK_BYTES = 1 << 20
+
+
+def ensure_fixture(directory, years=max(TREND_YEARS)):
+    """Writes the synthetic fixture unless an up-to-date one is already there."""
+    index_path = os.path.join(directory, 'index.json')
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    if os.path.exists(index_path):
+        with open(index_path) as fh:
+            scenes = json.load(fh)['scenes']
+        first = datetime.date.fromisoformat(scenes[0]['date'])
+        last = datetime.date.fromisoformat(scenes[-1]['date'])
+        if (today - last).days < 10 and (today - first).days >= 365 * years:
+            return directory
+    print(f"Writing synthetic fixture to {directory} ...", file=sys.stderr)
+    write_synthetic_fixture(directory, years=years, today=today)
+    return directory
+
+
+def measure(backend, fn, repeat, warmup=False):
+    """
+    Median wall time, max peak traced memory and backend requests of cold fn() calls.
+    `warmup` makes one untimed call first (for one-off costs such as lazy imports).
+    """
+    latencies, peaks, requests = [], [], []
+    result = fn() if warmup else None
+    for _ in range(repeat):
+        backend.cache_clear()
+        create_time_series.cache_clear()
+        before = backend.requests.snapshot() if backend.requests else None
+        # As in timeit, keep collector pauses out of the timings
+        gc.collect()
+        gc.disable()
+        tracemalloc.start()
+        try:
+            started = time.perf_counter()
+            result = fn()
+            latencies.append(time.perf_counter() - started)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+            gc.enable()
+        if before is not None:
+            requests.append(backend.requests.since(before).requests)
+    return {
+        'latency_s': statistics.median(latencies),
+        'peak_bytes': max(peaks),
+        'requests': max(requests) if requests else None,
+    }, result
+
+
+def run_suite(backend, repeat=5, aois=AOI_SIZES):
+    """{case name: measurement} for every stage, AOI size, window and trend period."""
+    results = {}
+    for aoi_name, bounds in aois.items():
+        for months in COMPOSITE_MONTHS:
+            results[f'scenes/{aoi_name}/{months}m'], _ = measure(
+                backend, lambda: backend.count_scenes(bounds, months), repeat)
+            results[f'stats/{aoi_name}/{months}m'], _ = measure(
+                backend, lambda: backend.composite_stats(bounds, months), repeat)
+        for years in TREND_YEARS:
+            results[f'time_series/{aoi_name}/{years}y'], df = measure(
+                backend, lambda: create_time_series(backend, bounds, years), repeat)
+            results[f'trend_figure/{aoi_name}/{years}y'], _ = measure(
+                backend, lambda: build_trend_figure(index_means(df)), repeat, warmup=True)
+            results[f'trend_figure_cached/{aoi_name}/{years}y'], _ = measure(
+                backend, lambda: cached_trend_figure(index_means(df)), repeat, warmup=True)
+    return results
+
+
+def compare(results, baseline, tolerance, memory_tolerance, request_tolerance):
+    """Regression messages for results that exceed the baseline."""
+    regressions = []
+    for case, result in results.items():
+        base = baseline.get(case)
+        if base is None:
+            continue
+        if result['latency_s'] > base['latency_s'] * (1 + tolerance) + LATENCY_SLACK_S:
+            regressions.append(f"{case}: latency {result['latency_s'] * 1000:.1f} ms "
+                               f"vs baseline {base['latency_s'] * 1000:.1f} ms")
+        if result['peak_bytes'] > base['peak_bytes'] * (1 + memory_tolerance) + MEMORY_SLACK_BYTES:
+            regressions.append(f"{case}: peak memory {result['peak_bytes'] / 2**20:.1f} MiB "
+                               f"vs baseline {base['peak_bytes'] / 2**20:.1f} MiB")
+        if (result['requests'] is not None and base.get('requests') is not None
+                and result['requests'] > base['requests'] * (1 + request_tolerance)):
+            regressions.append(f"{case}: {result['requests']} requests "
+                               f"vs baseline {base['requests']}")
+    return regressions
+
+
+def print_table(results, baseline):
+    print(f"{'case':<32} {'latency':>10} {'base':>10} {'peak MiB':>9} {'requests':>9}")
+    for case, result in results.items():
+        base = baseline.get(case)
+        base_latency = f"{base['latency_s'] * 1000:.1f}ms" if base else '-'
+        requests = '-' if result['requests'] is None else result['requests']
+        print(f"{case:<32} {result['latency_s'] * 1000:>8.1f}ms {base_latency:>10} "
+              f"{result['peak_bytes'] / 2**20:>9.1f} {requests:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline stages.")
+    parser.add_argument('--backend', default='local', choices=['local', 'ee', 'ee-raster'])
+    parser.add_argument('--fixture-dir', default=FIXTURE_DIR)
+    parser.add_argument('--aoi', action='append', choices=sorted(AOI_SIZES),
+                        help="Only these AOI sizes (repeatable)")
+    parser.add_argument('--repeat', type=int, default=5, help="Cold runs per case; the median is reported")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="Allowed relative increase in latency")
+    parser.add_argument('--memory-tolerance', type=float, default=0.25,
+                        help="Allowed relative increase in peak memory")
+    parser.add_argument('--request-tolerance', type=float, default=0.1,
+                        help="Allowed relative increase in backend requests")
+    parser.add_argument('--json', help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if args.backend == 'local':
+        ensure_fixture(args.fixture_dir)
+    backend = create_backend(args.backend, fixture_dir=args.fixture_dir)
+    backend.initialize()
+    aois = {name: AOI_SIZES[name] for name in args.aoi} if args.aoi else AOI_SIZES
+    results = run_suite(backend, args.repeat, aois)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baselines = json.load(fh)
+    baseline = baselines.get(args.backend, {})
+    print_table(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(results, fh, indent=1)
+    if args.save_baseline or not baseline:
+        baselines[args.backend] = {**baseline, **results}
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as fh:
+            json.dump(baselines, fh, indent=1, sort_keys=True)
+        print(f"{'Baseline' if baseline else f'No {args.backend} baseline yet; this run'} "
+              f"saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance, args.memory_tolerance,
+                          args.request_tolerance)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Plotly figures for the Analytics tab.
+
+Kept free of Streamlit calls so figure assembly can be timed and reused outside
+the dashboard (see benchmark.py).
+"""
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.subplots import make_subplots
+
+from ee_cache import get_cache
+from metrics import record_cache_lookup
+
+# Reference thresholds (for relative comparison, not regulatory limits)
+NDCI_ELEVATED = 0.15  # Elevated algal activity
+NDCI_HIGH = 0.25      # High algal activity
+TURBIDITY_ELEVATED = 0.05  # Elevated turbidity (reflectance units)
+TURBIDITY_HIGH = 0.08      # High turbidity (reflectance units)
+
+MONSOON_MONTHS = (6, 7, 8, 9)
+
+
+def is_monsoon(month_str):
+    """True for 'YYYY-MM' labels in the south-west monsoon (June-September)."""
+    try:
+        month = int(month_str.split('-')[1])
+        return month in MONSOON_MONTHS
+    except Exception:
+        return False
+
+
+def monsoon_periods(dt_index):
+    """
+    (x0, x1) shading ranges of contiguous runs of monsoon-month points in a
+    DatetimeIndex; x1 is the end of the last month in the run.
+    """
+    dt_index = pd.DatetimeIndex(dt_index)
+    in_monsoon = np.asarray(dt_index.month.isin(MONSOON_MONTHS) & dt_index.notna(), dtype=np.int8)
+    edges = np.diff(np.concatenate(([0], in_monsoon, [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return list(zip(dt_index[starts], dt_index[ends] + pd.offsets.MonthEnd(0)))
+
+
+def _period_shapes(periods, row_axes):
+    return [
+        dict(type='rect', x0=x0, x1=x1, y0=0, y1=1, xref=xref, yref=f'{yref} domain',
+             fillcolor='lightblue', opacity=0.18, layer='below', line_width=0)
+        for xref, yref in row_axes for x0, x1 in periods
+    ]
+
+
+def _hline_shape(y, color, xref, yref):
+    return dict(type='line', x0=0, x1=1, y0=y, y1=y, xref=f'{xref} domain', yref=yref,
+                line=dict(color=color, dash='dash'))
+
+
+# Above this many points per series, traces are drawn with WebGL instead of SVG
+WEBGL_POINT_THRESHOLD = 1000
+
+
+def build_trend_figure(timeseries_df):
+    """
+    NDCI and turbidity trend chart for a series indexed by 'YYYY-MM' months or ISO
+    dates, with monsoon shading, 3-point rolling means, reference lines and a linear
+    trend. Shapes are added in one layout update, and series longer than
+    WEBGL_POINT_THRESHOLD are drawn with WebGL.
+    """
+    # Convert index to datetime for better axis scaling and shading ranges
+    dt_index = pd.to_datetime(timeseries_df.index, format='ISO8601', errors='coerce')
+    Scatter = go.Scattergl if len(timeseries_df) > WEBGL_POINT_THRESHOLD else go.Scatter
+
+    # Create interactive chart
+    fig = make_subplots(
+        rows=2, cols=1,
+        subplot_titles=(
+            'Chlorophyll Index (NDCI) - Monsoon months in light blue', 
+            'Turbidity Index (Red Band Reflectance)'
+        ),
+        vertical_spacing=0.15,
+        shared_xaxes=True
+    )
+    shapes = []
+
+    # Chlorophyll plot
+    chl_data = timeseries_df['Chlorophyll Index'].dropna()
+    if len(chl_data) > 0:
+        # Monsoon shading across contiguous ranges for both subplots
+        shapes += _period_shapes(monsoon_periods(dt_index), [('x', 'y'), ('x2', 'y2')])
+
+        # Primary series
+        x_chl = pd.to_datetime(chl_data.index, format='ISO8601', errors='coerce')
+        fig.add_trace(
+            Scatter(
+                x=x_chl, y=chl_data.values,
+                mode='lines+markers', name='NDCI',
+                line=dict(color='#2ecc71', width=3),
+                marker=dict(size=8),
+                hovertemplate='<b>%{x}</b><br>NDCI: %{y:.4f}<extra></extra>'
+            ),
+            row=1, col=1
+        )
+        # Rolling 3-month average (smoothing)
+        chl_roll = chl_data.rolling(window=3, min_periods=2).mean()
+        fig.add_trace(
+            Scatter(
+                x=x_chl, y=chl_roll.values,
+                mode='lines', name='NDCI (3-mo avg)',
+                line=dict(color='rgba(46,204,113,0.5)', width=2, dash='dot')
+            ),
+            row=1, col=1
+        )
+        # Highlight high values
+        chl_high_mask = chl_data > NDCI_HIGH
+        if chl_high_mask.any():
+            fig.add_trace(
+                Scatter(
+                    x=x_chl[chl_high_mask], y=chl_data[chl_high_mask],
+                    mode='markers', name='NDCI > High',
+                    marker=dict(size=10, color='#e74c3c', symbol='diamond')
+                ),
+                row=1, col=1
+            )
+
+        # Reference lines
+        shapes.append(_hline_shape(NDCI_ELEVATED, 'orange', 'x', 'y'))
+        shapes.append(_hline_shape(NDCI_HIGH, 'red', 'x', 'y'))
+
+        # Trend line
+        if len(chl_data) > 1:
+            z = np.polyfit(range(len(chl_data)), chl_data.values, 1)
+            p = np.poly1d(z)
+            trend_direction = "↑ Increasing" if z[0] > 0 else "↓ Decreasing"
+            fig.add_trace(
+                Scatter(
+                    x=x_chl, y=p(range(len(chl_data))),
+                    mode='lines', name=f'Trend {trend_direction}',
+                    line=dict(color='rgba(46,204,113,0.3)', width=2, dash='dash')
+                ),
+                row=1, col=1
+            )
+
+    # Turbidity plot
+    turb_data = timeseries_df['Turbidity'].dropna()
+    if len(turb_data) > 0:
+        # Primary series
+        x_turb = pd.to_datetime(turb_data.index, format='ISO8601', errors='coerce')
+        fig.add_trace(
+            Scatter(
+                x=x_turb, y=turb_data.values,
+                mode='lines+markers', name='Turbidity',
+                line=dict(color='#e74c3c', width=3),
+                marker=dict(size=8),
+                hovertemplate='<b>%{x}</b><br>Turbidity: %{y:.4f}<extra></extra>'
+            ),
+            row=2, col=1
+        )
+        # Rolling 3-month average
+        turb_roll = turb_data.rolling(window=3, min_periods=2).mean()
+        fig.add_trace(
+            Scatter(
+                x=x_turb, y=turb_roll.values,
+                mode='lines', name='Turbidity (3-mo avg)',
+                line=dict(color='rgba(231,76,60,0.5)', width=2, dash='dot')
+            ),
+            row=2, col=1
+        )
+        # Highlight high turbidity points
+        turb_high_mask = turb_data > TURBIDITY_HIGH
+        if turb_high_mask.any():
+            fig.add_trace(
+                Scatter(
+                    x=x_turb[turb_high_mask], y=turb_data[turb_high_mask],
+                    mode='markers', name='Turbidity > High',
+                    marker=dict(size=10, color='#c0392b', symbol='diamond')
+                ),
+                row=2, col=1
+            )
+
+        shapes.append(_hline_shape(TURBIDITY_ELEVATED, 'orange', 'x2', 'y2'))
+        shapes.append(_hline_shape(TURBIDITY_HIGH, 'red', 'x2', 'y2'))
+
+    fig.update_layout(
+        shapes=shapes,
+        height=700, 
+        showlegend=True, 
+        hovermode='x unified',
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        legend=dict(
+            orientation='h',
+            yanchor='top',
+            y=-0.12,
+            xanchor='center',
+            x=0.5
+        ),
+        margin=dict(t=80, r=30, b=120, l=60)
+    )
+    fig.update_xaxes(title_text="Month", row=2, col=1, tickformat='%Y-%m')
+    fig.update_yaxes(title_text="NDCI (unitless)", row=1, col=1, tickformat=".3f", title_standoff=10, ticks="outside", ticklen=6)
+    fig.update_yaxes(title_text="Red Reflectance (unitless)", row=2, col=1, tickformat=".3f", title_standoff=10, ticks="outside", ticklen=6)
+
+    return fig
+
+
+_figure_cache = get_cache('build_trend_figure', maxsize=64, namespace='charts')
+
+
+def frame_digest(df):
+    """Content hash of a DataFrame: values, index and column labels."""
+    digest = hashlib.sha256(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    digest.update(repr(list(df.columns)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cached_trend_figure(timeseries_df):
+    """
+    build_trend_figure through a process-wide cache of serialized figures keyed by
+    frame_digest(), so reruns and other sessions with the same series only load JSON.
+    """
+    key = frame_digest(timeseries_df[['Chlorophyll Index', 'Turbidity']])
+    found, figure_json = _figure_cache.get(key)
+    record_cache_lookup('build_trend_figure', found)
+    if not found:
+        figure_json = pio.to_json(build_trend_figure(timeseries_df), validate=False)
+        _figure_cache.put(key, figure_json)
+    # The JSON came from a validated figure, so it is not validated again
+    return go.Figure(json.loads(figure_json), _validate=False)
@@ -0,0 +1,372 @@
+"""
+Content-addressed caching for functions that take Earth Engine objects.
+
+Streamlit does not hash underscore-prefixed arguments, so functions receiving
+ee.Image / ee.Geometry arguments previously shared a single cache entry. Here each
+ee object is keyed on a hash of its serialized expression graph instead, and the
+cached results are kept in-process (no pickling). Every entry's size is estimated,
+and all caches together stay within MEMORY_BUDGET_BYTES by evicting the least
+recently used entries process-wide, besides each cache's own maxsize. Functions
+marked `shared` also keep their results in the SQLite SharedCache, so worker
+processes on the host compute each result once between them.
+
+Misses are single-flight: when several sessions ask for the same result at once,
+the first computes it and the others wait for its result instead of repeating the
+backend work, so a cold start costs one computation per distinct input.
+"""
+import functools
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import Future
+
+import ee
+import numpy as np
+import pandas as pd
+
+from metrics import REGISTRY, record_cache_lookup, record_coalesced
+from storage import get_shared_cache
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+# Bytes all in-process caches may hold together
+MEMORY_BUDGET_BYTES = int(os.environ.get("BACKWATER_MEMORY_CACHE_MB", "256")) * 2**20
+
+# created and last accessed (monotonic), the value, its CacheScope and estimated bytes
+_Entry = namedtuple("_Entry", ["created", "accessed", "value", "scope", "nbytes"])
+
+
+def estimate_nbytes(value, _depth=0):
+    """
+    Approximate memory held by a cached value: array and frame buffers, strings
+    and containers. Memory-mapped arrays count as free, as the page cache holds them.
+    """
+    if isinstance(value, np.memmap):
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, "sum") else usage)
+    if isinstance(value, (str, bytes, int, float, bool, type(None), ee.ComputedObject)) or _depth > 4:
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_nbytes(k, _depth + 1) + estimate_nbytes(v, _depth + 1)
+                                          for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_nbytes(item, _depth + 1) for item in value)
+    slots = getattr(type(value), "__slots__", None)
+    if slots:
+        return sys.getsizeof(value) + sum(estimate_nbytes(getattr(value, name, None), _depth + 1) for name in slots)
+    if hasattr(value, "__dict__"):
+        return sys.getsizeof(value) + estimate_nbytes(vars(value), _depth + 1)
+    return sys.getsizeof(value)
+
+
+def _update_digest(digest, value):
+    if isinstance(value, ee.ComputedObject):
+        digest.update(b"ee:")
+        digest.update(value.serialize().encode("utf-8"))
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"[")
+        for item in value:
+            _update_digest(digest, item)
+            digest.update(b",")
+        digest.update(b"]")
+    elif isinstance(value, dict):
+        digest.update(b"{")
+        for key in sorted(value, key=repr):
+            _update_digest(digest, key)
+            digest.update(b":")
+            _update_digest(digest, value[key])
+            digest.update(b",")
+        digest.update(b"}")
+    else:
+        digest.update(repr(value).encode("utf-8"))
+
+
+def fingerprint(*values):
+    """Stable hash of plain values and ee objects (by their serialized expression graph)."""
+    digest = hashlib.sha256()
+    for value in values:
+        _update_digest(digest, value)
+        digest.update(b"|")
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU mapping with optional per-entry TTL, hit/miss counters and
+    byte accounting; entries beyond `maxsize` or the process-wide memory budget
+    are evicted least recently used first.
+    """
+
+    def __init__(self, maxsize=32, ttl=None, namespace=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (True, value) on a fresh hit, (False, None) otherwise; drops an expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and (self.ttl is None or now - entry.created < self.ttl):
+                self._entries[key] = entry._replace(accessed=now)
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry.value
+            if entry is not None:
+                self.nbytes -= self._entries.pop(key).nbytes
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, scope=None):
+        """Stores `value` unless it alone exceeds the memory budget."""
+        nbytes = estimate_nbytes(value)
+        if nbytes > MEMORY_BUDGET_BYTES:
+            return
+        now = time.monotonic()
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._entries[key] = _Entry(now, now, value, scope, nbytes)
+            self.nbytes += nbytes
+            while len(self._entries) > self.maxsize:
+                self.nbytes -= self._entries.popitem(last=False)[1].nbytes
+        enforce_memory_budget()
+
+    def oldest_access(self):
+        """Last access time of the least recently used entry, or None when empty."""
+        with self._lock:
+            return next(iter(self._entries.values())).accessed if self._entries else None
+
+    def pop_oldest(self):
+        with self._lock:
+            if self._entries:
+                self.nbytes -= self._entries.popitem(last=False)[1].nbytes
+
+    def invalidate(self, invalidation):
+        """Drops the entries `invalidation` matches; returns how many."""
+        with self._lock:
+            keys = [key for key, entry in self._entries.items()
+                    if invalidation.matches(self.namespace, entry.scope)]
+            for key in keys:
+                self.nbytes -= self._entries.pop(key).nbytes
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = self.nbytes = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+
+# Streamlit re-executes the app script on every rerun, redefining each decorated
+# function; the caches live here, keyed by function name, so they survive reruns.
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_cache(name, maxsize=32, ttl=None, namespace=None):
+    """Return the process-wide cache registered under `name`, creating it on first use."""
+    with _CACHES_LOCK:
+        cache = _CACHES.get(name)
+        if cache is None:
+            cache = _CACHES[name] = LRUCache(maxsize, ttl, namespace or name)
+        return cache
+
+
+def enforce_memory_budget():
+    """Evicts the least recently used entries process-wide until all caches fit MEMORY_BUDGET_BYTES."""
+    with _CACHES_LOCK:
+        caches = list(_CACHES.values())
+    while sum(cache.nbytes for cache in caches) > MEMORY_BUDGET_BYTES:
+        candidates = [(accessed, index) for index, accessed in
+                      enumerate(cache.oldest_access() for cache in caches) if accessed is not None]
+        if not candidates:
+            break
+        caches[min(candidates)[1]].pop_oldest()
+
+
+def cache_stats():
+    """
+    Per registered cache: entries, estimated MB in memory, hits (from memory and
+    from the shared tier), misses, hit rate, and entries and MB in the shared tier.
+    """
+    with _CACHES_LOCK:
+        caches = dict(_CACHES)
+    shared = get_shared_cache().sizes() if any(name in _SHARED for name in caches) else {}
+    rows = []
+    for name, cache in sorted(caches.items()):
+        with cache._lock:
+            entries, nbytes = len(cache._entries), cache.nbytes
+            hits, shared_hits, misses = cache.hits, cache.shared_hits, cache.misses
+        lookups = hits + misses
+        shared_entries, shared_bytes = shared.get(name, (0, 0))
+        rows.append({
+            'Function': name,
+            'Entries': entries,
+            'MB': round(nbytes / 2**20, 2),
+            'Hits': hits,
+            'Shared hits': shared_hits,
+            'Misses': misses - shared_hits,
+            'Hit rate': round((hits + shared_hits) / lookups, 3) if lookups else None,
+            'Shared entries': shared_entries,
+            'Shared MB': round((shared_bytes or 0) / 2**20, 2),
+        })
+    return rows
+
+
+def _cache_gauges():
+    with _CACHES_LOCK:
+        caches = dict(_CACHES)
+    return [({'cache': name}, cache.nbytes) for name, cache in sorted(caches.items())]
+
+
+REGISTRY.register_gauge('backwater_cache_bytes', "Estimated bytes held by in-process caches.", _cache_gauges)
+
+
+def invalidate(invalidation):
+    """
+    Drops the entries of every registered cache, and of the shared tier, that
+    `invalidation` (an invalidation.Invalidation) matches. Returns {namespace:
+    entries dropped}.
+    """
+    with _CACHES_LOCK:
+        caches = list(_CACHES.values())
+    dropped = Counter()
+    for cache in caches:
+        count = cache.invalidate(invalidation)
+        if count:
+            dropped[cache.namespace] += count
+    if _SHARED:
+        dropped.update(get_shared_cache().invalidate(invalidation))
+    return dropped
+
+
+class SingleFlight:
+    """
+    In-flight deduplication by key: the first caller runs the computation, callers
+    arriving while it runs wait for it and share its result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = Counter()
+
+    def do(self, name, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced[name] += 1
+        if not leader:
+            record_coalesced(name)
+            return future.result()
+        try:
+            value = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            # fn() has stored its result by now, so later callers find it cached
+            with self._lock:
+                del self._calls[key]
+        future.set_result(value)
+        return value
+
+
+_SINGLE_FLIGHT = SingleFlight()
+
+
+def single_flight(name, key, fn):
+    """
+    fn(), unless an identical call (same `key`) is already running in this process;
+    then its result. `name` labels the coalesced count.
+    """
+    return _SINGLE_FLIGHT.do(name, key, fn)
+
+
+def coalesced_counts():
+    """{name: calls coalesced onto an in-flight computation} since process start."""
+    with _SINGLE_FLIGHT._lock:
+        return dict(_SINGLE_FLIGHT.coalesced)
+
+
+# Names of the caches with a shared tier
+_SHARED = set()
+
+
+def ee_cached(maxsize=32, ttl=None, namespace=None, scope=None, shared=False):
+    """
+    LRU cache decorator keyed on the content of every argument, including ee objects.
+
+    Entries older than `ttl` seconds are recomputed. `namespace` groups caches for
+    invalidate() (default: the function name); `scope`, called with the function's
+    arguments, returns the invalidation.CacheScope of a result. With `shared`,
+    results (which must pickle) are also kept in the SharedCache and read from it
+    on a memory miss. The wrapped function exposes `cache_info()` and
+    `cache_clear()` like functools.lru_cache. Concurrent misses for the same
+    arguments share one call (see SingleFlight).
+    """
+    def decorator(func):
+        name = func.__qualname__
+        cache = get_cache(name, maxsize, ttl, namespace)
+        if shared:
+            _SHARED.add(name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = fingerprint(name, args, kwargs)
+            found, value = cache.get(key)
+            if found:
+                record_cache_lookup(name, True)
+                return value
+
+            # Recorded once per computation; calls joining it count as coalesced
+            def compute():
+                entry_scope = scope(*args, **kwargs) if scope else None
+                if shared:
+                    found, value = get_shared_cache().get(key, max_age=ttl)
+                    if found:
+                        with cache._lock:
+                            cache.shared_hits += 1
+                        record_cache_lookup(name, True, shared=True)
+                        cache.put(key, value, entry_scope)
+                        return value
+                record_cache_lookup(name, False)
+                value = func(*args, **kwargs)
+                cache.put(key, value, entry_scope)
+                if shared:
+                    get_shared_cache().put(key, name, value, cache.namespace, entry_scope)
+                return value
+
+            return single_flight(name, key, compute)
+
+        def cache_clear():
+            cache.clear()
+            if shared:
+                get_shared_cache().clear(name)
+
+        wrapper.cache_info = cache.info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
@@ -0,0 +1,162 @@
+"""
+Bounded thread pool for independent Earth Engine requests.
+
+Each getInfo() is a full round trip to the EE backend. Submitting independent
+requests here lets them run at the same time, so a dashboard rerun costs roughly
+the slowest request instead of the sum of all of them.
+"""
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import ee
+
+from metrics import in_current_stage
+
+# Substrings of EE / transport errors worth retrying, and HTTP statuses; anything
+# else (bad band names, invalid geometries, user memory limits) fails on the first
+# attempt.
+TRANSIENT_ERROR_MARKERS = (
+    "Too many concurrent",
+    "timed out",
+    "Deadline",
+    "Service unavailable",
+    "Internal error",
+    "rate limit",
+)
+TRANSIENT_HTTP_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# EE errors of a computation too large for one request, which smaller tiles (a
+# larger tileScale) can fix, unlike a plain retry
+MEMORY_LIMIT_MARKERS = (
+    "User memory limit exceeded",
+    "Computation timed out",
+)
+
+# An HTTP status quoted in an error message: "<HttpError 503 ...", "HTTP Error 429",
+# "status 500", "status code: 502"; bare numbers elsewhere (sizes, asset IDs) are not
+_HTTP_STATUS_PATTERN = re.compile(
+    r'(?:<HttpError|\bHTTP(?: Error)?|\bstatus(?: code)?:?)\s+(\d{3})\b', re.IGNORECASE
+)
+
+
+# Seconds a request may take, including retries
+DEFAULT_TIMEOUT = 120
+
+
+def bound_ee_requests(timeout=DEFAULT_TIMEOUT):
+    """
+    Bounds every HTTP call to the Earth Engine backend so a hung attempt cannot hold
+    a worker forever. Needs an initialized client.
+    """
+    ee.data.setDeadline(int(timeout * 1000))
+
+
+def http_status(exc):
+    """
+    HTTP status behind an error, or None: the response status of a transport error
+    (googleapiclient's HttpError, requests' HTTPError) anywhere in the exception's
+    cause chain, else a status quoted in its message.
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        for response in (getattr(exc, 'resp', None), getattr(exc, 'response', None)):
+            status = getattr(response, 'status', None) or getattr(response, 'status_code', None)
+            if isinstance(status, int):
+                return status
+        match = _HTTP_STATUS_PATTERN.search(str(exc))
+        if match:
+            return int(match.group(1))
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+
+def is_transient_error(exc):
+    """True for errors a retry can plausibly fix (throttling, timeouts, 5xx)."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    if isinstance(exc, (ee.EEException, OSError)):
+        if http_status(exc) in TRANSIENT_HTTP_STATUSES:
+            return True
+        message = str(exc).lower()
+        return any(marker.lower() in message for marker in TRANSIENT_ERROR_MARKERS)
+    return False
+
+
+def is_memory_limit_error(exc):
+    """True for EE errors a reduction can avoid by running with a larger tileScale."""
+    if not isinstance(exc, ee.EEException):
+        return False
+    message = str(exc).lower()
+    return any(marker.lower() in message for marker in MEMORY_LIMIT_MARKERS)
+
+
+class EERequestExecutor:
+    """
+    Runs Earth Engine requests on a bounded pool with per-request timeouts and
+    retry with exponential backoff (plus jitter) on transient errors.
+
+    A request's timeout runs from submission. Retries stop at it, and result()
+    stops waiting at it; a call that hangs keeps its worker until the transport
+    deadline set by bound_ee_requests, but no longer blocks its caller.
+    """
+
+    def __init__(self, max_workers=4, timeout=DEFAULT_TIMEOUT, retries=3, backoff=1.0):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ee-request")
+        self._lock = threading.Lock()
+        self.retried = 0
+
+    def submit(self, fn, *args, timeout=None, **kwargs):
+        """
+        Schedules fn(*args, **kwargs), attributed to the caller's metrics stage, and
+        returns a concurrent.futures.Future with the request's monotonic `deadline`;
+        read it with result().
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        future = self._pool.submit(self._call_with_retry, deadline, in_current_stage(fn), args, kwargs)
+        future.deadline = deadline
+        return future
+
+    @staticmethod
+    def result(future):
+        """
+        The future's result, waiting no longer than its request's deadline; raises
+        TimeoutError once that has passed.
+        """
+        try:
+            return future.result(timeout=max(0.0, future.deadline - time.monotonic()))
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError("Earth Engine request did not finish before its timeout") from None
+
+    def get_info(self, computed_object, timeout=None):
+        """Future for computed_object.getInfo()."""
+        return self.submit(computed_object.getInfo, timeout=timeout)
+
+    def _call_with_retry(self, deadline, fn, args, kwargs):
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as exc:
+                if attempt >= self.retries or not is_transient_error(exc):
+                    raise
+                delay = self.backoff * (2 ** attempt) * (1 + random.random() * 0.25)
+                if time.monotonic() + delay >= deadline:
+                    raise TimeoutError(
+                        f"{getattr(fn, '__qualname__', fn)} did not succeed before its timeout"
+                    ) from exc
+                attempt += 1
+                with self._lock:
+                    self.retried += 1
+                time.sleep(delay)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,138 @@
+"""
+Synthetic Sentinel-2 fixtures for the offline LocalBackend.
+
+Writes a deterministic series of scenes (QA60 and B2-B8 as uint16 surface
+reflectance x 10000) over an elliptical lake with seasonal turbidity, algal
+blooms and random cloud cover, in the layout LocalBackend reads.
+
+    python fixtures.py .cache/fixture --years 5 --scale 100
+"""
+import argparse
+import datetime
+import json
+import os
+
+import numpy as np
+
+from analysis import AOI_BOUNDS
+from raster_engine import REFLECTANCE_SCALE, pixel_grid
+
+FIXTURE_BANDS = ['B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8']
+
+# Typical surface reflectance of turbid lake water and vegetated shore, per band
+WATER_REFLECTANCE = {'B2': 0.05, 'B3': 0.06, 'B4': 0.04, 'B6': 0.02, 'B7': 0.02, 'B8': 0.02}
+LAND_REFLECTANCE = {'B2': 0.04, 'B3': 0.08, 'B4': 0.06, 'B5': 0.12, 'B6': 0.25, 'B7': 0.30, 'B8': 0.32}
+
+MONSOON_MONTHS = (6, 7, 8, 9)
+
+
+def lake_mask(height, width):
+    """
+    Elliptical lake with a ragged shoreline and a river inlet running to the
+    south-west corner (the default hotspot area), fixed for every scene.
+    """
+    yy, xx = np.mgrid[0:height, 0:width]
+    x = xx / max(width - 1, 1) - 0.5
+    y = yy / max(height - 1, 1) - 0.5
+    shore = 1 + 0.08 * np.sin(9 * np.arctan2(y, x))
+    lake = (x / 0.32) ** 2 + (y / 0.46) ** 2 < shore
+    # Distance to the diagonal from the centre to the bottom-left corner
+    inlet = (np.abs(x + y) / np.sqrt(2) < 0.06) & (x < 0) & (y > 0)
+    return lake | inlet
+
+
+def synthetic_scene(rng, date, water, cloud_fraction):
+    """Band dict and QA60 for one acquisition."""
+    height, width = water.shape
+    season = 1.0 if date.month in MONSOON_MONTHS else 0.0
+    yy, xx = np.mgrid[0:height, 0:width]
+    gradient = yy / max(height - 1, 1)
+
+    # Turbidity rises in the monsoon and towards the southern river inlets
+    red = WATER_REFLECTANCE['B4'] * (1 + 0.8 * season + 0.6 * gradient)
+    red = red + rng.normal(0, 0.004, water.shape)
+    # NDCI peaks after the monsoon, with a bloom patch in the north-east
+    ndci = 0.05 + 0.08 * (date.month in (10, 11, 12)) + rng.normal(0, 0.02, water.shape)
+    bloom = ((xx - 0.7 * width) ** 2 + (yy - 0.25 * height) ** 2) < (0.12 * min(height, width)) ** 2
+    ndci = ndci + 0.2 * bloom * rng.random()
+    red_edge = red * (1 + ndci) / (1 - ndci)
+
+    bands = {}
+    for band in FIXTURE_BANDS:
+        land = LAND_REFLECTANCE[band] + rng.normal(0, 0.01, water.shape)
+        if band == 'B4':
+            on_water = red
+        elif band == 'B5':
+            on_water = red_edge
+        else:
+            on_water = WATER_REFLECTANCE[band] * (1 + 0.3 * season) + rng.normal(0, 0.003, water.shape)
+        bands[band] = np.where(water, on_water, land)
+
+    # Cloud blobs: bright in every band and flagged in QA60 (opaque bit 10, cirrus bit 11)
+    qa = np.zeros(water.shape, dtype=np.uint16)
+    if cloud_fraction > 0:
+        noise = rng.random((-(-height // 16), -(-width // 16)))
+        noise = np.kron(noise, np.ones((16, 16)))[:height, :width]
+        cloudy = noise < cloud_fraction
+        qa[cloudy] = 1 << 10
+        qa[cloudy & (noise < cloud_fraction / 4)] |= 1 << 11
+        for band in FIXTURE_BANDS:
+            bands[band] = np.where(cloudy, 0.35, bands[band])
+
+    encoded = {
+        band: np.clip(np.round(values * REFLECTANCE_SCALE), 1, 65535).astype(np.uint16)
+        for band, values in bands.items()
+    }
+    encoded['QA60'] = qa
+    return encoded, float(qa.astype(bool).mean() * 100)
+
+
+def write_synthetic_fixture(directory, bounds=AOI_BOUNDS, years=5, revisit_days=10, scale_m=100,
+                            seed=0, today=None):
+    """Writes `years` of synthetic scenes every `revisit_days` up to today; returns the manifest."""
+    os.makedirs(directory, exist_ok=True)
+    dimensions = pixel_grid(bounds, scale_m)['dimensions']
+    height, width = dimensions['height'], dimensions['width']
+    water = lake_mask(height, width)
+
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    date = today - datetime.timedelta(days=365 * years)
+    scenes = []
+    while date <= today:
+        rng = np.random.default_rng([seed, date.toordinal()])
+        cloud_fraction = float(rng.choice([0.0, 0.05, 0.15, 0.4, 0.8], p=[0.3, 0.25, 0.2, 0.15, 0.1]))
+        encoded, cloud_percent = synthetic_scene(rng, date, water, cloud_fraction)
+        filename = f"S2_{date:%Y%m%d}.npz"
+        np.savez_compressed(os.path.join(directory, filename), **encoded)
+        scenes.append({
+            'date': date.isoformat(),
+            'file': filename,
+            'cloudy_pixel_percentage': round(cloud_percent, 2),
+        })
+        date += datetime.timedelta(days=revisit_days)
+
+    manifest = {'bounds': list(bounds), 'shape': [height, width], 'scenes': scenes}
+    with open(os.path.join(directory, 'index.json'), 'w') as fh:
+        json.dump(manifest, fh, indent=1)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic Sentinel-2 fixture for the local backend.")
+    parser.add_argument('directory')
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--revisit-days', type=int, default=10)
+    parser.add_argument('--scale', type=float, default=100, help="Pixel size in metres")
+    parser.add_argument('--bounds', type=float, nargs=4, default=AOI_BOUNDS,
+                        metavar=('MIN_LON', 'MIN_LAT', 'MAX_LON', 'MAX_LAT'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = write_synthetic_fixture(args.directory, args.bounds, args.years, args.revisit_days,
+                                       args.scale, args.seed)
+    print(f"Wrote {len(manifest['scenes'])} scenes of {manifest['shape'][0]}x{manifest['shape'][1]} "
+          f"pixels to {args.directory}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Scoped invalidation of cached and stored results.
+
+Every cached result can carry a CacheScope: the AOI bounds it covers and the
+[start, end) date window of the imagery behind it. Refresh builds an Invalidation
+from a set of namespaces, an optional AOI and a number of recent days, and drops
+only the results it matches, so history that cannot change and other users' areas
+stay warm. Results with an unknown namespace, AOI or window are treated as matching.
+"""
+import datetime
+from collections import namedtuple
+
+# aoi: (min_lon, min_lat, max_lon, max_lat) or None; start, end: ISO dates or None
+CacheScope = namedtuple('CacheScope', ['aoi', 'start', 'end'])
+
+# Namespaces of cached results and how the dashboard labels them
+NAMESPACES = {
+    'composites': "Composites and scene counts",
+    'stats': "Composite statistics",
+    'layers': "Map layers",
+    'time_series': "Trend series",
+    'site_time_series': "Site series",
+}
+
+
+def bounds_overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+class Invalidation:
+    """
+    Which results to drop: those in `namespaces` (all when None, none when empty)
+    whose AOI overlaps `aoi` (any AOI when None) and whose window ends within the
+    last `days` days (any window when None).
+    """
+
+    def __init__(self, namespaces=None, aoi=None, days=None, today=None):
+        self.namespaces = None if namespaces is None else frozenset(namespaces)
+        self.aoi = None if aoi is None else tuple(aoi)
+        self.cutoff = None
+        if days is not None:
+            today = today or datetime.datetime.now(datetime.timezone.utc).date()
+            self.cutoff = (today - datetime.timedelta(days=days)).isoformat()
+
+    @property
+    def empty(self):
+        """True when no namespace is selected, so nothing matches."""
+        return self.namespaces is not None and not self.namespaces
+
+    def matches(self, namespace, scope):
+        if self.empty:
+            return False
+        if self.namespaces is not None and namespace is not None and namespace not in self.namespaces:
+            return False
+        if scope is None:
+            return True
+        if self.aoi is not None and scope.aoi is not None and not bounds_overlap(self.aoi, scope.aoi):
+            return False
+        # Windows are half-open: one ending on the cutoff day holds nothing newer
+        if self.cutoff is not None and scope.end is not None and scope.end <= self.cutoff:
+            return False
+        return True
+
+    def describe(self):
+        if self.empty:
+            return "nothing"
+        if self.namespaces is None or self.namespaces >= set(NAMESPACES):
+            parts = ["all results"]
+        else:
+            parts = [', '.join(NAMESPACES.get(namespace, namespace).lower() for namespace in sorted(self.namespaces))]
+        if self.aoi is not None:
+            parts.append("overlapping the analysis area")
+        if self.cutoff is not None:
+            parts.append(f"with imagery after {self.cutoff}")
+        return ' '.join(parts)
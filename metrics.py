@@ -0,0 +1,341 @@
+"""
+Request counters and per-rerun stage instrumentation.
+
+Earth Engine round trips are counted with a response hook on the requests session
+the ee client sends everything through (getInfo, computePixels, getMapId), so they
+include calls made deep inside the ee library. Scene reads of the local backend
+are counted separately.
+
+Dashboard stages run inside RerunMetrics.stage(); requests, response bytes,
+ee_cached lookups and calls coalesced onto another session's in-flight request
+made on that thread while the stage is open are attributed to it, and so is work
+the stage hands to pools through in_current_stage(). Stage totals also
+accumulate in a process-wide registry that is exported as Prometheus text
+metrics.
+"""
+import contextlib
+import functools
+import threading
+import time
+from collections import Counter, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ee
+
+RequestCount = namedtuple('RequestCount', ['requests', 'bytes'])
+
+# Stage open on the current thread, if any
+_local = threading.local()
+
+
+def current_stage():
+    return getattr(_local, 'stage', None)
+
+
+def in_current_stage(fn):
+    """
+    fn bound to the stage open on the calling thread, for work submitted to a
+    worker thread: what it does there is attributed to that stage.
+    """
+    stage = current_stage()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        previous = current_stage()
+        _local.stage = stage
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.stage = previous
+    return wrapper
+
+
+class RequestCounter:
+    """Thread-safe count of requests and response bytes for one data source."""
+
+    def __init__(self, source):
+        self.source = source
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._bytes = 0
+
+    def add(self, n_bytes=0):
+        with self._lock:
+            self._requests += 1
+            self._bytes += n_bytes
+        stage = current_stage()
+        if stage is not None:
+            stage.add_request(n_bytes)
+
+    def snapshot(self):
+        with self._lock:
+            return RequestCount(self._requests, self._bytes)
+
+    def since(self, before):
+        """Requests and bytes counted since an earlier snapshot()."""
+        now = self.snapshot()
+        return RequestCount(now.requests - before.requests, now.bytes - before.bytes)
+
+
+# Earth Engine HTTP round trips
+EE_REQUESTS = RequestCounter('ee')
+
+# Scene files read from disk by the local backend
+SCENE_READS = RequestCounter('scenes')
+
+
+def _count_ee_response(response, *args, **kwargs):
+    EE_REQUESTS.add(len(response.content or b''))
+
+
+def count_ee_requests():
+    """
+    Counts every Earth Engine HTTP response in EE_REQUESTS. Needs an initialized
+    client; safe to call again after re-initialization. The requests session is
+    private to the ee client, so without one (another client version) nothing is
+    counted.
+    """
+    session = getattr(ee.data, '_requests_session', None)
+    hooks = getattr(session, 'hooks', None)
+    if isinstance(hooks, dict) and _count_ee_response not in hooks.setdefault('response', []):
+        hooks['response'].append(_count_ee_response)
+
+
+class StageMetrics:
+    """
+    Time, backend requests and cache lookups of one stage. `seconds` is wall time on
+    the script thread; `worker_seconds` sums the stage's work on pool threads, which
+    may overlap, so it can exceed the rerun's wall time.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.worker_seconds = 0.0
+        self.requests = 0
+        self.bytes = 0
+        self.cache_hits = Counter()
+        self.cache_misses = Counter()
+        self.coalesced = Counter()
+        self._lock = threading.Lock()
+
+    def add_time(self, seconds, worker=False):
+        with self._lock:
+            if worker:
+                self.worker_seconds += seconds
+            else:
+                self.seconds += seconds
+        REGISTRY.observe_stage_time(self.name, seconds, worker)
+
+    def add_request(self, n_bytes):
+        with self._lock:
+            self.requests += 1
+            self.bytes += n_bytes
+        REGISTRY.observe_stage_request(self.name, n_bytes)
+
+    def add_cache_lookup(self, cache, hit):
+        with self._lock:
+            (self.cache_hits if hit else self.cache_misses)[cache] += 1
+
+    def add_coalesced(self, name):
+        with self._lock:
+            self.coalesced[name] += 1
+
+
+class MetricsRegistry:
+    """Process-wide totals per stage and per cache, rendered as Prometheus text."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reruns = 0
+        self.stage_seconds = Counter()
+        self.stage_runs = Counter()
+        self.stage_worker_seconds = Counter()
+        self.stage_worker_runs = Counter()
+        self.stage_requests = Counter()
+        self.stage_bytes = Counter()
+        self.cache_lookups = Counter()
+        self.coalesced = Counter()
+        self.gauges = []
+
+    def observe_rerun(self):
+        with self._lock:
+            self.reruns += 1
+
+    def observe_stage_time(self, name, seconds, worker=False):
+        with self._lock:
+            if worker:
+                self.stage_worker_seconds[name] += seconds
+                self.stage_worker_runs[name] += 1
+            else:
+                self.stage_seconds[name] += seconds
+                self.stage_runs[name] += 1
+
+    def observe_stage_request(self, name, n_bytes):
+        with self._lock:
+            self.stage_requests[name] += 1
+            self.stage_bytes[name] += n_bytes
+
+    def observe_cache_lookup(self, cache, result):
+        with self._lock:
+            self.cache_lookups[cache, result] += 1
+
+    def register_gauge(self, name, help_text, samples):
+        """Exports gauge `name`; samples() returns [(labels dict, value)] at render time."""
+        with self._lock:
+            self.gauges.append((name, help_text, samples))
+
+    def observe_coalesced(self, name):
+        with self._lock:
+            self.coalesced[name] += 1
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{name}{suffix}{{{label_text}}} {value}" if label_text
+                             else f"{name}{suffix} {value}")
+
+        with self._lock:
+            stages = sorted(self.stage_runs)
+            worker_stages = sorted(self.stage_worker_runs)
+            request_stages = sorted(self.stage_requests)
+            metric('backwater_reruns_total', 'counter', "Dashboard script reruns.",
+                   [('', {}, self.reruns)])
+            metric('backwater_stage_seconds', 'summary', "Wall time of dashboard stages on the script thread.",
+                   [('_sum', {'stage': s}, f"{self.stage_seconds[s]:.6f}") for s in stages]
+                   + [('_count', {'stage': s}, self.stage_runs[s]) for s in stages])
+            metric('backwater_stage_worker_seconds', 'summary',
+                   "Time of dashboard stage work on pool threads (overlapping runs add up).",
+                   [('_sum', {'stage': s}, f"{self.stage_worker_seconds[s]:.6f}") for s in worker_stages]
+                   + [('_count', {'stage': s}, self.stage_worker_runs[s]) for s in worker_stages])
+            metric('backwater_stage_backend_requests_total', 'counter',
+                   "Backend requests made by dashboard stages.",
+                   [('', {'stage': s}, self.stage_requests[s]) for s in request_stages])
+            metric('backwater_stage_backend_bytes_total', 'counter',
+                   "Response bytes received by dashboard stages.",
+                   [('', {'stage': s}, self.stage_bytes[s]) for s in request_stages])
+            metric('backwater_cache_lookups_total', 'counter',
+                   "Lookups in ee_cached caches (hit, shared_hit from the shared tier, miss).",
+                   [('', {'cache': cache, 'result': result}, count)
+                    for (cache, result), count in sorted(self.cache_lookups.items())])
+            metric('backwater_coalesced_requests_total', 'counter',
+                   "Calls that waited on an identical in-flight computation instead of starting one.",
+                   [('', {'function': name}, count) for name, count in sorted(self.coalesced.items())])
+            gauges = list(self.gauges)
+        for name, help_text, samples in gauges:
+            metric(name, 'gauge', help_text, [('', labels, value) for labels, value in samples()])
+        counters = [(counter.source, counter.snapshot()) for counter in (EE_REQUESTS, SCENE_READS)]
+        metric('backwater_backend_requests_total', 'counter', "Requests to backend data sources.",
+               [('', {'source': source}, count.requests) for source, count in counters])
+        metric('backwater_backend_bytes_total', 'counter', "Response bytes from backend data sources.",
+               [('', {'source': source}, count.bytes) for source, count in counters])
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def record_cache_lookup(cache, hit, shared=False):
+    """Called by ee_cached on every lookup; `shared` marks hits in the shared tier."""
+    REGISTRY.observe_cache_lookup(cache, ('shared_hit' if shared else 'hit') if hit else 'miss')
+    stage = current_stage()
+    if stage is not None:
+        stage.add_cache_lookup(cache, hit)
+
+
+def record_coalesced(name):
+    """Called by single_flight when a call joins an in-flight computation."""
+    REGISTRY.observe_coalesced(name)
+    stage = current_stage()
+    if stage is not None:
+        stage.add_coalesced(name)
+
+
+class RerunMetrics:
+    """Stages of one dashboard rerun, in the order they were first opened."""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+        REGISTRY.observe_rerun()
+
+    @contextlib.contextmanager
+    def stage(self, name, worker=False):
+        """
+        Times the block and attributes this thread's requests and cache lookups to
+        `name`; with `worker`, the time counts as the stage's pool time.
+        """
+        with self._lock:
+            stage = self.stages.setdefault(name, StageMetrics(name))
+        previous = current_stage()
+        _local.stage = stage
+        started = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            _local.stage = previous
+            stage.add_time(time.perf_counter() - started, worker)
+
+    def wrap(self, name, fn):
+        """fn run inside stage `name`, for work submitted to other threads."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.stage(name, worker=True):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def stage_rows(self):
+        return [{
+            'Stage': stage.name,
+            'Wall (ms)': round(stage.seconds * 1000, 1),
+            'Worker (ms)': round(stage.worker_seconds * 1000, 1),
+            'Requests': stage.requests,
+            'KB': round(stage.bytes / 1024, 1),
+            'Cache hits': sum(stage.cache_hits.values()),
+            'Cache misses': sum(stage.cache_misses.values()),
+        } for stage in self.stages.values()]
+
+    def cache_rows(self):
+        hits, misses, coalesced = Counter(), Counter(), Counter()
+        for stage in self.stages.values():
+            hits.update(stage.cache_hits)
+            misses.update(stage.cache_misses)
+            coalesced.update(stage.coalesced)
+        return [{'Function': cache, 'Hits': hits[cache], 'Misses': misses[cache], 'Coalesced': coalesced[cache]}
+                for cache in sorted(set(hits) | set(misses) | set(coalesced))]
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """
+    Serves REGISTRY at http://host:port/metrics on a daemon thread. Returns the
+    server, or None if the port is taken (e.g. by another worker process).
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError:
+        return None
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,260 @@
+"""
+Per-pixel trends of NDCI and turbidity over the time cube.
+
+The Analytics tab fits one line through the AOI-mean series. That shows whether
+the lake as a whole is changing, but not where. Here every pixel gets its own
+trend. The cube's clear water acquisitions are reduced to monthly medians, which
+gives a (month, y, x) stack. Slopes and their significance are then computed for
+all pixels at once with array arithmetic: loops run over months or month pairs,
+never over pixels.
+
+Two estimators, with slopes in index units per year:
+
+- 'ols': least-squares slope over the months with data, with a two-sided Student
+  t test of the slope.
+- 'sen': Theil–Sen slope (the median of the slopes between all pairs of months)
+  with the Mann–Kendall test. It is robust to outlier months such as residual
+  cloud or glint, but computes one slope per pair of months, so pixels are
+  processed in blocks.
+"""
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from raster_engine import hex_to_rgba, image_overlay
+
+TREND_METHODS = ('ols', 'sen')
+TREND_METHOD = os.environ.get('BACKWATER_TREND_METHOD', 'ols')
+
+# Band reads and per-scene values of each index, as in analysis.monthly_indices
+INDEX_BANDS = {'ndci': ['B5', 'B4'], 'turbidity': ['B4']}
+
+# Two-sided level below which a pixel's trend is drawn as significant
+SIGNIFICANCE = 0.05
+
+# Months with data a pixel needs for a trend
+MIN_MONTHS = 6
+
+# Pairwise slopes per block of the Theil–Sen estimator (16 MB of float32) and
+# blocks reduced in parallel
+SEN_BLOCK_VALUES = 2 ** 22
+TREND_WORKERS = 4
+
+# Decreasing to increasing; the middle color is never drawn at full opacity
+TREND_PALETTE = ['#2166ac', '#67a9cf', '#d1e5f0', '#f7f7f7', '#fddbc7', '#ef8a62', '#b2182b']
+
+# Opacity of pixels whose trend is not significant
+INSIGNIFICANT_ALPHA = 60
+
+
+def scene_values(cube_slice, index):
+    """(time, y, x) values of `index` per scene of a CubeSlice, NaN where not clear water."""
+    if index == 'ndci':
+        return cube_slice.normalized_difference('B5', 'B4')
+    return cube_slice.reflectance('B4')
+
+
+def sorted_median(values, count):
+    """
+    Medians along axis 0 of `values` sorted along it, with `count` finite values per
+    column; NaN sorts last, so they sit at (count - 1) // 2 and count // 2.
+    """
+    low = np.take_along_axis(values, (np.maximum(count - 1, 0) // 2)[None], axis=0)[0]
+    high = np.take_along_axis(values, np.minimum(count // 2, len(values) - 1)[None], axis=0)[0]
+    return np.where(count > 0, (low + high) / 2, np.nan)
+
+
+def monthly_stack(cube, index, months, rows=None, cols=None):
+    """
+    (month, y, x) float32 medians of `index` per calendar month ('YYYY-MM') over
+    the cube's clear water acquisitions, NaN for months without any.
+    """
+    rows = rows or slice(0, cube.height)
+    cols = cols or slice(0, cube.width)
+    stack = np.full((len(months), rows.stop - rows.start, cols.stop - cols.start), np.nan, dtype=np.float32)
+    for i, month in enumerate(months):
+        start = np.datetime64(month, 'M')
+        values = scene_values(cube.select(str(start), str(start + 1), rows, cols, INDEX_BANDS[index]), index)
+        if len(values):
+            # np.nanmedian warns once per all-NaN pixel (land, cloud all month)
+            count = np.isfinite(values).sum(axis=0)
+            values.sort(axis=0)
+            stack[i] = sorted_median(values, count)
+    return stack
+
+
+def student_t_pvalue(t, df):
+    """
+    Two-sided p-values of Student t statistics with integer degrees of freedom
+    (arrays of one shape), from the closed-form series of Abramowitz & Stegun 26.7.
+    """
+    t = np.abs(np.asarray(t, dtype=np.float64))
+    df = np.asarray(df, dtype=np.int64)
+    theta = np.arctan(t / np.sqrt(np.maximum(df, 1)))
+    sin, cos2 = np.sin(theta), np.cos(theta) ** 2
+    odd = df % 2 == 1
+    # Even df: sin θ (1 + 1/2 cos²θ + 1·3/(2·4) cos⁴θ + ...), (df - 2) / 2 terms after the first
+    # Odd df: 2/π (θ + sin θ (cos θ + 2/3 cos³θ + ...)), (df - 3) / 2 terms after the first
+    term = np.where(odd, np.sqrt(cos2), 1.0)
+    total = term.copy()
+    terms = np.where(odd, (df - 3) // 2, (df - 2) // 2)
+    for j in range(1, int(terms.max(initial=0)) + 1):
+        factor = np.where(odd, 2 * j / (2 * j + 1), (2 * j - 1) / (2 * j))
+        term = term * cos2 * factor
+        total += np.where(j <= terms, term, 0.0)
+    cdf = np.where(odd, 2 / math.pi * (theta + np.where(df > 1, sin * total, 0.0)), sin * total)
+    return np.clip(1 - cdf, 0.0, 1.0)
+
+
+def normal_pvalue(z):
+    """Two-sided p-values of standard normal statistics (erfc to 1.5e-7, A&S 7.1.26)."""
+    x = np.abs(np.asarray(z, dtype=np.float64)) / math.sqrt(2)
+    t = 1 / (1 + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    return poly * np.exp(-x * x)
+
+
+def ols_trend(values, times):
+    """
+    Least-squares slopes and t-test p-values of (time, n) `values` (NaN = missing)
+    against `times`, per column.
+    """
+    times = times - times.mean()
+    sums = {name: np.zeros(values.shape[1]) for name in ('n', 't', 'y', 'tt', 'ty', 'yy')}
+    for t, row in zip(times, values):
+        valid = np.isfinite(row)
+        y = np.where(valid, row, 0.0).astype(np.float64)
+        sums['n'] += valid
+        sums['t'] += valid * t
+        sums['y'] += y
+        sums['tt'] += valid * t * t
+        sums['ty'] += t * y
+        sums['yy'] += y * y
+    n = sums['n']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sxx = sums['tt'] - sums['t'] ** 2 / n
+        sxy = sums['ty'] - sums['t'] * sums['y'] / n
+        syy = sums['yy'] - sums['y'] ** 2 / n
+        slope = sxy / sxx
+        residual = np.maximum(syy - slope * sxy, 0.0)
+        t_stat = slope / np.sqrt(residual / (n - 2) / sxx)
+    t_stat = np.where(residual > 0, t_stat, np.inf)
+    p_value = student_t_pvalue(np.nan_to_num(t_stat, nan=0.0, posinf=1e12), np.maximum(n - 2, 1))
+    return slope, p_value
+
+
+def sen_trend(values, times):
+    """
+    Theil–Sen slopes and Mann–Kendall p-values of (time, n) `values` (NaN =
+    missing) against `times`, per column. Ties are ignored in the variance of the
+    Mann–Kendall statistic, as the values are continuous. Blocks of columns run on
+    TREND_WORKERS threads; NumPy releases the GIL while sorting.
+    """
+    first, second = np.triu_indices(len(times), k=1)
+    spans = (times[second] - times[first]).astype(np.float32)[:, None]
+    n = np.isfinite(values).sum(axis=0)
+    slope = np.full(values.shape[1], np.nan)
+    s_stat = np.zeros(values.shape[1])
+    block = max(1, SEN_BLOCK_VALUES // max(1, len(first)))
+
+    def reduce_block(start):
+        columns = values[:, start:start + block]
+        slopes = (columns[second] - columns[first]) / spans
+        s_stat[start:start + block] = (slopes > 0).sum(axis=0) - (slopes < 0).sum(axis=0)
+        slopes.sort(axis=0)
+        pairs = n[start:start + block] * (n[start:start + block] - 1) // 2
+        slope[start:start + block] = sorted_median(slopes, pairs)
+
+    with ThreadPoolExecutor(max_workers=TREND_WORKERS) as pool:
+        list(pool.map(reduce_block, range(0, values.shape[1], block)))
+    variance = n * (n - 1) * (2 * n + 5) / 18
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(variance > 0, (s_stat - np.sign(s_stat)) / np.sqrt(variance), 0.0)
+    return slope, normal_pvalue(z)
+
+
+def pixel_trends(stack, method=TREND_METHOD):
+    """
+    (slope per year, p-value, months with data) per pixel of a (month, y, x) stack
+    of consecutive months; NaN slope and p-value where fewer than MIN_MONTHS have data.
+    """
+    if method not in TREND_METHODS:
+        raise ValueError(f"Unknown trend method {method!r}; expected one of {TREND_METHODS}")
+    months, height, width = stack.shape
+    values = stack.reshape(months, -1)
+    count = np.isfinite(values).sum(axis=0)
+    # Land and persistently clouded pixels are dropped before any per-pixel work
+    keep = np.flatnonzero(count >= MIN_MONTHS)
+    slope = np.full(values.shape[1], np.nan, dtype=np.float32)
+    p_value = np.full(values.shape[1], np.nan, dtype=np.float32)
+    if keep.size:
+        estimator = sen_trend if method == 'sen' else ols_trend
+        slope[keep], p_value[keep] = estimator(values[:, keep], np.arange(months) / 12)
+    return (slope.reshape(height, width), p_value.reshape(height, width),
+            count.astype(np.int16).reshape(height, width))
+
+
+class TrendMap:
+    """
+    Per-pixel trend of one index over `bounds`: `slope` (index units per year),
+    two-sided `p_value` and `count` of months with data, as (y, x) arrays.
+    """
+
+    def __init__(self, bounds, index, method, slope, p_value, count):
+        self.bounds = tuple(bounds)
+        self.index = index
+        self.method = method
+        self.slope = slope
+        self.p_value = p_value
+        self.count = count
+
+    @classmethod
+    def from_array(cls, bounds, index, method, array):
+        """From the (3, y, x) float32 array of to_array()."""
+        return cls(bounds, index, method, array[0], array[1], array[2])
+
+    def to_array(self):
+        """(slope, p-value, count) stacked as one float32 array, for the raster cache."""
+        return np.stack([self.slope, self.p_value, self.count.astype(np.float32)])
+
+    @property
+    def significant(self):
+        with np.errstate(invalid='ignore'):
+            return self.p_value < SIGNIFICANCE
+
+    def limit(self):
+        """Color scale half-width: the 98th percentile of significant absolute slopes."""
+        slopes = np.abs(self.slope[self.significant])
+        return float(np.percentile(slopes, 98)) if slopes.size else 0.0
+
+    def summary(self):
+        """Pixels with a trend and the shares of them significantly increasing or decreasing."""
+        trended = np.isfinite(self.slope)
+        pixels = int(trended.sum())
+        significant = self.significant
+        return {
+            'pixels': pixels,
+            'increasing': float((significant & (self.slope > 0)).sum() / pixels) if pixels else 0.0,
+            'decreasing': float((significant & (self.slope < 0)).sum() / pixels) if pixels else 0.0,
+            'limit': self.limit(),
+        }
+
+    def rgba(self, palette=TREND_PALETTE, limit=None):
+        """
+        RGBA image of the slopes on a diverging palette over [-limit, limit]:
+        significant pixels opaque, others faint, pixels without a trend transparent.
+        """
+        limit = limit or self.limit() or 1.0
+        lookup = np.array([hex_to_rgba(color) for color in palette], dtype=np.uint8)
+        trended = np.isfinite(self.slope)
+        position = np.clip((np.nan_to_num(self.slope) / limit + 1) / 2, 0, 1)
+        rgba = lookup[np.rint(position * (len(palette) - 1)).astype(np.intp)]
+        rgba[..., 3] = np.where(self.significant, 255, INSIGNIFICANT_ALPHA)
+        rgba[~trended] = 0
+        return rgba
+
+    def overlay(self, name, opacity):
+        """Folium image overlay of rgba() over the trend's bounds."""
+        return image_overlay(self.rgba(), self.bounds, name, opacity)
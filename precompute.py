@@ -0,0 +1,190 @@
+"""
+Headless precompute pipeline for the dashboard.
+
+Computes scene counts, composite statistics and monthly and per-scene time series
+for the configured AOIs, windows and trend periods with the same backends and
+analysis functions as the dashboard, and writes them to the shared result store under
+BACKWATER_CACHE_DIR. The dashboard then reads them instead of waiting on the
+backend. Run it once (e.g. from cron) or keep it running with --every:
+
+    python precompute.py                                   # dashboard defaults, once
+    python precompute.py --every 60                        # every hour
+    python precompute.py --aoi lake=76.25,9.9,76.45,10.1 --months 1 3 6 --years 2 5
+    python precompute.py --sites stations.geojson --backend ee-raster
+    python precompute.py --seed-tiles                      # also map tiles, zoom 10-14
+    python precompute.py --trend-maps                      # also per-pixel trend layers
+    python precompute.py --service-account key.json        # Earth Engine as a service account
+
+Earth Engine uses the service account of --service-account (a JSON key file),
+else of BACKWATER_SERVICE_ACCOUNT, else the dashboard's [gcp_service_account] in
+.streamlit/secrets.toml, else the local `earthengine authenticate` credentials.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from analysis import AOI_BOUNDS
+from backends import (
+    INDICES, create_backend, create_site_time_series, create_time_series, get_trend_map,
+    seed_layer_tiles, stored_composite_stats, stored_scene_count, stored_scene_series, stored_site_time_series,
+    stored_time_series
+)
+from sites import parse_sites
+
+# The dashboard's default analysis area (the hotspot rectangle)
+DEFAULT_HOTSPOT_BOUNDS = (76.255, 9.905, 76.270, 9.915)
+
+
+def parse_aoi(text):
+    """'name=min_lon,min_lat,max_lon,max_lat' (or just the four numbers)."""
+    name, _, coordinates = text.rpartition('=')
+    try:
+        bounds = tuple(float(value) for value in coordinates.split(','))
+    except ValueError:
+        bounds = ()
+    if len(bounds) != 4:
+        raise argparse.ArgumentTypeError(f"expected name=min_lon,min_lat,max_lon,max_lat, got {text!r}")
+    return name or coordinates, bounds
+
+
+def load_service_account(path=None):
+    """
+    Service account info from the JSON key at `path` or BACKWATER_SERVICE_ACCOUNT,
+    else from the dashboard's secrets file, else None.
+    """
+    path = path or os.environ.get('BACKWATER_SERVICE_ACCOUNT')
+    if path:
+        with open(path, encoding='utf-8') as fh:
+            return json.load(fh)
+    secrets_path = os.path.join('.streamlit', 'secrets.toml')
+    if not os.path.exists(secrets_path):
+        return None
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11; toml comes with Streamlit
+        import toml
+        with open(secrets_path, encoding='utf-8') as fh:
+            secrets = toml.load(fh)
+    else:
+        with open(secrets_path, 'rb') as fh:
+            secrets = tomllib.load(fh)
+    info = secrets.get('gcp_service_account')
+    return dict(info) if info else None
+
+
+def _seed_tiles(backend, bounds, months_back, refresh=False):
+    # Tiles of a layer never change, so there is nothing to refresh
+    return seed_layer_tiles(backend, bounds, months_back)
+
+
+def _trend_maps(backend, bounds, years, refresh=False):
+    # Trend maps are keyed by the time cube's state, so they are refitted only when it changed
+    for index in INDICES:
+        get_trend_map(backend, bounds, index, years)
+
+
+def build_jobs(composite_aois, series_aois, months, years, sites=None, tiles=False, trends=False):
+    """(label, stage function, args) for every result the dashboard may ask for."""
+    jobs = []
+    for name, bounds in composite_aois:
+        for months_back in months:
+            jobs.append((f"scenes {name} {months_back}m", stored_scene_count, (bounds, months_back)))
+            jobs.append((f"stats {name} {months_back}m", stored_composite_stats, (bounds, months_back)))
+            if tiles:
+                jobs.append((f"tiles {name} {months_back}m", _seed_tiles, (bounds, months_back)))
+        if trends:
+            # The longest period first, so the time cube is downloaded once and the
+            # shorter periods slice it
+            for period in sorted(years, reverse=True):
+                jobs.append((f"trend maps {name} {period}y", _trend_maps, (bounds, period)))
+    for name, bounds in series_aois:
+        for period in years:
+            jobs.append((f"time series {name} {period}y", stored_time_series, (bounds, period)))
+            jobs.append((f"scene series {name} {period}y", stored_scene_series, (bounds, period)))
+    if sites:
+        for period in years:
+            jobs.append((f"site time series {len(sites)} sites {period}y", stored_site_time_series,
+                         (sites, period)))
+    return jobs
+
+
+def run_once(backend, jobs):
+    """
+    Recomputes every job and replaces its stored result; the previous result stays
+    readable until then. A failing job is reported and skipped; returns the number
+    of failures.
+    """
+    backend.cache_clear()
+    create_time_series.cache_clear()
+    create_site_time_series.cache_clear()
+
+    failures = 0
+    started = time.perf_counter()
+    for label, stage, args in jobs:
+        job_started = time.perf_counter()
+        try:
+            stage(backend, *args, refresh=True)
+        except Exception as e:
+            failures += 1
+            print(f"  FAILED {label}: {e}", file=sys.stderr, flush=True)
+            continue
+        print(f"  {label}: {time.perf_counter() - job_started:.2f} s", flush=True)
+    print(f"Precomputed {len(jobs) - failures}/{len(jobs)} results in "
+          f"{time.perf_counter() - started:.1f} s", flush=True)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute dashboard results into the shared store.")
+    parser.add_argument('--backend', choices=['ee', 'ee-raster', 'local'],
+                        help="Default: BACKWATER_BACKEND, else 'ee'")
+    parser.add_argument('--fixture-dir', help="Fixture directory for the local backend")
+    parser.add_argument('--service-account', metavar='JSON',
+                        help="Earth Engine service account key file; default: BACKWATER_SERVICE_ACCOUNT, "
+                             "else [gcp_service_account] in .streamlit/secrets.toml, else local credentials")
+    parser.add_argument('--aoi', type=parse_aoi, action='append',
+                        help="AOI for composites and time series (repeatable); "
+                             "default: the lake AOI for composites, the hotspot box for time series")
+    parser.add_argument('--months', type=int, nargs='+', default=[1, 2, 3, 4, 5, 6],
+                        help="Composite windows in months")
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 2, 3, 4, 5],
+                        help="Trend periods in years")
+    parser.add_argument('--sites', help="GeoJSON of sites to precompute site time series for")
+    parser.add_argument('--seed-tiles', action='store_true',
+                        help="Also fetch the map layers' tiles at zoom 10-14 into the tile proxy cache")
+    parser.add_argument('--trend-maps', action='store_true',
+                        help="Also build the time cubes and per-pixel trend maps of the map AOIs")
+    parser.add_argument('--every', type=float, metavar='MINUTES',
+                        help="Repeat every MINUTES instead of running once")
+    args = parser.parse_args()
+
+    if args.aoi:
+        composite_aois = series_aois = args.aoi
+    else:
+        composite_aois = [('lake', tuple(AOI_BOUNDS))]
+        series_aois = [('hotspot', DEFAULT_HOTSPOT_BOUNDS)]
+    sites = None
+    if args.sites:
+        with open(args.sites, 'rb') as fh:
+            sites = parse_sites(fh.read())
+
+    name = args.backend or os.environ.get('BACKWATER_BACKEND', 'ee')
+    service_account_info = None if name == 'local' else load_service_account(args.service_account)
+    backend = create_backend(name, service_account_info=service_account_info, fixture_dir=args.fixture_dir)
+    backend.initialize()
+    jobs = build_jobs(composite_aois, series_aois, args.months, args.years, sites, args.seed_tiles,
+                      args.trend_maps)
+
+    while True:
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} precomputing {len(jobs)} results "
+              f"with {backend!r}", flush=True)
+        failures = run_once(backend, jobs)
+        if args.every is None:
+            return 1 if failures else 0
+        time.sleep(args.every * 60)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""
+Local NumPy raster engine for the index layers.
+
+The clipped composite bands are downloaded once as arrays; water masking, the NDCI
+classes, turbidity hotspots, NIR anomalies and the summary statistics are then all
+computed locally in vectorized form and drawn as image overlays. Switching layers
+or changing opacity no longer sends anything to Earth Engine.
+"""
+import datetime
+import functools
+import math
+
+import ee
+import folium
+import numpy as np
+
+from analysis import MAX_CLOUD_PERCENT, build_composite, composite_window, mask_s2_clouds, scene_collection
+from ee_cache import ee_cached
+from invalidation import CacheScope
+from storage import get_raster_cache
+
+# Bands needed for NDWI (B3, B8), NDCI (B4, B5), turbidity (B4) and NIR anomalies (B8)
+BANDS = ['B3', 'B4', 'B5', 'B8']
+
+# Reflectance is transferred as uint16 (reflectance * 10000), 0 meaning no data
+REFLECTANCE_SCALE = 10000
+
+METERS_PER_DEGREE = 111320.0
+
+
+def pixel_grid(bounds, scale_m=20):
+    """EPSG:4326 pixel grid covering `bounds` at roughly `scale_m` metres per pixel."""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    mid_lat = math.radians((min_lat + max_lat) / 2)
+    step_x = scale_m / (METERS_PER_DEGREE * math.cos(mid_lat))
+    step_y = scale_m / METERS_PER_DEGREE
+    return {
+        'dimensions': {
+            'width': int(math.ceil((max_lon - min_lon) / step_x)),
+            'height': int(math.ceil((max_lat - min_lat) / step_y)),
+        },
+        'affineTransform': {
+            'scaleX': step_x, 'shearX': 0, 'translateX': min_lon,
+            'shearY': 0, 'scaleY': -step_y, 'translateY': max_lat,
+        },
+        'crsCode': 'EPSG:4326',
+    }
+
+
+def download_bands(image, bounds, scale_m=20):
+    """
+    Downloads the composite bands over `bounds` as a (band, y, x) uint16 array.
+
+    One computePixels request; at 20 m the Vembanad AOI is about 10 MB, well inside
+    the 48 MB per-request limit. Much larger areas need the tiled reductions instead.
+    """
+    expression = image.select(BANDS).multiply(REFLECTANCE_SCALE).round().unmask(0).toUint16()
+    pixels = ee.data.computePixels({
+        'expression': expression,
+        'fileFormat': 'NUMPY_NDARRAY',
+        'grid': pixel_grid(bounds, scale_m),
+    })
+    return np.stack([pixels[band] for band in BANDS])
+
+
+def hex_to_rgba(color, alpha=255):
+    color = color.lstrip('#')
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4)) + (alpha,)
+
+
+def image_overlay(rgba, bounds, name, opacity):
+    """Folium image overlay for an RGBA array on an EPSG:4326 grid over `bounds`."""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    return folium.raster_layers.ImageOverlay(
+        image=rgba,
+        bounds=[[min_lat, min_lon], [max_lat, max_lon]],
+        opacity=opacity,
+        name=name,
+        mercator_project=True,
+    )
+
+
+class LocalComposite:
+    """
+    Composite bands (a uint16 array, usually memory-mapped from the raster cache)
+    with the dashboard's index layers computed locally.
+    """
+
+    def __init__(self, bands, bounds):
+        self.bands = bands
+        self.bounds = tuple(bounds)
+
+    def reflectance(self, band):
+        """Float32 reflectance for one band, NaN where there is no data."""
+        data = self.bands[BANDS.index(band)].astype(np.float32)
+        data[data == 0] = np.nan
+        return data / REFLECTANCE_SCALE
+
+    @staticmethod
+    def _normalized_difference(a, b):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (a - b) / (a + b)
+
+    @functools.cached_property
+    def water_mask(self):
+        """NDWI water mask (McFeeters 1996), same thresholds as the Earth Engine path."""
+        green, nir = self.reflectance('B3'), self.reflectance('B8')
+        ndwi = self._normalized_difference(green, nir)
+        return (ndwi > 0.1) & (nir < 0.15)
+
+    @functools.cached_property
+    def ndci(self):
+        ndci = self._normalized_difference(self.reflectance('B5'), self.reflectance('B4'))
+        ndci[~self.water_mask] = np.nan
+        return ndci
+
+    @functools.cached_property
+    def turbidity(self):
+        red = self.reflectance('B4')
+        red[~self.water_mask] = np.nan
+        return red
+
+    @functools.cached_property
+    def nir(self):
+        nir = self.reflectance('B8')
+        nir[~self.water_mask] = np.nan
+        return nir
+
+    @functools.cached_property
+    def ndci_classes(self):
+        """Relative NDCI categories 1-4 (0 = not water), as in get_chlorophyll_map."""
+        ndci = np.nan_to_num(self.ndci, nan=-np.inf)
+        classes = np.digitize(ndci, [0.0, 0.1, 0.2], right=True).astype(np.uint8) + 1
+        classes[~np.isfinite(self.ndci)] = 0
+        return classes
+
+    @functools.cached_property
+    def stats(self):
+        """Same keys as calculate_water_quality_stats, computed from the local arrays."""
+        stats = {}
+        for name, values in (('ndci', self.ndci), ('turbidity', self.turbidity), ('nir', self.nir)):
+            valid = values[np.isfinite(values)]
+            stats[f'{name}_count'] = int(valid.size)
+            if valid.size == 0:
+                for key in ('mean', 'stdDev', 'min', 'max', 'p85', 'p95'):
+                    stats[f'{name}_{key}'] = None
+                continue
+            p85, p95 = np.percentile(valid, [85, 95])
+            stats.update({
+                f'{name}_mean': float(valid.mean()),
+                f'{name}_stdDev': float(valid.std()),
+                f'{name}_min': float(valid.min()),
+                f'{name}_max': float(valid.max()),
+                f'{name}_p85': float(p85),
+                f'{name}_p95': float(p95),
+            })
+        stats['water_pixels'] = stats['nir_count']
+        return stats
+
+    @functools.cached_property
+    def turbidity_hotspots(self):
+        """Top 15% red reflectance over water."""
+        threshold = self.stats['turbidity_p85']
+        if threshold is None:
+            return np.zeros(self.water_mask.shape, dtype=bool)
+        return np.nan_to_num(self.turbidity, nan=-np.inf) >= threshold
+
+    @functools.cached_property
+    def nir_anomalies(self):
+        """Top 5% NIR reflectance over water."""
+        threshold = self.stats['nir_p95']
+        if threshold is None:
+            return np.zeros(self.water_mask.shape, dtype=bool)
+        return np.nan_to_num(self.nir, nan=-np.inf) >= threshold
+
+    def geometry_mask(self, geometry):
+        """
+        Pixels whose centres fall inside a GeoJSON Polygon or MultiPolygon (even-odd
+        rule, so holes are excluded). A site smaller than one pixel gets the pixel
+        under the centre of its bounding box.
+        """
+        height, width = self.bands.shape[1:]
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        lon = min_lon + (np.arange(width) + 0.5) * (max_lon - min_lon) / width
+        lat = max_lat - (np.arange(height) + 0.5) * (max_lat - min_lat) / height
+        x, y = np.meshgrid(lon, lat)
+
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        mask = np.zeros((height, width), dtype=bool)
+        for polygon in polygons:
+            inside = np.zeros_like(mask)
+            for ring in polygon:
+                ring = np.asarray(ring, dtype=float)[:, :2]
+                for (ax, ay), (bx, by) in zip(ring, np.roll(ring, -1, axis=0)):
+                    if ay == by:
+                        continue
+                    crosses = (ay > y) != (by > y)
+                    inside ^= crosses & (x < ax + (y - ay) * (bx - ax) / (by - ay))
+            mask |= inside
+
+        if not mask.any():
+            points = np.concatenate([np.asarray(ring, dtype=float)[:, :2]
+                                     for polygon in polygons for ring in polygon])
+            centre_lon, centre_lat = (points.min(axis=0) + points.max(axis=0)) / 2
+            col = int((centre_lon - min_lon) / (max_lon - min_lon) * width)
+            row = int((max_lat - centre_lat) / (max_lat - min_lat) * height)
+            if 0 <= row < height and 0 <= col < width:
+                mask[row, col] = True
+        return mask
+
+    def region_stats(self, mask):
+        """NDCI and turbidity mean, std and pixel count over water pixels in `mask`."""
+        stats = {}
+        for name, values in (('ndci', self.ndci), ('turbidity', self.turbidity)):
+            valid = values[mask & np.isfinite(values)]
+            stats[name] = {
+                'mean': float(valid.mean()) if valid.size else None,
+                'std': float(valid.std()) if valid.size else None,
+                'pixel_count': int(valid.size),
+            }
+        return stats
+
+    def classes_rgba(self, palette):
+        """RGBA image of the NDCI classes, transparent outside water."""
+        lookup = np.array([(0, 0, 0, 0)] + [hex_to_rgba(color) for color in palette], dtype=np.uint8)
+        return lookup[self.ndci_classes]
+
+    @staticmethod
+    def mask_rgba(mask, color):
+        """RGBA image painting `mask` in a single color."""
+        rgba = np.zeros(mask.shape + (4,), dtype=np.uint8)
+        rgba[mask] = hex_to_rgba(color)
+        return rgba
+
+    def overlay(self, rgba, name, opacity):
+        """Folium image overlay for an RGBA array over this composite's bounds."""
+        return image_overlay(rgba, self.bounds, name, opacity)
+
+
+def download_scenes(bounds, start, end, scale_m=20):
+    """
+    Yields (date, bands, clear) for every cloud-filtered acquisition over `bounds` in
+    [start, end), oldest first: the BANDS as a (band, y, x) uint16 array on
+    pixel_grid(bounds, scale_m), cloud-masked with mask_s2_clouds (0 = no data), and
+    its clear-sky mask. One request lists the scenes, then one per scene.
+    """
+    collection = scene_collection(ee.Geometry.Rectangle(list(bounds)), start, end)
+    scenes = ee.Dictionary({
+        'ids': collection.aggregate_array('system:index'),
+        'times': collection.aggregate_array('system:time_start'),
+    }).getInfo()
+    for index, millis in zip(scenes['ids'], scenes['times']):
+        image = mask_s2_clouds(collection.filter(ee.Filter.eq('system:index', index)).first())
+        bands = download_bands(image, bounds, scale_m)
+        date = datetime.datetime.fromtimestamp(millis / 1000, datetime.timezone.utc).date().isoformat()
+        yield date, bands, bands.max(axis=0) > 0
+
+
+def _local_composite_scope(bounds, months_back=3, scale_m=20):
+    return CacheScope(tuple(bounds), *composite_window(months_back))
+
+
+@ee_cached(maxsize=4, ttl=3600, namespace='composites', scope=_local_composite_scope)
+def get_local_composite(bounds, months_back=3, scale_m=20):
+    """
+    The composite for `bounds` over the last `months_back` months as a LocalComposite.
+
+    Bands come from the shared on-disk raster cache when present (memory-mapped, no
+    download); otherwise the composite is downloaded once and written there.
+    """
+    start, end = composite_window(months_back)
+    cache = get_raster_cache()
+    key = cache.key(bounds, start, end, MAX_CLOUD_PERCENT, scale_m)
+    bands = cache.get(key)
+    if bands is None:
+        _, image, _ = build_composite(ee.Geometry.Rectangle(list(bounds)), months_back)
+        bands = cache.put(key, download_bands(image, bounds, scale_m))
+    return LocalComposite(bands, bounds)
@@ -0,0 +1,125 @@
+"""
+Mergeable partial statistics for reductions split over a grid of sub-regions.
+
+A single reduceRegion over a large AOI runs into Earth Engine's time and memory
+limits. Split into cells, each cell's reduction is small and the cells can run in
+parallel; the partial results then merge exactly: counts add up, means are
+weighted by count, variances are pooled (Chan et al.) and minima and maxima are
+taken over the cells. Percentiles come from the merged fixed-bin histograms, so
+they are as exact as the bin width, like Earth Engine's own percentile reducer.
+"""
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# Value range and bins of each band's histogram (reflectance for turbidity and nir)
+HISTOGRAM_RANGES = {'ndci': (-1.0, 1.0), 'turbidity': (0.0, 1.0), 'nir': (0.0, 1.0)}
+HISTOGRAM_BINS = 1000
+
+# Percentiles reported by the merged statistics, as by calculate_water_quality_stats
+PERCENTILES = (85, 95)
+
+# count, mean, m2 (sum of squared deviations from the mean), min, max and the
+# histogram counts of one band over one region
+PartialStats = namedtuple('PartialStats', ['count', 'mean', 'm2', 'min', 'max', 'histogram'])
+
+
+def grid_cells(bounds, cell_degrees):
+    """(min_lon, min_lat, max_lon, max_lat) cells of a grid covering `bounds`, row by row."""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    columns = max(1, math.ceil((max_lon - min_lon) / cell_degrees - 1e-9))
+    rows = max(1, math.ceil((max_lat - min_lat) / cell_degrees - 1e-9))
+    lons = np.linspace(min_lon, max_lon, columns + 1)
+    lats = np.linspace(min_lat, max_lat, rows + 1)
+    return [(float(lons[i]), float(lats[j]), float(lons[i + 1]), float(lats[j + 1]))
+            for j in range(rows) for i in range(columns)]
+
+
+def empty_partial(band):
+    return PartialStats(0, 0.0, 0.0, math.inf, -math.inf, np.zeros(HISTOGRAM_BINS, dtype=np.int64))
+
+
+def partial_from_values(band, values):
+    """PartialStats of a band from a NumPy array (NaN = masked)."""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return empty_partial(band)
+    histogram, _ = np.histogram(values, bins=HISTOGRAM_BINS, range=HISTOGRAM_RANGES[band])
+    mean = float(values.mean())
+    return PartialStats(int(values.size), mean, float(((values - mean) ** 2).sum()),
+                        float(values.min()), float(values.max()), histogram.astype(np.int64))
+
+
+def partial_from_properties(band, properties):
+    """
+    PartialStats of a band from Earth Engine reducer output: '<band>_mean',
+    '_stdDev' (population), '_count', '_min', '_max' and '_histogram' (fixedHistogram
+    rows of [bucket min, count]).
+    """
+    count = int(properties.get(f'{band}_count') or 0)
+    if count == 0:
+        return empty_partial(band)
+    histogram = np.array([row[1] for row in properties[f'{band}_histogram']], dtype=np.int64)
+    std = properties.get(f'{band}_stdDev') or 0.0
+    return PartialStats(count, float(properties[f'{band}_mean']), float(std) ** 2 * count,
+                        float(properties[f'{band}_min']), float(properties[f'{band}_max']), histogram)
+
+
+def merge_partials(a, b):
+    """Exact combination of two PartialStats of disjoint regions."""
+    if a.count == 0:
+        return b
+    if b.count == 0:
+        return a
+    count = a.count + b.count
+    delta = b.mean - a.mean
+    return PartialStats(
+        count,
+        a.mean + delta * b.count / count,
+        a.m2 + b.m2 + delta * delta * a.count * b.count / count,
+        min(a.min, b.min),
+        max(a.max, b.max),
+        a.histogram + b.histogram,
+    )
+
+
+def histogram_percentile(band, histogram, percentile):
+    """Percentile of the binned values, interpolated linearly within its bin."""
+    total = histogram.sum()
+    low, high = HISTOGRAM_RANGES[band]
+    width = (high - low) / len(histogram)
+    target = total * percentile / 100
+    cumulative = np.cumsum(histogram)
+    index = int(np.searchsorted(cumulative, target))
+    index = min(index, len(histogram) - 1)
+    before = cumulative[index - 1] if index else 0
+    fraction = (target - before) / histogram[index] if histogram[index] else 0.0
+    return low + (index + fraction) * width
+
+
+def merged_stats(partials):
+    """
+    {band: [PartialStats, ...]} merged into the keys of calculate_water_quality_stats:
+    '<band>_mean', '_stdDev', '_min', '_max', '_p85', '_p95', '_count'.
+    """
+    stats = {}
+    for band, band_partials in partials.items():
+        merged = empty_partial(band)
+        for partial in band_partials:
+            merged = merge_partials(merged, partial)
+        stats[f'{band}_count'] = merged.count
+        if merged.count == 0:
+            for key in ('mean', 'stdDev', 'min', 'max') + tuple(f'p{p}' for p in PERCENTILES):
+                stats[f'{band}_{key}'] = None
+            continue
+        stats.update({
+            f'{band}_mean': merged.mean,
+            f'{band}_stdDev': math.sqrt(merged.m2 / merged.count),
+            f'{band}_min': merged.min,
+            f'{band}_max': merged.max,
+        })
+        for percentile in PERCENTILES:
+            stats[f'{band}_p{percentile}'] = histogram_percentile(band, merged.histogram, percentile)
+    return stats
@@ -0,0 +1,135 @@
+"""
+Per-acquisition index statistics held as parallel NumPy arrays.
+
+A per-scene series over the lake has some 70 acquisitions a year. Rows arrive page
+by page from the backend and are packed straight into typed columns (day dates,
+float32 means, int32 pixel counts), so five years take a few kilobytes instead of
+a dict per row. Pages concatenate without copying row data, and the columns turn
+into pandas or Arrow tables at the end.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+COLUMNS = ('date', 'ndci', 'turbidity', 'valid_pixels', 'total_pixels')
+DTYPES = {
+    'date': 'datetime64[D]',
+    'ndci': np.float32,
+    'turbidity': np.float32,
+    'valid_pixels': np.int32,
+    'total_pixels': np.int32,
+}
+
+
+class SceneSeries:
+    """
+    One row per cloud-filtered acquisition: date, NDCI and turbidity means over
+    water, and the AOI's clear water and total pixel counts.
+    """
+
+    __slots__ = COLUMNS
+
+    def __init__(self, date, ndci, turbidity, valid_pixels, total_pixels):
+        for name, values in zip(COLUMNS, (date, ndci, turbidity, valid_pixels, total_pixels)):
+            setattr(self, name, np.asarray(values, dtype=DTYPES[name]))
+
+    @classmethod
+    def empty(cls):
+        return cls(*([] for _ in COLUMNS))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """From dicts with COLUMNS keys ('date' as 'YYYY-MM-DD'); None means no clear water."""
+        def column(name, missing):
+            return [missing if row.get(name) is None else row[name] for row in rows]
+        return cls(column('date', 'NaT'), column('ndci', np.nan), column('turbidity', np.nan),
+                   column('valid_pixels', 0), column('total_pixels', 0))
+
+    @classmethod
+    def concat(cls, parts):
+        parts = list(parts)
+        if not parts:
+            return cls.empty()
+        return cls(*(np.concatenate([getattr(part, name) for part in parts]) for name in COLUMNS))
+
+    def __len__(self):
+        return len(self.date)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in COLUMNS)
+
+    @property
+    def valid_fraction(self):
+        """Share of the AOI's pixels that were clear water in each acquisition."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.total_pixels > 0, self.valid_pixels / self.total_pixels, np.nan).astype(np.float32)
+
+    def daily(self):
+        """
+        Sorted by date, with acquisitions of the same day (overlapping tiles) merged:
+        means weighted by clear water pixels, counts summed up to the AOI total.
+        """
+        order = np.argsort(self.date, kind='stable')
+        date = self.date[order]
+        days, starts = np.unique(date, return_index=True)
+        if len(days) == len(date):
+            return SceneSeries(*(getattr(self, name)[order] for name in COLUMNS))
+        weights = self.valid_pixels[order].astype(np.float64)
+        valid = np.add.reduceat(self.valid_pixels[order], starts)
+        merged = {}
+        for name in ('ndci', 'turbidity'):
+            values = np.nan_to_num(getattr(self, name)[order].astype(np.float64)) * weights
+            with np.errstate(divide='ignore', invalid='ignore'):
+                merged[name] = np.add.reduceat(values, starts) / valid
+        total = np.maximum.reduceat(self.total_pixels[order], starts)
+        return SceneSeries(days, merged['ndci'], merged['turbidity'], np.minimum(valid, total), total)
+
+    def between(self, start, end):
+        """Rows dated in [start, end) (ISO dates)."""
+        keep = (self.date >= np.datetime64(start, 'D')) & (self.date < np.datetime64(end, 'D'))
+        return SceneSeries(*(getattr(self, name)[keep] for name in COLUMNS))
+
+    def to_columns(self):
+        """JSON-serializable {column: list}, for the result store."""
+        columns = {'date': np.datetime_as_string(self.date, unit='D').tolist()}
+        for name in COLUMNS[1:]:
+            values = getattr(self, name)
+            columns[name] = [None if np.isnan(v) else float(v) for v in values.tolist()] \
+                if values.dtype.kind == 'f' else values.tolist()
+        return columns
+
+    @classmethod
+    def from_columns(cls, columns):
+        return cls(*([np.nan if v is None else v for v in columns[name]] for name in COLUMNS))
+
+    def to_frame(self):
+        """DataFrame with a 'YYYY-MM-DD' date column, the means, counts and valid_fraction."""
+        return pd.DataFrame({
+            'date': np.datetime_as_string(self.date, unit='D'),
+            'ndci': self.ndci,
+            'turbidity': self.turbidity,
+            'valid_fraction': self.valid_fraction,
+            'valid_pixels': self.valid_pixels,
+            'total_pixels': self.total_pixels,
+        })
+
+    def to_arrow(self):
+        """pyarrow Table sharing the numeric columns' buffers."""
+        return pa.table({
+            'date': pa.array(self.date, type=pa.date32()),
+            'ndci': self.ndci,
+            'turbidity': self.turbidity,
+            'valid_fraction': self.valid_fraction,
+            'valid_pixels': self.valid_pixels,
+            'total_pixels': self.total_pixels,
+        })
+
+    def to_parquet(self):
+        """Parquet bytes of to_arrow()."""
+        sink = io.BytesIO()
+        pq.write_table(self.to_arrow(), sink)
+        return sink.getvalue()
@@ -0,0 +1,105 @@
+"""
+Monitoring sites uploaded as GeoJSON (stations, river mouths, sub-basins).
+
+Sites are kept as plain GeoJSON geometries so every backend can use them: Earth
+Engine reduces all of them with one reduceRegions per month, the local backend
+rasterizes them onto its monthly composites.
+"""
+import hashlib
+import json
+import math
+from collections import namedtuple
+
+Site = namedtuple('Site', ['name', 'geometry'])
+
+# Properties tried, in order, for a site's display name
+NAME_PROPERTIES = ('name', 'site', 'station', 'label', 'id')
+
+# Points are widened to squares of this half-size so a station covers a few pixels
+POINT_BUFFER_M = 60
+
+METERS_PER_DEGREE = 111320.0
+
+
+def _point_square(lon, lat, half_size_m=POINT_BUFFER_M):
+    dlat = half_size_m / METERS_PER_DEGREE
+    dlon = half_size_m / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+    ring = [[lon - dlon, lat - dlat], [lon + dlon, lat - dlat], [lon + dlon, lat + dlat],
+            [lon - dlon, lat + dlat], [lon - dlon, lat - dlat]]
+    return {'type': 'Polygon', 'coordinates': [ring]}
+
+
+def _area_geometry(geometry):
+    """Polygon or MultiPolygon for a GeoJSON geometry; points become small squares."""
+    kind = geometry.get('type')
+    coordinates = geometry.get('coordinates')
+    if kind in ('Polygon', 'MultiPolygon'):
+        return {'type': kind, 'coordinates': coordinates}
+    if kind == 'Point':
+        return _point_square(*coordinates[:2])
+    if kind == 'MultiPoint':
+        return {'type': 'MultiPolygon',
+                'coordinates': [_point_square(*point[:2])['coordinates'] for point in coordinates]}
+    raise ValueError(f"Unsupported site geometry type {kind!r}; use points or polygons")
+
+
+def parse_sites(geojson):
+    """
+    Sites from a GeoJSON FeatureCollection, Feature or geometry (text, bytes or dict).
+
+    Names come from the first of NAME_PROPERTIES present, else 'Site N'; duplicate
+    names get a numeric suffix. Raises ValueError for invalid or empty input.
+    """
+    if isinstance(geojson, (bytes, str)):
+        try:
+            geojson = json.loads(geojson)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Not valid GeoJSON: {e}") from e
+    if geojson.get('type') == 'FeatureCollection':
+        features = geojson.get('features') or []
+    elif geojson.get('type') == 'Feature':
+        features = [geojson]
+    else:
+        features = [{'type': 'Feature', 'geometry': geojson, 'properties': {}}]
+
+    sites, seen = [], set()
+    for number, feature in enumerate(features, start=1):
+        if not feature.get('geometry'):
+            continue
+        properties = feature.get('properties') or {}
+        name = next((str(properties[key]) for key in NAME_PROPERTIES if properties.get(key) is not None),
+                    f"Site {number}")
+        unique, suffix = name, 2
+        while unique in seen:
+            unique, suffix = f"{name} ({suffix})", suffix + 1
+        seen.add(unique)
+        sites.append(Site(unique, _area_geometry(feature['geometry'])))
+    if not sites:
+        raise ValueError("The GeoJSON contains no site geometries")
+    return tuple(sites)
+
+
+def _positions(geometry):
+    polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+    for polygon in polygons:
+        for ring in polygon:
+            yield from ring
+
+
+def geometry_bounds(geometry):
+    """(min_lon, min_lat, max_lon, max_lat) of a Polygon or MultiPolygon."""
+    lons, lats = zip(*((position[0], position[1]) for position in _positions(geometry)))
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def sites_bounds(sites):
+    """Bounding box of all sites."""
+    boxes = [geometry_bounds(site.geometry) for site in sites]
+    return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+            max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+
+def site_key(site):
+    """Monthly store key of a site: its geometry, so renaming keeps the history."""
+    digest = hashlib.sha256(json.dumps(site.geometry, sort_keys=True).encode('utf-8'))
+    return f"site:{digest.hexdigest()[:32]}"
@@ -0,0 +1,611 @@
+"""
+On-disk storage shared by every Streamlit session and worker process on the host.
+
+Closed calendar months never change once Sentinel-2 processing has settled, so
+their monthly statistics are written here once, as Parquet, and read back on every
+later request.
+Downloaded composites are kept as memory-mapped uint16 arrays, so every process
+reading the same composite shares one copy through the OS page cache, and map
+tiles fetched through the tile proxy are kept as PNG files. Results
+precomputed by precompute.py (scene counts, composite statistics, time series)
+are kept as JSON in a result store the dashboard reads before computing anything,
+and ee_cached results marked shared are pickled into a second SQLite cache tier.
+"""
+import contextlib
+import datetime
+import glob
+import hashlib
+import io
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute  # noqa: F401 (pa.compute)
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from invalidation import CacheScope
+
+CACHE_DIR = os.environ.get(
+    "BACKWATER_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive lock on the file at `path` (created if missing), held across processes."""
+    with open(path, "a+b") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        else:
+            fh.seek(0)
+            # Blocks (retrying for 10 s at a time) until the first byte is free
+            while True:
+                try:
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def bounds_to_key(bounds):
+    """Stable text key for an AOI given as (min_lon, min_lat, max_lon, max_lat)."""
+    return ",".join(f"{float(c):.6f}" for c in bounds)
+
+
+def aoi_key(aoi):
+    """Store key for an AOI given as bounds or as a ready-made text key (e.g. a site key)."""
+    return aoi if isinstance(aoi, str) else bounds_to_key(aoi)
+
+
+def month_labels(years, today=None):
+    """Calendar months ('YYYY-MM') covering the last `years` years, current month last."""
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    total = today.year * 12 + today.month - 1
+    labels = []
+    for offset in range(years * 12 - 1, -1, -1):
+        year, month = divmod(total - offset, 12)
+        labels.append(f"{year:04d}-{month + 1:02d}")
+    return labels
+
+
+def current_month_label(today=None):
+    """Label of the still-open calendar month."""
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    return f"{today.year:04d}-{today.month:02d}"
+
+
+class MonthlyStore:
+    """
+    Columnar store of monthly index statistics: Parquet files partitioned by AOI and
+    year (<root>/aoi=<digest>/year=<YYYY>/part.parquet) with typed columns month
+    (date32), index, mean, std and pixel_count. Reads push the month range and the
+    requested columns down to Parquet, so only the needed row groups and columns of
+    the needed year files are touched.
+    """
+
+    SCHEMA = pa.schema([
+        ('month', pa.date32()),
+        ('index', pa.string()),
+        ('mean', pa.float64()),
+        ('std', pa.float64()),
+        ('pixel_count', pa.int64()),
+    ])
+    STATS = ('mean', 'std', 'pixel_count')
+
+    def __init__(self, root=None):
+        self.root = root or os.path.join(CACHE_DIR, "timeseries")
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def aoi_dir(self, aoi):
+        digest = hashlib.sha256(aoi_key(aoi).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.root, f"aoi={digest}")
+
+    @staticmethod
+    def _month_date(month):
+        return datetime.date(int(month[:4]), int(month[5:7]), 1)
+
+    def read_table(self, aoi, start=None, end=None, columns=STATS):
+        """
+        pyarrow Table of (month, index, *columns) for months in [start, end] ('YYYY-MM',
+        inclusive, either open), sorted by month and index.
+        """
+        directory = self.aoi_dir(aoi)
+        names = ['month', 'index', *columns]
+        if not os.path.isdir(directory):
+            return self.SCHEMA.empty_table().select(names)
+        partitioning = ds.partitioning(pa.schema([('year', pa.int16())]), flavor="hive")
+        dataset = ds.dataset(directory, format="parquet", partitioning=partitioning,
+                             schema=self.SCHEMA.append(pa.field('year', pa.int16())))
+        # Year bounds prune whole partition files; month bounds prune row groups
+        condition = ds.scalar(True)
+        if start is not None:
+            condition &= (ds.field('year') >= int(start[:4])) & \
+                (ds.field('month') >= pa.scalar(self._month_date(start), pa.date32()))
+        if end is not None:
+            condition &= (ds.field('year') <= int(end[:4])) & \
+                (ds.field('month') <= pa.scalar(self._month_date(end), pa.date32()))
+        table = dataset.to_table(columns=names, filter=condition)
+        return table.sort_by([('month', 'ascending'), ('index', 'ascending')])
+
+    def load(self, aoi, months, columns=STATS):
+        """Return {month: {index: {stat: value}}} for the requested months that are stored."""
+        if not months:
+            return {}
+        table = self.read_table(aoi, min(months), max(months), columns)
+        wanted = set(months)
+        found = {}
+        for row in table.to_pylist():
+            month = row.pop('month').strftime("%Y-%m")
+            if month in wanted:
+                found.setdefault(month, {})[row.pop('index')] = row
+        return found
+
+    def save(self, aoi, monthly_stats):
+        """
+        Persist {month: {index: {stat: value}}}; None values record a month with no
+        clear data. Rewrites the touched year files atomically, each under a file lock
+        so saves from other processes to the same year are merged, not overwritten.
+        """
+        by_year = {}
+        for month, indices in monthly_stats.items():
+            for index, stats in indices.items():
+                by_year.setdefault(int(month[:4]), []).append({
+                    'month': self._month_date(month),
+                    'index': index,
+                    **{stat: stats.get(stat) for stat in self.STATS},
+                })
+        directory = self.aoi_dir(aoi)
+        with self._lock:
+            for year, rows in by_year.items():
+                partition = os.path.join(directory, f"year={year}")
+                os.makedirs(partition, exist_ok=True)
+                path = os.path.join(partition, "part.parquet")
+                table = pa.Table.from_pylist(rows, schema=self.SCHEMA)
+                # Dot-prefixed lock and temporary files are skipped by dataset reads
+                with file_lock(os.path.join(partition, ".lock")):
+                    if os.path.exists(path):
+                        existing = pq.read_table(path, schema=self.SCHEMA)
+                        replaced = pa.compute.is_in(
+                            existing['month'], value_set=pa.array(sorted({r['month'] for r in rows}), pa.date32())
+                        )
+                        table = pa.concat_tables([existing.filter(pa.compute.invert(replaced)), table])
+                    table = table.sort_by([('month', 'ascending'), ('index', 'ascending')])
+                    tmp_path = os.path.join(partition, f".part.{uuid.uuid4().hex}.tmp")
+                    pq.write_table(table, tmp_path)
+                    os.replace(tmp_path, path)
+
+
+def time_series_parquet(df):
+    """
+    Parquet bytes of a long time series frame (month 'YYYY-MM', index, mean, std,
+    pixel_count, optionally site first), typed as in MonthlyStore.SCHEMA.
+    """
+    schema = MonthlyStore.SCHEMA
+    if 'site' in df.columns:
+        schema = schema.insert(0, pa.field('site', pa.string()))
+    df = df.assign(month=[MonthlyStore._month_date(month) for month in df['month']])
+    table = pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+    sink = io.BytesIO()
+    pq.write_table(table, sink)
+    return sink.getvalue()
+
+
+_monthly_store = None
+_monthly_store_lock = threading.Lock()
+
+
+def get_monthly_store():
+    """Process-wide MonthlyStore at the default location."""
+    global _monthly_store
+    with _monthly_store_lock:
+        if _monthly_store is None:
+            _monthly_store = MonthlyStore()
+        return _monthly_store
+
+
+class ResultStore:
+    """
+    SQLite-backed store of JSON-serializable results keyed by text, with their age,
+    namespace and invalidation.CacheScope.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "results.sqlite")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    computed_at REAL NOT NULL,
+                    value TEXT NOT NULL
+                )
+            """)
+            # Stores written before scoped invalidation lack these; their rows match any scope
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(results)")}
+            for column in ("namespace", "scope"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE results ADD COLUMN {column} TEXT")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key, max_age=None):
+        """Return (True, value) if stored (and not older than `max_age` seconds), else (False, None)."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT computed_at, value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None or (max_age is not None and time.time() - row[0] > max_age):
+            return False, None
+        return True, json.loads(row[1])
+
+    def put(self, key, value, namespace=None, scope=None):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, computed_at, value, namespace, scope) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, time.time(), json.dumps(value), namespace,
+                 json.dumps(scope) if scope is not None else None)
+            )
+
+    @staticmethod
+    def _like_prefix(prefix):
+        return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+    def delete_prefix(self, prefix):
+        """Drops every result whose key starts with `prefix`; returns how many."""
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM results WHERE key LIKE ? ESCAPE '\\'", (self._like_prefix(prefix),)
+            ).rowcount
+
+    def invalidate(self, prefix, invalidation):
+        """
+        Drops the results under key `prefix` that `invalidation` (an
+        invalidation.Invalidation) matches. Returns {namespace: results dropped}.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT key, namespace, scope FROM results WHERE key LIKE ? ESCAPE '\\'",
+                (self._like_prefix(prefix),)
+            ).fetchall()
+            dropped = {}
+            for key, namespace, scope in rows:
+                scope = CacheScope(*json.loads(scope)) if scope is not None else None
+                if invalidation.matches(namespace, scope):
+                    conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                    dropped[namespace] = dropped.get(namespace, 0) + 1
+            return dropped
+
+
+_result_store = None
+_result_store_lock = threading.Lock()
+
+
+def get_result_store():
+    """Process-wide ResultStore at the default location."""
+    global _result_store
+    with _result_store_lock:
+        if _result_store is None:
+            _result_store = ResultStore()
+        return _result_store
+
+
+class SharedCache:
+    """
+    Second tier of the ee_cached caches: pickled results in SQLite, shared by every
+    worker process on the host, with the function, namespace and
+    invalidation.CacheScope of each. The least recently used entries are deleted
+    once the stored values exceed max_bytes.
+    """
+
+    # Seconds between access-time updates of one entry, to keep hits read-only
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or os.path.join(CACHE_DIR, "shared_cache.sqlite")
+        self.max_bytes = max_bytes or int(os.environ.get("BACKWATER_SHARED_CACHE_MB", "1024")) * 2**20
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    function TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    value BLOB NOT NULL,
+                    namespace TEXT,
+                    scope TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key, max_age=None):
+        """Return (True, value) if stored (and not older than `max_age` seconds), else (False, None)."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT stored_at, accessed_at, value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (max_age is not None and time.time() - row[0] > max_age):
+                return False, None
+            if time.time() - row[1] > self.TOUCH_INTERVAL:
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        try:
+            return True, pickle.loads(row[2])
+        except Exception:
+            # Written by an incompatible version of the code; recompute
+            return False, None
+
+    def put(self, key, function, value, namespace=None, scope=None):
+        """Stores `value` if it pickles; returns whether it was stored."""
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return False
+        if len(data) > self.max_bytes:
+            return False
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, function, stored_at, accessed_at, size, value, namespace, scope) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, function, now, now, len(data), data, namespace,
+                 json.dumps(scope) if scope is not None else None)
+            )
+            self._evict(conn)
+        return True
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+    def invalidate(self, invalidation):
+        """Drops the entries `invalidation` matches. Returns {namespace: entries dropped}."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT key, namespace, scope FROM entries").fetchall()
+            dropped = {}
+            for key, namespace, scope in rows:
+                scope = CacheScope(*json.loads(scope)) if scope is not None else None
+                if invalidation.matches(namespace, scope):
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    dropped[namespace] = dropped.get(namespace, 0) + 1
+            return dropped
+
+    def clear(self, function):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE function = ?", (function,))
+
+    def sizes(self):
+        """{function: (entries, bytes)}."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT function, COUNT(*), SUM(size) FROM entries GROUP BY function").fetchall()
+        return {function: (count, size) for function, count, size in rows}
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """Process-wide SharedCache at the default location."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = SharedCache()
+        return _shared_cache
+
+
+class RasterCache:
+    """
+    Size-bounded directory of composite band stacks stored as .npy files.
+
+    Arrays are opened read-only with mmap_mode, so sessions and worker processes
+    share them zero-copy. Writes go through a temporary file and an atomic rename;
+    the least recently used files are deleted once the directory exceeds max_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or os.path.join(CACHE_DIR, "rasters")
+        self.max_bytes = max_bytes or int(os.environ.get("BACKWATER_RASTER_CACHE_MB", "2048")) * 2**20
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(bounds, start, end, max_cloud, scale_m):
+        """Key for a composite of `bounds` over [start, end) with the given cloud filter."""
+        text = f"{bounds_to_key(bounds)}|{start}|{end}|{max_cloud}|{scale_m}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def get(self, key):
+        """Read-only memory map of the cached array, or None."""
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+        # mtime doubles as the LRU timestamp
+        os.utime(path)
+        return array
+
+    def put(self, key, array):
+        """Store `array` and return it re-opened as a read-only memory map."""
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as fh:
+            np.save(fh, np.ascontiguousarray(array))
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Windows refuses to replace a file another process has mapped; keep theirs
+            os.remove(tmp_path)
+        self.evict(keep=path)
+        return np.load(path, mmap_mode="r")
+
+    def evict(self, keep=None):
+        """Delete least recently used files until the cache fits within max_bytes."""
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "*.npy")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                # Processes with the file mapped keep their pages until they close it
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+_raster_cache = None
+_raster_cache_lock = threading.Lock()
+
+
+def get_raster_cache():
+    """Process-wide RasterCache at the default location."""
+    global _raster_cache
+    with _raster_cache_lock:
+        if _raster_cache is None:
+            _raster_cache = RasterCache()
+        return _raster_cache
+
+
+class TileCache:
+    """
+    Size-bounded directory of XYZ map tiles: <layer>/<z>/<x>/<y>.png, plus a
+    layer.json per layer holding what is needed to request its tiles again.
+
+    Tiles are written through a temporary file and an atomic rename, so every
+    process can serve them. File mtimes double as LRU timestamps; once the tracked
+    size exceeds max_bytes the least recently used tiles are deleted, down to
+    EVICT_TO of it so a full cache is not rescanned on every write.
+    """
+
+    EVICT_TO = 0.9
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or os.path.join(CACHE_DIR, "tiles")
+        self.max_bytes = max_bytes or int(os.environ.get("BACKWATER_TILE_CACHE_MB", "512")) * 2**20
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._bytes = sum(size for _, size, _ in self._tiles())
+
+    def _tiles(self):
+        for path in glob.glob(os.path.join(self.directory, "*", "*", "*", "*.png")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+    def _path(self, layer, z, x, y):
+        return os.path.join(self.directory, layer, str(z), str(x), f"{y}.png")
+
+    @staticmethod
+    def _write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+
+    def get_layer(self, layer):
+        """The dict stored with put_layer(), or None."""
+        try:
+            with open(os.path.join(self.directory, layer, "layer.json"), encoding="utf-8") as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return None
+
+    def put_layer(self, layer, info):
+        self._write(os.path.join(self.directory, layer, "layer.json"), json.dumps(info).encode("utf-8"))
+
+    def get(self, layer, z, x, y):
+        """PNG bytes of a cached tile, or None."""
+        path = self._path(layer, z, x, y)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return data
+
+    def put(self, layer, z, x, y, data):
+        self._write(self._path(layer, z, x, y), data)
+        with self._lock:
+            self._bytes += len(data)
+            over = self._bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used tiles until the cache fits within EVICT_TO of max_bytes."""
+        with self._lock:
+            files = sorted(self._tiles())
+            total = sum(size for _, size, _ in files)
+            for _, size, path in files:
+                if total <= self.max_bytes * self.EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+            self._bytes = total
+
+
+_tile_cache = None
+_tile_cache_lock = threading.Lock()
+
+
+def get_tile_cache():
+    """Process-wide TileCache at the default location."""
+    global _tile_cache
+    with _tile_cache_lock:
+        if _tile_cache is None:
+            _tile_cache = TileCache()
+        return _tile_cache
@@ -0,0 +1,7 @@
+"""Tests import the top-level modules of the repository and cache under a temporary directory."""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BACKWATER_CACHE_DIR', tempfile.mkdtemp(prefix='backwater-test-'))
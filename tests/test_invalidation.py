@@ -0,0 +1,61 @@
+import datetime
+
+from invalidation import CacheScope, Invalidation
+
+TODAY = datetime.date(2026, 3, 15)
+LAKE = (76.25, 9.9, 76.45, 10.1)
+SCOPE = CacheScope(LAKE, '2026-01-01', '2026-03-14')
+
+
+def test_everything_matches_by_default():
+    invalidation = Invalidation()
+    assert invalidation.matches('stats', SCOPE)
+    assert invalidation.matches(None, None)
+
+
+def test_namespace():
+    invalidation = Invalidation({'stats', 'time_series'})
+    assert invalidation.matches('stats', SCOPE)
+    assert not invalidation.matches('layers', SCOPE)
+    # Results of unknown namespace are dropped to be safe
+    assert invalidation.matches(None, SCOPE)
+
+
+def test_aoi_overlap():
+    invalidation = Invalidation(aoi=(76.40, 10.05, 76.50, 10.20))
+    assert invalidation.matches('stats', SCOPE)
+    assert not invalidation.matches('stats', SCOPE._replace(aoi=(77.0, 11.0, 77.1, 11.1)))
+    # Touching edges do not overlap
+    assert not invalidation.matches('stats', SCOPE._replace(aoi=(76.50, 10.0, 76.60, 10.1)))
+    assert invalidation.matches('stats', SCOPE._replace(aoi=None))
+
+
+def test_cutoff():
+    invalidation = Invalidation(days=7, today=TODAY)
+    assert invalidation.cutoff == '2026-03-08'
+    assert invalidation.matches('stats', SCOPE)
+    # Half-open windows ending on the cutoff day hold no newer imagery
+    assert not invalidation.matches('stats', SCOPE._replace(end='2026-03-08'))
+    assert invalidation.matches('stats', SCOPE._replace(end='2026-03-09'))
+    assert invalidation.matches('stats', SCOPE._replace(end=None))
+
+
+def test_no_namespace_matches_nothing():
+    invalidation = Invalidation(set())
+    assert invalidation.empty
+    assert not invalidation.matches('stats', SCOPE)
+    assert not invalidation.matches(None, None)
+    assert invalidation.describe() == "nothing"
+
+
+def test_describe():
+    assert Invalidation().describe() == "all results"
+    assert Invalidation({'stats'}, aoi=LAKE, days=7, today=TODAY).describe() == (
+        "composite statistics overlapping the analysis area with imagery after 2026-03-08")
+
+
+def test_all_conditions_must_hold():
+    invalidation = Invalidation({'time_series'}, aoi=LAKE, days=7, today=TODAY)
+    assert invalidation.matches('time_series', SCOPE)
+    assert not invalidation.matches('stats', SCOPE)
+    assert not invalidation.matches('time_series', SCOPE._replace(end='2026-02-01'))
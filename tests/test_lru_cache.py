@@ -0,0 +1,27 @@
+import time
+
+import numpy as np
+
+from ee_cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == (True, 1)
+    cache.put('c', 3)
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1) and cache.get('c') == (True, 3)
+
+
+def test_expired_entry_is_dropped_with_its_bytes():
+    cache = LRUCache(ttl=0.05)
+    cache.put('b', 'small')
+    small = cache.nbytes
+    cache.put('a', np.zeros(1000))
+    time.sleep(0.1)
+    assert cache.get('a') == (False, None)
+    assert cache.nbytes == small
+    assert cache.info().currsize == 1
+    assert cache.misses == 1
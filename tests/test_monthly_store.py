@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from backends import settled_months
+from storage import MonthlyStore
+
+AOI = (76.25, 9.9, 76.45, 10.1)
+
+
+def stats(mean, std=0.01, pixel_count=100):
+    return {'mean': mean, 'std': std, 'pixel_count': pixel_count}
+
+
+def test_save_load_round_trip(tmp_path):
+    store = MonthlyStore(str(tmp_path))
+    monthly = {
+        '2025-11': {'ndci': stats(0.1), 'turbidity': stats(0.05)},
+        '2025-12': {'ndci': stats(0.2), 'turbidity': stats(0.06)},
+        '2026-01': {'ndci': stats(None, None, None), 'turbidity': stats(None, None, None)},
+    }
+    store.save(AOI, monthly)
+    assert store.load(AOI, sorted(monthly)) == monthly
+    # One Parquet file per year
+    assert sorted(os.listdir(store.aoi_dir(AOI))) == ['year=2025', 'year=2026']
+
+
+def test_load_returns_only_requested_stored_months(tmp_path):
+    store = MonthlyStore(str(tmp_path))
+    store.save(AOI, {month: {'ndci': stats(0.1)} for month in ('2025-10', '2025-11', '2025-12')})
+    assert sorted(store.load(AOI, ['2025-11', '2026-01'])) == ['2025-11']
+    assert store.load((0.0, 0.0, 1.0, 1.0), ['2025-11']) == {}
+    assert store.load(AOI, []) == {}
+
+
+def test_save_replaces_months_and_keeps_others(tmp_path):
+    store = MonthlyStore(str(tmp_path))
+    store.save(AOI, {'2025-10': {'ndci': stats(0.1)}, '2025-11': {'ndci': stats(0.2)}})
+    store.save(AOI, {'2025-11': {'ndci': stats(0.3)}})
+    loaded = store.load(AOI, ['2025-10', '2025-11'])
+    assert loaded['2025-10']['ndci']['mean'] == pytest.approx(0.1)
+    assert loaded['2025-11']['ndci']['mean'] == pytest.approx(0.3)
+
+
+def test_read_table_selects_columns(tmp_path):
+    store = MonthlyStore(str(tmp_path))
+    store.save(AOI, {'2025-11': {'ndci': stats(0.1), 'turbidity': stats(0.05)}})
+    table = store.read_table(AOI, '2025-01', '2025-12', columns=('mean',))
+    assert table.column_names == ['month', 'index', 'mean']
+    assert table.num_rows == 2
+
+
+def test_settled_months():
+    monthly = {
+        # Closed more than SETTLING_DAYS before the anchor date
+        '2026-08': {'ndci': stats(0.1)},
+        # Closed 3 days before it: late scenes may still arrive
+        '2026-09': {'ndci': stats(0.2)},
+        # Still open
+        '2026-10': {'ndci': stats(0.3)},
+        # Closed but without data yet
+        '2026-07': {'ndci': stats(None, None, 0), 'turbidity': stats(None, None, 0)},
+    }
+    assert list(settled_months(monthly, '2026-10-04')) == ['2026-08']
+    assert sorted(settled_months(monthly, '2026-10-08')) == ['2026-08', '2026-09']
@@ -0,0 +1,102 @@
+import math
+
+import numpy as np
+import pytest
+
+from pixel_trends import MIN_MONTHS, TrendMap, normal_pvalue, pixel_trends, student_t_pvalue
+
+MONTHS = 36
+
+
+def trend_stack(slope_per_year=0.02, noise=0.002, seed=0):
+    """(month, y, x) stack of a linear trend plus noise, a few months missing per pixel."""
+    rng = np.random.default_rng(seed)
+    years = np.arange(MONTHS) / 12
+    stack = 0.1 + slope_per_year * years[:, None, None] + rng.normal(0, noise, (MONTHS, 3, 4))
+    stack[rng.random(stack.shape) < 0.15] = np.nan
+    # A land pixel without data and one with too few months
+    stack[:, 0, 0] = np.nan
+    stack[MIN_MONTHS - 1:, 0, 1] = np.nan
+    return stack.astype(np.float32)
+
+
+def pixel_series(stack, y, x):
+    years = np.arange(len(stack)) / 12
+    values = stack[:, y, x].astype(np.float64)
+    valid = np.isfinite(values)
+    return years[valid], values[valid]
+
+
+@pytest.mark.parametrize('t, df, expected', [
+    (1.0, 1, 0.5),                                  # Cauchy: P(|T| > 1) = 1/2
+    (2.0, 2, 1 - 2 / math.sqrt(6)),                 # closed form for two degrees of freedom
+    (2.228139, 10, 0.05),                           # two-sided 5% critical values
+    (2.042272, 30, 0.05),
+    (0.0, 5, 1.0),
+])
+def test_student_t_pvalue(t, df, expected):
+    assert float(student_t_pvalue(np.array([t]), np.array([df]))[0]) == pytest.approx(expected, abs=1e-5)
+
+
+@pytest.mark.parametrize('z', [0.0, 0.5, 1.959964, 3.0])
+def test_normal_pvalue(z):
+    assert float(normal_pvalue(z)) == pytest.approx(math.erfc(z / math.sqrt(2)), abs=2e-7)
+
+
+def test_ols_slopes_and_pvalues():
+    stack = trend_stack()
+    slope, p_value, count = pixel_trends(stack, 'ols')
+    assert np.isnan(slope[0, 0]) and np.isnan(slope[0, 1])
+    assert count[0, 1] == np.isfinite(stack[:, 0, 1]).sum()
+    for y, x in [(1, 1), (2, 3), (0, 2)]:
+        years, values = pixel_series(stack, y, x)
+        expected_slope, intercept = np.polyfit(years, values, 1)
+        residual = values - (expected_slope * years + intercept)
+        df = len(values) - 2
+        se = math.sqrt((residual ** 2).sum() / df / ((years - years.mean()) ** 2).sum())
+        expected_p = student_t_pvalue(np.array([expected_slope / se]), np.array([df]))[0]
+        assert slope[y, x] == pytest.approx(expected_slope, rel=1e-3)
+        assert p_value[y, x] == pytest.approx(expected_p, rel=1e-2, abs=1e-6)
+    finite = np.isfinite(slope)
+    assert np.all(np.abs(slope[finite] - 0.02) < 0.002)
+    assert np.all(p_value[finite] < 0.001)
+
+
+def test_sen_slopes_and_pvalues():
+    stack = trend_stack(noise=0.01)
+    stack[5, 2, 2] = 5.0  # an outlier month the Theil–Sen slope ignores
+    slope, p_value, _ = pixel_trends(stack, 'sen')
+    for y, x in [(1, 1), (2, 2), (2, 3)]:
+        years, values = pixel_series(stack, y, x)
+        first, second = np.triu_indices(len(years), k=1)
+        pair_slopes = (values[second] - values[first]) / (years[second] - years[first])
+        s_stat = np.sign(values[second] - values[first]).sum()
+        n = len(values)
+        z = (s_stat - np.sign(s_stat)) / math.sqrt(n * (n - 1) * (2 * n + 5) / 18)
+        assert slope[y, x] == pytest.approx(np.median(pair_slopes), rel=1e-4)
+        assert p_value[y, x] == pytest.approx(math.erfc(abs(z) / math.sqrt(2)), abs=1e-6)
+    assert slope[2, 2] == pytest.approx(0.02, abs=0.005)
+
+
+def test_no_trend_is_not_significant():
+    rng = np.random.default_rng(3)
+    stack = (0.1 + rng.normal(0, 0.01, (MONTHS, 20, 20))).astype(np.float32)
+    for method in ('ols', 'sen'):
+        _, p_value, _ = pixel_trends(stack, method)
+        # About 5% of pure-noise pixels fall below the 5% level
+        assert (p_value < 0.05).mean() < 0.15
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        pixel_trends(trend_stack(), 'lowess')
+
+
+def test_trend_map_array_round_trip():
+    slope, p_value, count = pixel_trends(trend_stack(), 'ols')
+    trend = TrendMap((76.0, 9.0, 76.1, 9.1), 'ndci', 'ols', slope, p_value, count)
+    restored = TrendMap.from_array(trend.bounds, 'ndci', 'ols', trend.to_array())
+    np.testing.assert_array_equal(restored.slope, slope)
+    summary = restored.summary()
+    assert summary['pixels'] == 10
+    assert summary['increasing'] == 1.0 and summary['decreasing'] == 0.0
@@ -0,0 +1,84 @@
+import math
+
+import numpy as np
+import pytest
+
+from reductions import (
+    HISTOGRAM_BINS, HISTOGRAM_RANGES, empty_partial, grid_cells, merge_partials, merged_stats,
+    partial_from_properties, partial_from_values
+)
+
+
+def sample(seed=0, size=5000):
+    rng = np.random.default_rng(seed)
+    values = np.clip(rng.normal(0.2, 0.15, size), -1, 1)
+    values[rng.random(size) < 0.1] = np.nan
+    return values
+
+
+def test_merge_partials_matches_single_pass():
+    values = sample()
+    parts = np.array_split(values, 7)
+    merged = empty_partial('ndci')
+    for part in parts:
+        merged = merge_partials(merged, partial_from_values('ndci', part))
+    finite = values[np.isfinite(values)]
+    assert merged.count == finite.size
+    assert merged.mean == pytest.approx(finite.mean(), rel=1e-12)
+    assert merged.m2 / merged.count == pytest.approx(finite.var(), rel=1e-10)
+    assert (merged.min, merged.max) == (finite.min(), finite.max())
+    np.testing.assert_array_equal(
+        merged.histogram, np.histogram(finite, bins=HISTOGRAM_BINS, range=HISTOGRAM_RANGES['ndci'])[0])
+
+
+def test_merge_with_empty_partial():
+    partial = partial_from_values('ndci', sample(size=100))
+    assert merge_partials(empty_partial('ndci'), partial) is partial
+    assert merge_partials(partial, partial_from_values('ndci', [np.nan])) is partial
+
+
+def test_merged_stats_match_numpy():
+    values = sample(seed=1)
+    cells = [partial_from_values('ndci', part) for part in np.array_split(values, 5)]
+    stats = merged_stats({'ndci': cells})
+    finite = values[np.isfinite(values)]
+    bin_width = (HISTOGRAM_RANGES['ndci'][1] - HISTOGRAM_RANGES['ndci'][0]) / HISTOGRAM_BINS
+    assert stats['ndci_count'] == finite.size
+    assert stats['ndci_mean'] == pytest.approx(finite.mean())
+    assert stats['ndci_stdDev'] == pytest.approx(finite.std())
+    assert stats['ndci_min'] == finite.min()
+    assert stats['ndci_max'] == finite.max()
+    for percentile in (85, 95):
+        assert abs(stats[f'ndci_p{percentile}'] - np.percentile(finite, percentile)) <= bin_width
+
+
+def test_merged_stats_without_data():
+    stats = merged_stats({'turbidity': [empty_partial('turbidity')]})
+    assert stats['turbidity_count'] == 0
+    assert stats['turbidity_mean'] is None and stats['turbidity_p95'] is None
+
+
+def test_partial_from_properties_matches_values():
+    values = sample(seed=2)
+    finite = values[np.isfinite(values)]
+    low, high = HISTOGRAM_RANGES['ndci']
+    histogram, edges = np.histogram(finite, bins=HISTOGRAM_BINS, range=(low, high))
+    properties = {
+        'ndci_count': finite.size, 'ndci_mean': finite.mean(), 'ndci_stdDev': finite.std(),
+        'ndci_min': finite.min(), 'ndci_max': finite.max(),
+        'ndci_histogram': [[edge, count] for edge, count in zip(edges[:-1], histogram)],
+    }
+    expected = partial_from_values('ndci', values)
+    partial = partial_from_properties('ndci', properties)
+    assert partial.count == expected.count
+    assert partial.m2 == pytest.approx(expected.m2)
+    np.testing.assert_array_equal(partial.histogram, expected.histogram)
+
+
+def test_grid_cells_cover_bounds():
+    bounds = (76.25, 9.9, 76.45, 10.1)
+    cells = grid_cells(bounds, 0.05)
+    assert len(cells) == 16
+    area = sum((cell[2] - cell[0]) * (cell[3] - cell[1]) for cell in cells)
+    assert area == pytest.approx((bounds[2] - bounds[0]) * (bounds[3] - bounds[1]))
+    assert math.isclose(min(cell[0] for cell in cells), bounds[0])
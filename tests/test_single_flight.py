@@ -0,0 +1,68 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ee_cache import SingleFlight
+
+
+def run_concurrently(flight, calls, key_of, fn):
+    """Results of `calls` flight.do() calls started together on separate threads."""
+    barrier = threading.Barrier(calls)
+
+    def call(i):
+        barrier.wait()
+        return flight.do('test', key_of(i), fn)
+
+    with ThreadPoolExecutor(max_workers=calls) as pool:
+        return list(pool.map(call, range(calls)))
+
+
+def test_identical_calls_share_one_computation():
+    flight = SingleFlight()
+    runs = []
+
+    def compute():
+        runs.append(1)
+        time.sleep(0.2)
+        return object()
+
+    results = run_concurrently(flight, 8, lambda i: 'key', compute)
+    assert len(runs) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.coalesced['test'] == 7
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    runs = []
+
+    def compute():
+        runs.append(1)
+        time.sleep(0.05)
+        return len(runs)
+
+    run_concurrently(flight, 4, lambda i: i, compute)
+    assert len(runs) == 4
+    assert flight.coalesced['test'] == 0
+
+
+def test_waiters_share_the_exception_and_the_key_is_released():
+    flight = SingleFlight()
+
+    def fail():
+        time.sleep(0.2)
+        raise ValueError('boom')
+
+    barrier = threading.Barrier(3)
+
+    def call(_):
+        barrier.wait()
+        with pytest.raises(ValueError, match='boom'):
+            flight.do('test', 'key', fail)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        list(pool.map(call, range(3)))
+    # A later call runs again rather than reusing the failure
+    assert flight.do('test', 'key', lambda: 'ok') == 'ok'
@@ -0,0 +1,101 @@
+import numpy as np
+
+from raster_engine import BANDS, REFLECTANCE_SCALE
+from time_cube import SPACE_CHUNK, TIME_CHUNK, TimeCube
+
+HEIGHT, WIDTH = 40, SPACE_CHUNK + 30
+
+
+def make_scenes(dates, seed=0):
+    """(date, data, clear) scenes with random reflectance and about a third of the pixels cloudy."""
+    rng = np.random.default_rng(seed)
+    scenes = []
+    for date in dates:
+        data = rng.integers(1, int(0.3 * REFLECTANCE_SCALE), (len(BANDS), HEIGHT, WIDTH)).astype(np.uint16)
+        clear = rng.random((HEIGHT, WIDTH)) > 0.3
+        data[:, ~clear] = 0
+        scenes.append((date, data, clear))
+    return scenes
+
+
+def daily_dates(start, count, step=5):
+    return [str(np.datetime64(start) + i * step) for i in range(count)]
+
+
+def create(directory, start='2024-01-01'):
+    return TimeCube.create(str(directory), (76.0, 9.0, 76.1, 9.1), BANDS, HEIGHT, WIDTH, start)
+
+
+def assert_holds(cube, scenes):
+    selected = cube.select()
+    assert selected.dates.astype(str).tolist() == [scene[0] for scene in scenes]
+    np.testing.assert_array_equal(selected.data, np.stack([scene[1] for scene in scenes]))
+    np.testing.assert_array_equal(selected.clear, np.stack([scene[2] for scene in scenes]))
+
+
+def test_append_select_round_trip(tmp_path):
+    scenes = make_scenes(daily_dates('2024-01-01', TIME_CHUNK + 5))
+    cube = create(tmp_path)
+    cube.append(scenes, '2024-12-01')
+    assert_holds(cube, scenes)
+    reopened = TimeCube(str(tmp_path))
+    assert reopened.end == '2024-12-01'
+    assert_holds(reopened, scenes)
+
+
+def test_select_window_and_bands(tmp_path):
+    scenes = make_scenes(daily_dates('2024-01-01', TIME_CHUNK + 5))
+    cube = create(tmp_path)
+    cube.append(scenes, '2024-12-01')
+    rows, cols = slice(5, 30), slice(SPACE_CHUNK - 10, SPACE_CHUNK + 20)
+    selected = cube.select('2024-03-01', '2024-05-01', rows, cols, ['B8', 'B3'])
+    expected = [scene for scene in scenes if '2024-03-01' <= scene[0] < '2024-05-01']
+    assert selected.bands == ['B8', 'B3']
+    band_index = [BANDS.index('B8'), BANDS.index('B3')]
+    np.testing.assert_array_equal(
+        selected.data, np.stack([scene[1][band_index, rows, cols] for scene in expected]))
+    np.testing.assert_array_equal(selected.clear, np.stack([scene[2][rows, cols] for scene in expected]))
+
+
+def test_append_continues_after_stored_scenes(tmp_path):
+    scenes = make_scenes(daily_dates('2024-01-01', 2 * TIME_CHUNK + 3))
+    cube = create(tmp_path)
+    cube.append(scenes[:TIME_CHUNK + 2], '2024-07-01')
+    # Scenes already stored are skipped
+    cube.append(scenes, '2024-12-01')
+    assert_holds(cube, scenes)
+
+
+def test_since_rescan_adds_late_scenes(tmp_path):
+    scenes = make_scenes(daily_dates('2024-01-01', TIME_CHUNK + 6))
+    late = scenes[-3]
+    cube = create(tmp_path)
+    cube.append([scene for scene in scenes[:-2] if scene is not late], scenes[-2][0])
+    assert len(cube) == len(scenes) - 3
+    cube.append(scenes[-4:], '2024-12-01', since=scenes[-4][0])
+    assert_holds(cube, scenes)
+    assert cube.end == '2024-12-01'
+
+
+def test_same_day_scenes_are_merged(tmp_path):
+    (date, first, first_clear), = make_scenes(['2024-01-01'], seed=1)
+    _, second, second_clear = make_scenes(['2024-01-01'], seed=2)[0]
+    cube = create(tmp_path)
+    cube.append([(date, first, first_clear), (date, second, second_clear)], '2024-01-05')
+    selected = cube.select()
+    assert len(cube) == 1
+    empty = ~first.any(axis=0)
+    np.testing.assert_array_equal(selected.data[0], np.where(empty, second, first))
+    np.testing.assert_array_equal(selected.clear[0], first_clear | second_clear)
+
+
+def test_prepend_matches_a_direct_build(tmp_path):
+    scenes = make_scenes(daily_dates('2024-01-01', 2 * TIME_CHUNK + 7))
+    split = TIME_CHUNK + 4
+    cube = create(tmp_path / 'extended', start=scenes[split][0])
+    cube.append(scenes[split:], '2025-06-01')
+    cube.prepend(scenes, '2024-01-01')
+    assert cube.start == '2024-01-01'
+    assert_holds(cube, scenes)
+    assert_holds(TimeCube(str(tmp_path / 'extended')), scenes)
+
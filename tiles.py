@@ -0,0 +1,170 @@
+"""
+Map tile endpoints for Earth Engine layers.
+
+geemap's addLayer asks Earth Engine for a new mapid on every call, i.e. on every
+Streamlit rerun. Tile URL templates are cached here per (layer expression, viz
+params) instead, and opacity is left to the client-side tile layer.
+
+With BACKWATER_TILE_PORT set, layers are served through a local XYZ tile proxy
+instead. Each layer is registered under a hash of its expression and viz params,
+and tiles fetched from Earth Engine are kept in the on-disk TileCache shared by
+all sessions and processes. Panning over tiles seen before then needs no Earth
+Engine request, and cached tiles keep loading after the mapid token expires; a
+missing tile is fetched with a fresh token. seed_tiles() pre-fetches zoom levels
+over an AOI (see precompute.py --seed-tiles).
+"""
+import math
+import os
+import re
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ee
+
+from ee_cache import ee_cached, fingerprint
+from metrics import EE_REQUESTS, in_current_stage
+from storage import get_tile_cache
+
+# Earth Engine tile URLs stay valid for a few hours; refresh well before that
+TILE_URL_TTL = 3600
+
+EE_ATTRIBUTION = "Google Earth Engine"
+
+# Local tile proxy port (0 disables it) and the base URL browsers reach it at
+TILE_PROXY_PORT = int(os.environ.get("BACKWATER_TILE_PORT", "0"))
+TILE_PROXY_URL = os.environ.get("BACKWATER_TILE_URL") or f"http://127.0.0.1:{TILE_PROXY_PORT}"
+
+# Zoom levels pre-fetched by seed_tiles()
+SEED_ZOOMS = range(10, 15)
+
+UPSTREAM_TIMEOUT = 30
+
+_TILE_PATH = re.compile(r'^/tiles/([0-9a-f]+)/(\d+)/(\d+)/(\d+)\.png$')
+
+
+@ee_cached(maxsize=64, ttl=TILE_URL_TTL, namespace='layers', shared=True)
+def get_tile_url(image, vis_params):
+    """XYZ tile URL template for `image` rendered with `vis_params` (one getMapId call)."""
+    map_id = ee.Image(image).getMapId(vis_params)
+    return map_id['tile_fetcher'].url_format
+
+
+def register_layer(image, vis_params):
+    """
+    Key of the proxied layer for `image` rendered with `vis_params`. The serialized
+    expression is stored with the tiles, so any process can fetch missing tiles.
+    """
+    layer = fingerprint(image, vis_params)[:32]
+    cache = get_tile_cache()
+    if cache.get_layer(layer) is None:
+        cache.put_layer(layer, {'image': ee.Image(image).serialize(), 'vis_params': vis_params})
+    return layer
+
+
+def proxy_url_format(layer):
+    return f"{TILE_PROXY_URL}/tiles/{layer}/{{z}}/{{x}}/{{y}}.png"
+
+
+def fetch_tile(layer, z, x, y):
+    """
+    PNG bytes of a proxied tile, from the tile cache or else from Earth Engine (then
+    cached). Returns None for an unknown layer.
+    """
+    cache = get_tile_cache()
+    data = cache.get(layer, z, x, y)
+    if data is not None:
+        return data
+    info = cache.get_layer(layer)
+    if info is None:
+        return None
+    image = ee.Image(ee.deserializer.fromJSON(info['image']))
+    url = get_tile_url(image, info['vis_params']).format(z=z, x=x, y=y)
+    with urllib.request.urlopen(url, timeout=UPSTREAM_TIMEOUT) as response:
+        data = response.read()
+    EE_REQUESTS.add(len(data))
+    cache.put(layer, z, x, y, data)
+    return data
+
+
+def tile_ranges(bounds, zoom):
+    """Web Mercator XYZ column and row ranges covering `bounds` at `zoom`."""
+    n = 2 ** zoom
+
+    def column(lon):
+        return min(n - 1, max(0, int((lon + 180) / 360 * n)))
+
+    def row(lat):
+        lat = math.radians(lat)
+        return min(n - 1, max(0, int((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n)))
+
+    min_lon, min_lat, max_lon, max_lat = bounds
+    return range(column(min_lon), column(max_lon) + 1), range(row(max_lat), row(min_lat) + 1)
+
+
+def seed_tiles(layer, bounds, zooms=SEED_ZOOMS, max_workers=8):
+    """Fetches every tile of `layer` over `bounds` at `zooms` into the cache; returns the tile count."""
+    tiles = [(z, x, y) for z in zooms for columns, rows in [tile_ranges(bounds, z)]
+             for x in columns for y in rows]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        list(pool.map(in_current_stage(lambda tile: fetch_tile(layer, *tile)), tiles))
+    return len(tiles)
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        match = _TILE_PATH.match(self.path.split('?')[0])
+        if match is None:
+            self.send_error(404)
+            return
+        layer, z, x, y = match.group(1), *(int(value) for value in match.groups()[1:])
+        try:
+            data = fetch_tile(layer, z, x, y)
+        except Exception:
+            self.send_error(502)
+            return
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'max-age=86400')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_tile_proxy(port=TILE_PROXY_PORT, host='127.0.0.1'):
+    """
+    Serves proxied tiles at http://host:port/tiles/<layer>/{z}/{x}/{y}.png on a daemon
+    thread. Returns the server, or None if the port is taken (e.g. by another worker
+    process, which then serves the same cache).
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _TileHandler)
+    except OSError:
+        return None
+    threading.Thread(target=server.serve_forever, name='tile-proxy', daemon=True).start()
+    return server
+
+
+def add_ee_layer(m, image, vis_params, name, shown=True, opacity=1.0):
+    """
+    Adds an Earth Engine image to a geemap Map, through the tile proxy when it is
+    enabled, else from its cached Earth Engine tile URL.
+    """
+    url = proxy_url_format(register_layer(image, vis_params)) if TILE_PROXY_PORT \
+        else get_tile_url(image, vis_params)
+    m.add_tile_layer(
+        url,
+        name=name,
+        attribution=EE_ATTRIBUTION,
+        opacity=opacity,
+        shown=shown,
+    )
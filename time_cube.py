@@ -0,0 +1,335 @@
+"""
+Per-pixel time cube of cloud-masked Sentinel-2 reflectance: time × band × y × x.
+
+Everything else in the pipeline collapses imagery to a composite or an AOI mean;
+the cube keeps every acquisition of every pixel for multi-temporal analyses.
+Reflectance is stored as uint16 (reflectance * 10000, 0 = no data) and the
+clear-sky and water masks as two bit planes packed eight pixels to a byte, so a
+scene of the four analysis bands costs 8.25 bytes per pixel.
+
+On disk a cube is a directory with cube.json (grid, bands, acquisition dates and
+the current generation of each time chunk) and .npy chunk files of TIME_CHUNK
+scenes by SPACE_CHUNK × SPACE_CHUNK pixels. Chunks are memory-mapped on first use,
+so slicing a date range and window reads only the chunks it overlaps. New scenes
+are appended at the end, and full chunks are never rewritten. A chunk that
+changes (the partial tail chunk, or every chunk when the cube is extended back in
+time) is written as a new generation of files, and the metadata naming the new
+generations is swapped in last. Readers in other processes therefore always see a
+consistent cube: the files behind the metadata they loaded stay in place until
+they are STALE_SECONDS old. Writers in several processes need an outside lock
+(see backends.get_time_cube).
+"""
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from raster_engine import REFLECTANCE_SCALE
+from storage import bounds_to_key
+
+# Scenes and pixels per chunk side
+TIME_CHUNK = 32
+SPACE_CHUNK = 256
+
+# Bit planes of the packed mask
+CLEAR, WATER = 0, 1
+
+# Seconds chunk files replaced by a newer generation are kept for readers of the
+# previous metadata
+STALE_SECONDS = 3600
+
+_CHUNK_FILE = re.compile(r'^(\d{5})_\d{3}_\d{3}\.([0-9a-f]+)\.(?:data|mask)\.npy$')
+
+
+def water_mask(data, bands):
+    """Water pixels of a (band, y, x) uint16 scene, as in analysis.monthly_indices."""
+    green = data[bands.index('B3')].astype(np.float32)
+    nir = data[bands.index('B8')].astype(np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndwi = (green - nir) / (green + nir)
+    return (ndwi > 0.1) & (nir < 0.15 * REFLECTANCE_SCALE) & (nir > 0)
+
+
+def merge_same_day(scenes):
+    """
+    (date, data, clear) scenes, oldest first, with acquisitions of the same day
+    (overlapping tiles) merged as in SceneSeries.daily(): pixels without data in the
+    earlier scene are filled from the later one, and the clear masks are ORed.
+    """
+    merged = None
+    for date, data, clear in scenes:
+        if merged is not None and date == merged[0]:
+            empty = ~merged[1].any(axis=0)
+            merged = (date, np.where(empty, data, merged[1]), merged[2] | clear)
+            continue
+        if merged is not None:
+            yield merged
+        merged = (date, data, clear)
+    if merged is not None:
+        yield merged
+
+
+def _write_npy(path, array):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as fh:
+        np.save(fh, np.ascontiguousarray(array))
+    os.replace(tmp_path, path)
+
+
+class CubeSlice:
+    """
+    Scenes of a cube over a date range and window: `dates` (datetime64[D]),
+    `data` (time, band, y, x) uint16 and the `clear` and `water` (time, y, x) masks.
+    """
+
+    def __init__(self, dates, bands, data, clear, water):
+        self.dates = dates
+        self.bands = list(bands)
+        self.data = data
+        self.clear = clear
+        self.water = water
+
+    @property
+    def valid(self):
+        """Clear-sky water pixels with data."""
+        return self.clear & self.water & (self.data.min(axis=1) > 0)
+
+    def reflectance(self, band, water_only=True):
+        """(time, y, x) float32 reflectance of `band`, NaN where not valid (or not clear)."""
+        values = self.data[:, self.bands.index(band)].astype(np.float32) / REFLECTANCE_SCALE
+        keep = self.valid if water_only else self.clear & (values > 0)
+        values[~keep] = np.nan
+        return values
+
+    def normalized_difference(self, a, b, water_only=True):
+        """(a - b) / (a + b) per pixel and scene, e.g. NDCI from ('B5', 'B4')."""
+        first, second = self.reflectance(a, water_only), self.reflectance(b, water_only)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (first - second) / (first + second)
+
+
+class TimeCube:
+    """A time cube directory; see the module docstring."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'cube.json'), encoding='utf-8') as fh:
+            meta = json.load(fh)
+        self.bounds = tuple(meta['bounds'])
+        self.bands = meta['bands']
+        self.height, self.width = meta['height'], meta['width']
+        self.start = meta['start']
+        self.end = meta['end']
+        self.dates = np.array(meta['dates'], dtype='datetime64[D]')
+        self.generations = meta['generations']
+        self._chunks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, directory, bounds, bands, height, width, start):
+        """An empty cube over `bounds` on a height × width grid, holding scenes from `start`."""
+        os.makedirs(directory, exist_ok=True)
+        cls._write_meta(directory, {
+            'bounds': list(bounds), 'bands': list(bands), 'height': height, 'width': width,
+            'start': start, 'end': start, 'dates': [], 'generations': [],
+        })
+        return cls(directory)
+
+    @staticmethod
+    def _write_meta(directory, meta):
+        path = os.path.join(directory, 'cube.json')
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(meta, fh)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def nbytes(self):
+        """Bytes of all scenes in memory form: uint16 bands plus the packed masks."""
+        per_scene = self.height * (len(self.bands) * 2 * self.width + 2 * -(-self.width // 8))
+        return len(self) * per_scene
+
+    def _chunk_path(self, ti, generation, yi, xi, kind):
+        return os.path.join(self.directory, f"{ti:05d}_{yi:03d}_{xi:03d}.{generation}.{kind}.npy")
+
+    def _chunk(self, ti, generation, yi, xi):
+        """Memory-mapped (data, packed mask) of one chunk, opened on first use."""
+        key = ti, generation, yi, xi
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is None:
+                chunk = self._chunks[key] = (np.load(self._chunk_path(*key, 'data'), mmap_mode='r'),
+                                             np.load(self._chunk_path(*key, 'mask'), mmap_mode='r'))
+            return chunk
+
+    def time_range(self, start=None, end=None):
+        """Scene indices of acquisitions in [start, end) (ISO dates, None = open)."""
+        first = 0 if start is None else int(np.searchsorted(self.dates, np.datetime64(start, 'D')))
+        last = len(self.dates) if end is None else int(np.searchsorted(self.dates, np.datetime64(end, 'D')))
+        return first, max(first, last)
+
+    def window(self, bounds):
+        """Row and column slices of the cube grid covered by `bounds`."""
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        col0 = int(np.clip(np.floor((bounds[0] - min_lon) / (max_lon - min_lon) * self.width), 0, self.width))
+        col1 = int(np.clip(np.ceil((bounds[2] - min_lon) / (max_lon - min_lon) * self.width), 0, self.width))
+        row0 = int(np.clip(np.floor((max_lat - bounds[3]) / (max_lat - min_lat) * self.height), 0, self.height))
+        row1 = int(np.clip(np.ceil((max_lat - bounds[1]) / (max_lat - min_lat) * self.height), 0, self.height))
+        return slice(row0, row1), slice(col0, col1)
+
+    def select(self, start=None, end=None, rows=None, cols=None, bands=None):
+        """
+        CubeSlice of the scenes in [start, end) over the `rows` × `cols` window (slices
+        of the grid, default all) and `bands` (default all); only overlapping chunks
+        are read.
+        """
+        return self._select(*self.time_range(start, end), rows, cols, bands)
+
+    def _select(self, t0, t1, rows=None, cols=None, bands=None):
+        rows = rows or slice(0, self.height)
+        cols = cols or slice(0, self.width)
+        band_index = [self.bands.index(band) for band in (bands or self.bands)]
+        height, width = rows.stop - rows.start, cols.stop - cols.start
+        data = np.zeros((t1 - t0, len(band_index), height, width), dtype=np.uint16)
+        masks = np.zeros((t1 - t0, 2, height, width), dtype=bool)
+        if t1 > t0 and height > 0 and width > 0:
+            for ti in range(t0 // TIME_CHUNK, (t1 - 1) // TIME_CHUNK + 1):
+                c_t0 = max(t0, ti * TIME_CHUNK)
+                c_t1 = min(t1, (ti + 1) * TIME_CHUNK)
+                for yi in range(rows.start // SPACE_CHUNK, (rows.stop - 1) // SPACE_CHUNK + 1):
+                    y0, y1 = max(rows.start, yi * SPACE_CHUNK), min(rows.stop, (yi + 1) * SPACE_CHUNK)
+                    for xi in range(cols.start // SPACE_CHUNK, (cols.stop - 1) // SPACE_CHUNK + 1):
+                        x0, x1 = max(cols.start, xi * SPACE_CHUNK), min(cols.stop, (xi + 1) * SPACE_CHUNK)
+                        chunk_data, chunk_mask = self._chunk(ti, self.generations[ti], yi, xi)
+                        chunk_width = min(SPACE_CHUNK, self.width - xi * SPACE_CHUNK)
+                        local_t = slice(c_t0 - ti * TIME_CHUNK, c_t1 - ti * TIME_CHUNK)
+                        local_y = slice(y0 - yi * SPACE_CHUNK, y1 - yi * SPACE_CHUNK)
+                        local_x = slice(x0 - xi * SPACE_CHUNK, x1 - xi * SPACE_CHUNK)
+                        out = (slice(c_t0 - t0, c_t1 - t0), slice(None),
+                               slice(y0 - rows.start, y1 - rows.start), slice(x0 - cols.start, x1 - cols.start))
+                        data[out] = chunk_data[local_t][:, band_index, local_y, local_x]
+                        unpacked = np.unpackbits(chunk_mask[local_t, :, local_y], axis=-1, count=chunk_width)
+                        masks[out] = unpacked[..., local_x].astype(bool)
+        return CubeSlice(self.dates[t0:t1], [self.bands[i] for i in band_index], data,
+                         masks[:, CLEAR], masks[:, WATER])
+
+    def _stored_scenes(self):
+        """Yields the stored (date, data, clear) scenes, oldest first, a time chunk at a time."""
+        for t0 in range(0, len(self), TIME_CHUNK):
+            stored = self._select(t0, min(len(self), t0 + TIME_CHUNK))
+            for date, data, clear in zip(stored.dates, stored.data, stored.clear):
+                yield str(date), data, clear
+
+    def append(self, scenes, end, since=None):
+        """
+        Appends (date, data, clear) scenes, `data` a (band, y, x) uint16 array on the
+        cube grid and `clear` its (y, x) clear-sky mask; the water mask is derived from
+        the bands. `end` (ISO date, exclusive) records how far the cube is complete
+        once all are written. With `since`, stored scenes dated from then on are
+        replaced by the given ones (a re-scan of a window that may have gained late
+        scenes); otherwise only scenes after the last stored one are added. Scenes of
+        one day are merged (see merge_same_day). Writes a chunk whenever one fills, so
+        an interrupted append resumes after the last one.
+        """
+        keep = len(self) if since is None else self.time_range(None, since)[1]
+        dates = np.datetime_as_string(self.dates[:keep], unit='D').tolist()
+        generations = self.generations[:-(-keep // TIME_CHUNK)]
+        # Until all are written the cube is complete only up to the re-scanned window
+        partial_end = self.end if since is None else min(since, self.end)
+        stored = dates[-1] if dates else None
+        pending = []
+        for date, data, clear in merge_same_day(scenes):
+            if (stored is not None and date <= stored) or (since is not None and date < since):
+                continue
+            pending.append((date, data, clear))
+            if (len(dates) + len(pending)) % TIME_CHUNK == 0:
+                self._write_scenes(dates, generations, pending, partial_end)
+                pending = []
+        self._write_scenes(dates, generations, pending, end)
+
+    def prepend(self, scenes, start):
+        """
+        Extends the cube back to `start` (ISO date) with (date, data, clear) scenes
+        dated before its first one, merged per day. Every chunk is rewritten, as time indices shift,
+        but from the stored scenes rather than the backend; the extended cube replaces
+        the current one in a single metadata write.
+        """
+        first = str(self.dates[0]) if len(self) else self.end
+        older = (scene for scene in merge_same_day(scenes) if start <= scene[0] < min(first, self.start))
+        dates, generations, pending = [], [], []
+        for scene in itertools.chain(older, self._stored_scenes()):
+            pending.append(scene)
+            if len(pending) == TIME_CHUNK:
+                self._write_scenes(dates, generations, pending, publish=False)
+                pending = []
+        self.start = start
+        self._write_scenes(dates, generations, pending, self.end)
+
+    def _write_scenes(self, dates, generations, scenes, end=None, publish=True):
+        """
+        Writes `scenes` into the tail chunk after `dates` (rewriting a partial one)
+        as a new generation of chunk files, and with `publish` the metadata listing
+        them. Files of earlier generations are left to readers of the previous
+        metadata and removed once stale.
+        """
+        if scenes:
+            ti, filled = divmod(len(dates), TIME_CHUNK)
+            data = np.stack([scene[1] for scene in scenes]).astype(np.uint16)
+            clear = np.stack([scene[2] for scene in scenes])
+            water = np.stack([water_mask(scene[1], self.bands) for scene in scenes])
+            masks = np.stack([clear, water], axis=1)
+            generation = uuid.uuid4().hex[:12]
+            for yi in range(-(-self.height // SPACE_CHUNK)):
+                ys = slice(yi * SPACE_CHUNK, (yi + 1) * SPACE_CHUNK)
+                for xi in range(-(-self.width // SPACE_CHUNK)):
+                    xs = slice(xi * SPACE_CHUNK, (xi + 1) * SPACE_CHUNK)
+                    chunk_data = data[:, :, ys, xs]
+                    chunk_mask = np.packbits(masks[:, :, ys, xs], axis=-1)
+                    if filled:
+                        existing_data, existing_mask = self._chunk(ti, generations[ti], yi, xi)
+                        chunk_data = np.concatenate([existing_data[:filled], chunk_data])
+                        chunk_mask = np.concatenate([existing_mask[:filled], chunk_mask])
+                    _write_npy(self._chunk_path(ti, generation, yi, xi, 'data'), chunk_data)
+                    _write_npy(self._chunk_path(ti, generation, yi, xi, 'mask'), chunk_mask)
+            generations[ti:] = [generation]
+            dates.extend(scene[0] for scene in scenes)
+        if not publish:
+            return
+        meta = {
+            'bounds': list(self.bounds), 'bands': self.bands, 'height': self.height, 'width': self.width,
+            'start': self.start, 'end': end, 'dates': dates, 'generations': generations,
+        }
+        self._write_meta(self.directory, meta)
+        self.dates = np.array(dates, dtype='datetime64[D]')
+        self.generations = list(generations)
+        self.end = end
+        self._remove_stale_chunks()
+
+    def _remove_stale_chunks(self):
+        """Deletes chunk files of generations the metadata no longer lists, once STALE_SECONDS old."""
+        current = {(ti, generation) for ti, generation in enumerate(self.generations)}
+        cutoff = time.time() - STALE_SECONDS
+        for name in os.listdir(self.directory):
+            match = _CHUNK_FILE.match(name)
+            if match is None or (int(match.group(1)), match.group(2)) in current:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def cube_key(source, bounds):
+    """Directory name of the cube of `source` (a backend repr) over `bounds`."""
+    return hashlib.sha256(f"{source}|{bounds_to_key(bounds)}".encode('utf-8')).hexdigest()[:32]